@@ -6,23 +6,25 @@ import base64
 import re # Import re for potential parsing if needed
 from langchain.schema.output_parser import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from utils.llm_cache import cached_invoke
+from utils.image_utils import prepare_image_for_vision
+from utils.image_filter import split_image_refs, reuse_analysis
+from utils.chart_classifier import classify_chart
+from utils.llm_provider import get_chat_model, lazy_resource
 # --- Configuration ---
 USE_MULTIMODAL_LLM_FOR_CHARTS = True
 DEFAULT_LANGUAGE = "English" # Fallback language
+# Skip the vision call for images the local pre-classifier confidently rejects as charts
+USE_CHART_PREFILTER = os.getenv("CHART_PREFILTER", "true").lower() not in ("0", "false", "no", "off")
+CHART_PREFILTER_MIN_CONFIDENCE = 0.55
 
-# Initialize Ollama for chart analysis (reuse image LLM if suitable)
-llm_chart = None
-if USE_MULTIMODAL_LLM_FOR_CHARTS:
-    try:
-        from langchain_ollama import ChatOllama
-        llm_chart = ChatOllama(model=os.getenv("IMAGE_ANALYZER_MODEL"), temperature=0)
-        print(f"Initialized Ollama for chart analysis ({os.getenv("IMAGE_ANALYZER_MODEL")}).")
-    except ImportError:
-        print("langchain_ollama not found. Cannot use LLM for chart analysis.")
-        USE_MULTIMODAL_LLM_FOR_CHARTS = False
-    except Exception as e:
-        print(f"Failed to initialize Ollama for charts: {e}")
-        USE_MULTIMODAL_LLM_FOR_CHARTS = False
+# Ollama for chart analysis (reuse image LLM if suitable), built on first use
+def _build_chart_llm():
+    llm = get_chat_model(os.getenv("IMAGE_ANALYZER_MODEL"), temperature=0)
+    print(f"Initialized Ollama for chart analysis ({llm.model}).")
+    return llm
+
+chart_llm = lazy_resource("chart_analyzer.llm", _build_chart_llm)
 
 def analyze_charts(state: GraphState) -> Dict[str, Any]:
     """
@@ -34,7 +36,7 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
     pdf_path = state["pdf_path"]
     # Get detected language from state, fallback to default
     language = state.get("language", DEFAULT_LANGUAGE)
-    print(f"  Using language: {language}")
+    print(f"  Document language: {language} (images use the language of their page)")
 
     chart_summaries = []
     doc = None
@@ -44,10 +46,12 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
     if not image_refs:
         print("No image references found to analyze as potential charts.")
         return {}
+    image_refs, reused_refs = split_image_refs(image_refs) # Skips tiny/decorative images (see utils/image_filter.py)
 
     print(f"Found {len(image_refs)} potential charts (analyzing as images).")
 
-    if not USE_MULTIMODAL_LLM_FOR_CHARTS or not llm_chart:
+    llm_chart = chart_llm.get() if USE_MULTIMODAL_LLM_FOR_CHARTS else None
+    if not llm_chart:
         print("Multi-modal LLM for charts is not configured. Skipping chart analysis.")
         return {}
 
@@ -59,31 +63,41 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
             img_metadata = img_ref.get("metadata", {})
             img_name = img_ref.get("content", f"image_{i}")
             xref = img_metadata.get("xref")
+            image_language = img_metadata.get("language") or language # Per-element language from the language detector
             print(f"  Analyzing potential chart {i+1}/{len(image_refs)}: {img_name} (xref: {xref})")
 
             summary = f"Chart/Image: {img_name}"
             image_bytes = None
+            prepared = None
 
             # --- Get Image Data ---
             if xref and doc:
                 try:
                     base_image = doc.extract_image(xref)
-                    if base_image: image_bytes = base_image["image"]
+                    if base_image:
+                        image_bytes = base_image["image"]
+                        prepared = prepare_image_for_vision(image_bytes, base_image.get("ext"), doc, xref)
                     else: print(f"    Could not extract image for xref {xref}."); continue
                 except Exception as e: print(f"    Error extracting image bytes for xref {xref}: {e}"); continue
 
-            if not image_bytes: continue
+            if not prepared: continue
+
+            # --- Cheap local pre-check: most photos and logos never reach the vision model ---
+            prefilter = classify_chart(image_bytes, prepared["image"], prepared["original_size"]) if USE_CHART_PREFILTER else None
+            if prefilter and not prefilter["is_chart"] and prefilter["confidence"] >= CHART_PREFILTER_MIN_CONFIDENCE:
+                print(f"    Skipped: pre-filter says not a chart (confidence {prefilter['confidence']}).")
+                continue
 
             # --- Use Multi-modal LLM for Analysis ---
             print("    Attempting analysis with multi-modal LLM...")
             try:
-                img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                img_base64 = base64.b64encode(prepared["data"]).decode('utf-8')
                 # Include language in the prompt
-                prompt = (f"Analyze this image in {language}. Is it a chart or graph? "
+                prompt = (f"Analyze this image in {image_language}. Is it a chart or graph? "
                         f"If yes, identify the chart type (e.g., bar, line, pie). "
-                        f"Describe the main data presented, key trends, or insights shown in the chart in {language}. "
+                        f"Describe the main data presented, key trends, or insights shown in the chart in {image_language}. "
                         f"Extract axis labels and the title if visible. "
-                        f"If it's not a chart, briefly describe what it is in {language}."
+                        f"If it's not a chart, briefly describe what it is in {image_language}."
                         "NO FURTHER EXPLANATION, JUST PROVIDE THE RESULT.")
                 
                 system_prompt = "You are an assistant tasked with describing table or image or chart"
@@ -92,7 +106,7 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": "data:image/png;base64," + "{img_base64}",
+                                "url": "data:{img_mime};base64,{img_base64}",
                             },
                         },
                         {
@@ -108,7 +122,9 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
                     ]
                 )
                 parser_chain = final_prompt | llm_chart | StrOutputParser()
-                llm_result = parser_chain.invoke(img_base64)
+                llm_result = cached_invoke(parser_chain, {"img_base64": img_base64, "img_mime": prepared["mime_type"]},
+                                           model=llm_chart.model,
+                                           prompt=final_prompt, language=image_language)
                 summary = llm_result.strip()
                 print(f"    LLM Chart Analysis Result: {summary[:150]}...")
 
@@ -121,10 +137,14 @@ def analyze_charts(state: GraphState) -> Dict[str, Any]:
                 "chart_ref": img_name,
                 "summary": summary,
                 "analysis_method": "llm",
-                "analysis_language": language, # Store language used
-                "metadata": img_metadata
+                "analysis_language": image_language, # Store language used
+                "metadata": {**img_metadata, "chart_prefilter": {
+                    "is_chart": prefilter["is_chart"], "confidence": prefilter["confidence"], "score": prefilter["score"]
+                } if prefilter else None, "image_preprocessing": prepared["metadata"]}
             })
 
+        chart_summaries.extend(reuse_analysis(reused_refs, chart_summaries, "chart_ref"))
+
     except Exception as e:
         print(f"Error during chart analysis setup or loop: {e}")
         raise e
@@ -1,50 +1,227 @@
+import os
 from typing import Dict, Any, List
 from graph_definition import GraphState
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownTextSplitter # Example splitters
+from utils.llm_provider import get_embeddings, lazy_resource
+from utils.embedding_cache import CachedEmbeddings, with_embedding_cache
+from utils.tokenizer import count_tokens, tokenizer_name
+from utils import semantic_chunking
 
 # --- Configuration ---
-CHUNK_STRATEGY = "semantic" # Options: "recursive", "markdown", "semantic" (requires embedding model)
+# Options: "recursive", "markdown", "semantic" (SemanticChunker per element), "semantic_native"
+# (whole document at once, see utils/semantic_chunking.py). The semantic ones require an embedding model.
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "semantic")
+# Unit of the chunk sizes: "tokens" (counted with utils/tokenizer.py, by default the embedding
+# model's tokenizer; characters are used if no tokenizer is installed) or "chars".
+# Token counts per character vary a lot between languages (e.g. Vietnamese vs. English).
+CHUNK_SIZE_UNIT = os.getenv("CHUNK_SIZE_UNIT", "tokens")
 CHUNK_SIZE = 1000 # Target size for chunks (in characters for recursive/markdown)
 CHUNK_OVERLAP = 150 # Overlap between chunks
+CHUNK_SIZE_TOKENS = 256 # The same in tokens
+CHUNK_OVERLAP_TOKENS = 40
 # For semantic chunking (if implemented):
 EMBEDDING_MODEL = "bge-m3:latest" 
 SEMANTIC_THRESHOLD = 0.85 
+SEMANTIC_THRESHOLD_TYPE = "percentile" # Or "standard_deviation", "interquartile"
+# For "semantic_native": chunk size bounds in characters. Sentences are merged across elements
+# and pages until a semantic breakpoint (once the chunk has SEMANTIC_MIN_CHUNK_SIZE characters),
+# an element-type change or SEMANTIC_MAX_CHUNK_SIZE is reached.
+SEMANTIC_MAX_CHUNK_SIZE = 2000
+SEMANTIC_MIN_CHUNK_SIZE = 200
+SEMANTIC_MAX_CHUNK_TOKENS = 512 # The same in tokens
+SEMANTIC_MIN_CHUNK_TOKENS = 50
+# Attach a pooled embedding (EMBEDDING_MODEL) to every chunk, written to <output>.embeddings.npy.
+# The semantic strategies pool the sentence vectors they already computed; other chunks are
+# embedded in one batched pass.
+OUTPUT_CHUNK_EMBEDDINGS = os.getenv("OUTPUT_CHUNK_EMBEDDINGS", "false").lower() in ("1", "true", "yes", "on")
 
-# Initialize text splitters
-recursive_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-    length_function=len,
-    is_separator_regex=False,
-    separators=["\n\n", "\n", ". ", ", ", " ", ""] # Common separators
-)
-
-markdown_splitter = MarkdownTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP
-)
-
-# Placeholder for semantic chunking setup
-if CHUNK_STRATEGY == "semantic":
-    try:
-        from langchain_experimental.text_splitter import SemanticChunker
-        from langchain_ollama import OllamaEmbeddings
-
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-        # embeddings = SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL)
-
-        semantic_splitter = SemanticChunker(
-            embeddings=embeddings,
-            breakpoint_threshold_type="percentile", # Or "standard_deviation", "interquartile"
-            breakpoint_threshold_amount=SEMANTIC_THRESHOLD
-        )
-        print("Initialized Semantic Chunker.")
-    except ImportError:
-        print("Semantic Chunker or embedding model not available. Falling back to recursive.")
-        CHUNK_STRATEGY = "recursive"
-    except Exception as e:
-        print(f"Error initializing Semantic Chunker: {e}. Falling back to recursive.")
-        CHUNK_STRATEGY = "recursive"
+# Text splitters, built on first use (loading the tokenizer is not free)
+def _build_text_splitters() -> Dict[str, Any]:
+    if CHUNK_SIZE_UNIT == "tokens" and tokenizer_name():
+        # count_tokens is memoized: the splitters measure overlapping pieces many times
+        unit, length_function = "tokens", count_tokens
+        chunk_size, chunk_overlap = CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS
+        semantic_max, semantic_min = SEMANTIC_MAX_CHUNK_TOKENS, SEMANTIC_MIN_CHUNK_TOKENS
+    else:
+        if CHUNK_SIZE_UNIT == "tokens":
+            print("No tokenizer available. Chunk sizes are measured in characters.")
+        unit, length_function = "chars", len
+        chunk_size, chunk_overlap = CHUNK_SIZE, CHUNK_OVERLAP
+        semantic_max, semantic_min = SEMANTIC_MAX_CHUNK_SIZE, SEMANTIC_MIN_CHUNK_SIZE
+
+    return {
+        "unit": unit,
+        "length_function": length_function,
+        "semantic_max": semantic_max,
+        "semantic_min": semantic_min,
+        "recursive": RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=length_function,
+            is_separator_regex=False,
+            separators=["\n\n", "\n", ". ", ", ", " ", ""] # Common separators
+        ),
+        "markdown": MarkdownTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=length_function
+        ),
+        # Cuts single sentences/tables longer than the native chunker's max chunk size
+        "oversized": RecursiveCharacterTextSplitter(
+            chunk_size=semantic_max,
+            chunk_overlap=0,
+            length_function=length_function,
+            separators=["\n\n", "\n", ". ", ", ", " ", ""]
+        ),
+    }
+
+text_splitters = lazy_resource("chunker.text_splitters", _build_text_splitters)
+
+# Semantic chunking setup (embedding model + SemanticChunker), built on first use
+def _build_embeddings():
+    # Sentence vectors are cached on disk by (model, normalized text), see utils/embedding_cache.py
+    return with_embedding_cache(get_embeddings(EMBEDDING_MODEL))
+    # return SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL)
+
+chunk_embeddings = lazy_resource("chunker.embeddings", _build_embeddings)
+
+
+def _build_semantic_splitter():
+    from langchain_experimental.text_splitter import SemanticChunker
+
+    embeddings = chunk_embeddings.get()
+    if embeddings is None:
+        raise RuntimeError("Embedding model not available")
+    splitter = SemanticChunker(
+        embeddings=embeddings,
+        breakpoint_threshold_type=SEMANTIC_THRESHOLD_TYPE,
+        breakpoint_threshold_amount=SEMANTIC_THRESHOLD
+    )
+    print("Initialized Semantic Chunker.")
+    return splitter
+
+semantic_chunker = lazy_resource("chunker.semantic_splitter", _build_semantic_splitter)
+
+
+def prewarm_semantic_embeddings(splitter, texts: List[str]):
+    """
+    Embeds the sentence windows of all texts in one batched pass through the embedding cache,
+    so the per-element split_text calls that follow only read vectors from the cache.
+    Uses the splitter's own sentence splitting and windowing, so the texts match exactly.
+    """
+    if not isinstance(splitter.embeddings, CachedEmbeddings):
+        return # Without the cache, pre-warming would embed everything twice
+    from langchain_experimental.text_splitter import combine_sentences
+
+    windows = []
+    for text in texts:
+        sentences = splitter._get_single_sentences_list(text)
+        if len(sentences) < 2:
+            continue # split_text does not embed single sentences
+        combined = combine_sentences([{"sentence": s, "index": i} for i, s in enumerate(sentences)],
+                                     splitter.buffer_size)
+        windows.extend(sentence["combined_sentence"] for sentence in combined)
+    if windows:
+        print(f"Embedding {len(windows)} sentence windows of {len(texts)} elements in one batched pass...")
+        splitter.embeddings.embed_documents(windows)
+
+
+def semantic_chunk_vectors(splitter, text: str, chunks: List[str]) -> List[Any]:
+    """
+    Pooled embeddings of the chunks SemanticChunker made from one element, from the sentence
+    window vectors it already computed (read back from the embedding cache).
+    Returns one vector (or None, if the sentences cannot be matched) per chunk.
+    """
+    if not isinstance(splitter.embeddings, CachedEmbeddings) or not semantic_chunking.NUMPY_AVAILABLE:
+        return [None] * len(chunks)
+    from langchain_experimental.text_splitter import combine_sentences
+
+    sentences = splitter._get_single_sentences_list(text)
+    counts = [len(splitter._get_single_sentences_list(chunk)) for chunk in chunks]
+    if len(sentences) < 2 or sum(counts) != len(sentences):
+        return [None] * len(chunks)
+    combined = combine_sentences([{"sentence": s, "index": i} for i, s in enumerate(sentences)], splitter.buffer_size)
+    vectors = splitter.embeddings.embed_documents([sentence["combined_sentence"] for sentence in combined])
+    pooled, start = [], 0
+    for count in counts:
+        pooled.append(semantic_chunking.pool_vectors(vectors[start:start + count]).tolist())
+        start += count
+    return pooled
+
+
+def attach_chunk_embeddings(final_chunks: List[Dict[str, Any]], vectors: List[Any]):
+    """
+    Stores vectors[i] as final_chunks[i]['embedding']. Chunks without a vector are embedded
+    with the chunker's embedding model in one batched call.
+    """
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        embeddings = chunk_embeddings.get()
+        if embeddings is None:
+            print("Embedding model not available. Chunks are saved without embeddings.")
+            return
+        print(f"Embedding {len(missing)} chunks for the output...")
+        for i, vector in zip(missing, embeddings.embed_documents([final_chunks[i]["content"] for i in missing])):
+            vectors[i] = vector
+    for chunk, vector in zip(final_chunks, vectors):
+        chunk["embedding"] = list(vector)
+
+
+def record_token_counts(final_chunks: List[Dict[str, Any]], splitters: Dict[str, Any]):
+    """Adds 'token_count' to the chunk metadata when chunk sizes are measured in tokens."""
+    if splitters["unit"] != "tokens":
+        return
+    for chunk in final_chunks:
+        chunk["metadata"]["token_count"] = count_tokens(chunk["content"])
+
+
+def record_page_ranges(final_chunks: List[Dict[str, Any]]):
+    """
+    Sets 'pages' (every page the chunk covers) on chunks that don't have it yet: the page range
+    of a text work unit, or the element's page. Incremental runs rely on it to find chunks that
+    span a changed page (see utils/incremental.py).
+    """
+    for chunk in final_chunks:
+        metadata = chunk["metadata"]
+        if not metadata.get("pages"):
+            pages = metadata.get("page_numbers") or [metadata.get("page_number")]
+            metadata["pages"] = [page for page in pages if page is not None]
+
+
+def create_native_chunks(prepared_elements: List[tuple], embeddings, splitters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Chunks the prepared elements of the whole document with utils.semantic_chunking.
+    A chunk takes the metadata of its first element, plus 'pages' (all pages it covers) and
+    'provenance' (page, bbox and character range of the sentences of every source element).
+    """
+    chunks = semantic_chunking.chunk_document(
+        prepared_elements, embeddings,
+        split_oversized=splitters["oversized"].split_text,
+        max_length=splitters["semantic_max"],
+        min_length=splitters["semantic_min"],
+        length_function=splitters["length_function"],
+        threshold_type=SEMANTIC_THRESHOLD_TYPE,
+        threshold_amount=SEMANTIC_THRESHOLD,
+        return_vectors=OUTPUT_CHUNK_EMBEDDINGS,
+    )
+    final_chunks = []
+    for chunk_index, chunk in enumerate(chunks):
+        base_metadata = prepared_elements[chunk["element_indices"][0]][2]
+        pages = sorted({entry["page_number"] for entry in chunk["provenance"] if entry["page_number"] is not None})
+        final_chunks.append({
+            "content": chunk["content"],
+            "metadata": {
+                **base_metadata,
+                "chunk_index": chunk_index,
+                "pages": pages,
+                "provenance": [{key: value for key, value in entry.items() if key != "element_index"}
+                               for entry in chunk["provenance"]],
+            }
+        })
+        if "vector" in chunk:
+            final_chunks[-1]["embedding"] = chunk["vector"].tolist()
+    print(f"Finished native semantic chunking. {len(prepared_elements)} elements -> {len(final_chunks)} chunks.")
+    return final_chunks
 
 
 def create_chunks(state: GraphState) -> Dict[str, Any]:
@@ -66,12 +243,24 @@ def create_chunks(state: GraphState) -> Dict[str, Any]:
         print("No synthesized content to chunk.")
         return {}
 
+    splitters = text_splitters.get()
+    semantic_splitter = semantic_chunker.get() if CHUNK_STRATEGY == "semantic" else None
+    if CHUNK_STRATEGY == "semantic" and semantic_splitter is None:
+        print("Semantic Chunker or embedding model not available. Falling back to recursive.")
+    native_embeddings = None
+    if CHUNK_STRATEGY == "semantic_native":
+        native_embeddings = chunk_embeddings.get() if semantic_chunking.NUMPY_AVAILABLE else None
+        if native_embeddings is None:
+            print("Embedding model or NumPy not available. Falling back to recursive.")
+
     # Combine content into a single string or process element by element?
     # Option 1: Combine all text-based content into one large document string
     # Option 2: Chunk element by element, preserving element type in metadata
 
     # Let's try Option 2: Chunk element by element, adding type info
-    chunk_index = 0
+    # First collect the text of every element, so the semantic splitter's embeddings
+    # can be computed for the whole document in one batched pass
+    prepared_elements = []
     for element in synthesized_content:
         element_type = element.get("type", "unknown")
         content_to_chunk = ""
@@ -107,21 +296,46 @@ def create_chunks(state: GraphState) -> Dict[str, Any]:
 
         if not content_to_chunk.strip():
             continue # Skip empty content
+        prepared_elements.append((element_type, content_to_chunk, base_metadata))
+
+    if native_embeddings is not None:
+        try:
+            final_chunks = create_native_chunks(prepared_elements, native_embeddings, splitters)
+            record_token_counts(final_chunks, splitters)
+            record_page_ranges(final_chunks)
+            return {"final_chunks": final_chunks}
+        except Exception as e:
+            print(f"Native semantic chunking failed: {e}. Falling back to recursive.")
 
+    if semantic_splitter:
+        try:
+            prewarm_semantic_embeddings(semantic_splitter, [content for _, content, _ in prepared_elements])
+        except Exception as e:
+            print(f"Batched embedding failed: {e}. Elements will be embedded one by one.")
+
+    chunk_index = 0
+    chunk_vectors = [] # Pooled vectors of the semantic chunks, in final_chunks order
+    for element_type, content_to_chunk, base_metadata in prepared_elements:
         # Apply selected chunking strategy
         try:
             chunks = []
+            element_vectors = None
             if CHUNK_STRATEGY == "markdown":
                 # Use Markdown splitter if content is likely Markdown (tables, maybe LLM-cleaned text)
-                if element_type == "table_processed" and base_metadata.get("table_format") == "llm_markdown":
-                     chunks = markdown_splitter.split_text(content_to_chunk)
+                if element_type == "table_processed" and base_metadata.get("table_format") in ("llm_markdown", "markdown_local"):
+                     chunks = splitters["markdown"].split_text(content_to_chunk)
                 else:
                      # Use recursive for general text or non-markdown tables/summaries
-                     chunks = recursive_splitter.split_text(content_to_chunk)
-            elif CHUNK_STRATEGY == "semantic" and semantic_splitter:
+                     chunks = splitters["recursive"].split_text(content_to_chunk)
+            elif semantic_splitter:
                 chunks = semantic_splitter.split_text(content_to_chunk)
+                if OUTPUT_CHUNK_EMBEDDINGS:
+                    try:
+                        element_vectors = semantic_chunk_vectors(semantic_splitter, content_to_chunk, chunks)
+                    except Exception as e:
+                        print(f"Could not pool sentence embeddings ({e}). Chunks will be embedded separately.")
             else: # Default to recursive
-                chunks = recursive_splitter.split_text(content_to_chunk)
+                chunks = splitters["recursive"].split_text(content_to_chunk)
 
             # Create final chunk dictionaries
             for i, chunk_text in enumerate(chunks):
@@ -136,6 +350,7 @@ def create_chunks(state: GraphState) -> Dict[str, Any]:
                     "metadata": chunk_metadata
                 })
                 chunk_index += 1
+            chunk_vectors.extend(element_vectors or [None] * len(chunks))
 
         except Exception as e:
             print(f"Error chunking element ({element_type}): {e}")
@@ -143,8 +358,16 @@ def create_chunks(state: GraphState) -> Dict[str, Any]:
             error_metadata = {**base_metadata, "chunking_error": str(e), "chunk_index": chunk_index}
             final_chunks.append({"content": content_to_chunk, "metadata": error_metadata})
             chunk_index += 1
+            chunk_vectors.extend([None] * (len(final_chunks) - len(chunk_vectors)))
 
+    if OUTPUT_CHUNK_EMBEDDINGS and final_chunks:
+        try:
+            attach_chunk_embeddings(final_chunks, chunk_vectors[:len(final_chunks)])
+        except Exception as e:
+            print(f"Failed to embed chunks: {e}. Chunks are saved without embeddings.")
 
+    record_token_counts(final_chunks, splitters)
+    record_page_ranges(final_chunks)
     print(f"Finished chunking. Generated {len(final_chunks)} final chunks.")
     return {"final_chunks": final_chunks}
 
@@ -1,5 +1,6 @@
 from typing import Dict, Any, List
 from graph_definition import GraphState
+from utils.file_handler import find_invalid_embeddings
 import json
 
 def format_output(state: GraphState) -> Dict[str, Any]:
@@ -52,6 +53,10 @@ def format_output(state: GraphState) -> Dict[str, Any]:
 
         checked_chunks.append(chunk)
 
+    # 4. Chunk embeddings (OUTPUT_CHUNK_EMBEDDINGS) must all have the same dimensions
+    if any("embedding" in chunk for chunk in checked_chunks):
+        _validate_embeddings(checked_chunks)
+
     print(f"Final quality check complete. {len(checked_chunks)} chunks remaining.")
 
     # The state already holds 'final_chunks', just ensure it's the checked version.
@@ -59,6 +64,24 @@ def format_output(state: GraphState) -> Dict[str, Any]:
     return {"final_chunks": checked_chunks}
 
 
+def _validate_embeddings(chunks: List[Dict[str, Any]]):
+    """
+    Drops chunk embeddings that are not a list of finite numbers of the document's
+    dimensionality (the most common one), so the sidecar .npy file stays rectangular.
+    """
+    expected, invalid = find_invalid_embeddings(
+        {i: chunk["embedding"] for i, chunk in enumerate(chunks) if chunk.get("embedding") is not None})
+    for i, chunk in enumerate(chunks):
+        vector = chunk.get("embedding")
+        if vector is None:
+            if expected is not None:
+                print(f"  Warning: Chunk {i} has no embedding.")
+        elif i in invalid:
+            size = len(vector) if isinstance(vector, list) else type(vector).__name__
+            print(f"  Warning: Removing invalid embedding of chunk {i} ({size}, expected {expected} dimensions).")
+            del chunk["embedding"]
+
+
 def _make_serializable(obj: Any) -> Any:
     """Recursively converts non-serializable items in dicts/lists to strings."""
     if isinstance(obj, dict):
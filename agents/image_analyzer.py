@@ -6,6 +6,10 @@ import fitz # To extract image bytes if needed
 import base64
 from langchain.schema.output_parser import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from utils.llm_cache import cached_invoke
+from utils.image_utils import prepare_image_for_vision
+from utils.image_filter import split_image_refs, reuse_analysis
+from utils.llm_provider import get_chat_model, lazy_resource
 
 # --- Configuration ---
 USE_MULTIMODAL_LLM = True
@@ -13,19 +17,13 @@ USE_OCR_FALLBACK = False # Requires pytesseract and Tesseract install
 DEFAULT_LANGUAGE = "English" # Fallback language
 
 
-# Initialize Ollama for image analysis (if used)
-llm_image = None
-if USE_MULTIMODAL_LLM:
-    try:
-        from langchain_ollama import ChatOllama
-        llm_image = ChatOllama(model=os.getenv("IMAGE_ANALYZER_MODEL"), temperature=0)
-        print(f"Initialized Ollama for image analysis {os.getenv("IMAGE_ANALYZER_MODEL")}.")
-    except ImportError:
-        print("langchain_community.llms.Ollama not found. Cannot use LLM for image analysis.")
-        USE_MULTIMODAL_LLM = False
-    except Exception as e:
-        print(f"Failed to initialize Ollama for images: {e}")
-        USE_MULTIMODAL_LLM = False
+# Ollama for image analysis (if used), built on first use
+def _build_image_llm():
+    llm = get_chat_model(os.getenv("IMAGE_ANALYZER_MODEL"), temperature=0)
+    print(f"Initialized Ollama for image analysis {llm.model}.")
+    return llm
+
+image_llm = lazy_resource("image_analyzer.llm", _build_image_llm)
 
 # OCR setup (if used)
 # ...
@@ -39,7 +37,7 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
     pdf_path = state["pdf_path"]
     # Get detected language from state, fallback to default
     language = state.get("language", DEFAULT_LANGUAGE)
-    print(f"  Using language: {language}")
+    print(f"  Document language: {language} (images use the language of their page)")
 
     image_descriptions = []
     doc = None
@@ -48,8 +46,10 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
     if not image_refs:
         print("No image references found to analyze.")
         return {}
+    image_refs, reused_refs = split_image_refs(image_refs) # Skips tiny/decorative images (see utils/image_filter.py)
 
     print(f"Found {len(image_refs)} image references.")
+    llm_image = image_llm.get() if USE_MULTIMODAL_LLM else None
 
     try:
         if (USE_MULTIMODAL_LLM or USE_OCR_FALLBACK) and image_refs:
@@ -59,28 +59,32 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
             img_metadata = img_ref.get("metadata", {})
             img_name = img_ref.get("content", f"image_{i}")
             xref = img_metadata.get("xref")
+            image_language = img_metadata.get("language") or language # Per-element language from the language detector
             print(f"  Analyzing image {i+1}/{len(image_refs)}: {img_name} (xref: {xref})")
 
             description = f"Image: {img_name}"
             ocr_text = None
             image_bytes = None
+            prepared = None
 
             # --- Get Image Data ---
             if xref and doc:
                 try:
                     base_image = doc.extract_image(xref)
-                    if base_image: image_bytes = base_image["image"]
+                    if base_image:
+                        image_bytes = base_image["image"]
+                        prepared = prepare_image_for_vision(image_bytes, base_image.get("ext"), doc, xref)
                     else: print(f"    Could not extract image for xref {xref}.")
                 except Exception as e: print(f"    Error extracting image bytes for xref {xref}: {e}")
 
             # --- Use Multi-modal LLM ---
-            if USE_MULTIMODAL_LLM and llm_image and image_bytes:
+            if USE_MULTIMODAL_LLM and llm_image and prepared:
                 print("    Attempting analysis with multi-modal LLM...")
                 try:
-                    img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                    img_base64 = base64.b64encode(prepared["data"]).decode('utf-8')
                     
                     # Include language in the prompt
-                    prompt = f"Describe this image in detail in {language}. What does it show? Is there any text visible? If yes, extract the text exactly as it appears. NOTE: NO FURTHER EXPLANATION, JUST PROVIDE THE RESULT."
+                    prompt = f"Describe this image in detail in {image_language}. What does it show? Is there any text visible? If yes, extract the text exactly as it appears. NOTE: NO FURTHER EXPLANATION, JUST PROVIDE THE RESULT."
                     system_prompt = "You are an assistant tasked with describing image"
                     system_message_template = SystemMessagePromptTemplate.from_template(system_prompt)
                     
@@ -88,7 +92,7 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": "data:image/png;base64," + "{img_base64}",
+                                "url": "data:{img_mime};base64,{img_base64}",
                             },
                         },
                         {
@@ -104,7 +108,9 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
                         ]
                     )
                     summarize_chain = final_prompt | llm_image | StrOutputParser()
-                    llm_result = summarize_chain.invoke(img_base64)
+                    llm_result = cached_invoke(summarize_chain, {"img_base64": img_base64, "img_mime": prepared["mime_type"]},
+                                               model=llm_image.model,
+                                               prompt=final_prompt, language=image_language)
                     print(f"    LLM Result (raw): {llm_result[:100]}...")
                     description = llm_result.strip()
                     # Simple OCR extraction attempt (adjust based on LLM output format)
@@ -137,10 +143,12 @@ def analyze_images(state: GraphState) -> Dict[str, Any]:
                 "description": description,
                 "ocr_text": ocr_text if ocr_text else None,
                 "analysis_method": "llm" if USE_MULTIMODAL_LLM and image_bytes else ("ocr" if ocr_text else "none"),
-                "analysis_language": language, # Store language used
-                "metadata": img_metadata
+                "analysis_language": image_language, # Store language used
+                "metadata": {**img_metadata, "image_preprocessing": prepared["metadata"] if prepared else None}
             })
 
+        image_descriptions.extend(reuse_analysis(reused_refs, image_descriptions, "image_ref"))
+
     except Exception as e:
         print(f"Error during image analysis setup or loop: {e}")
         raise e
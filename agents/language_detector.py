@@ -1,14 +1,49 @@
-from typing import Dict, Any, Optional
+import os
+import re
+import functools
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from graph_definition import GraphState
 # Use a lightweight library like langdetect or gcld3
 # pip install langdetect pycountry
-from langdetect import detect, DetectorFactory
+from langdetect import detect_langs, DetectorFactory
 from langdetect.lang_detect_exception import LangDetectException
 import pycountry # Import pycountry
+from utils.header_footer import is_page_furniture
+from utils.llm_provider import lazy_resource
 
 # Ensure reproducibility for langdetect
 DetectorFactory.seed = 0
 
+# --- Configuration ---
+# Every element gets its own language ('language' metadata, full name): text blocks and tables
+# are detected on their own text, images and texts too short to detect get the majority
+# language of their page, or of the document. The document language (state 'language') is the
+# majority over all text, weighted by length.
+# LANGUAGE_ID_MODEL: path to a fastText language identification model (lid.176.ftz/.bin); if set
+# (and the fasttext package is installed) all blocks are classified in one batched predict call.
+# Otherwise langdetect classifies the blocks one by one.
+DEFAULT_LANGUAGE = "English" # Fallback language
+MIN_DETECTION_CHARS = 20 # Shorter texts are not detected (too unreliable)
+DETECTION_SAMPLE_CHARS = 500 # Only the beginning of long blocks is used
+MIN_DETECTION_CONFIDENCE = 0.5
+SHORT_TEXT_MAX_CHARS = 200 # Results for texts up to this length are cached (captions, labels, repeated lines)
+SHORT_TEXT_CACHE_SIZE = 4096
+
+
+def _build_fasttext_model():
+    import fasttext
+    path = os.environ["LANGUAGE_ID_MODEL"]
+    model = fasttext.load_model(path)
+    print(f"Loaded fastText language identification model '{path}'.")
+    return model
+
+fasttext_model = lazy_resource("language_detector.fasttext", _build_fasttext_model)
+
+_short_text_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+
+@functools.lru_cache(maxsize=256)
 def get_language_name(lang_code: str) -> Optional[str]:
     """Converts a 2-letter language code (ISO 639-1) to its English name."""
     if not lang_code or len(lang_code) != 2:
@@ -21,85 +56,118 @@ def get_language_name(lang_code: str) -> Optional[str]:
         print(f"Could not find language name for code '{lang_code}': {e}")
         return None
 
+
+def _detection_sample(text: str) -> str:
+    # fastText predicts line by line, so newlines must go
+    return re.sub(r"\s+", " ", text[:DETECTION_SAMPLE_CHARS * 2]).strip()[:DETECTION_SAMPLE_CHARS]
+
+
+def _detect_batch(samples: List[str]) -> List[Optional[str]]:
+    """Language codes of the samples (None where not confident): one fastText call, or langdetect per sample."""
+    model = fasttext_model.get() if os.getenv("LANGUAGE_ID_MODEL") else None
+    if model is not None:
+        labels, probabilities = model.predict(samples, k=1)
+        return [label[0].replace("__label__", "") if label and probability[0] >= MIN_DETECTION_CONFIDENCE else None
+                for label, probability in zip(labels, probabilities)]
+    codes = []
+    for sample in samples:
+        try:
+            best = detect_langs(sample)[0]
+            codes.append(best.lang if best.prob >= MIN_DETECTION_CONFIDENCE else None)
+        except LangDetectException:
+            codes.append(None)
+    return codes
+
+
+def detect_language_codes(texts: List[str]) -> List[Optional[str]]:
+    """
+    Language code per text (None for texts too short or not detected with confidence).
+    Identical texts are detected once, short texts are answered from a cache when possible.
+    """
+    samples = [_detection_sample(text) for text in texts]
+    found: Dict[str, Optional[str]] = {}
+    for sample in samples:
+        if len(sample) < MIN_DETECTION_CHARS:
+            found[sample] = None
+        elif sample in _short_text_cache:
+            _short_text_cache.move_to_end(sample)
+            found[sample] = _short_text_cache[sample]
+    missing = list(dict.fromkeys(sample for sample in samples if sample not in found))
+    if missing:
+        for sample, code in zip(missing, _detect_batch(missing)):
+            found[sample] = code
+            if len(sample) <= SHORT_TEXT_MAX_CHARS:
+                _short_text_cache[sample] = code
+        while len(_short_text_cache) > SHORT_TEXT_CACHE_SIZE:
+            _short_text_cache.popitem(last=False)
+    return [found[sample] for sample in samples]
+
+
+def _element_text(element: Dict[str, Any]) -> str:
+    content = element.get("content")
+    if element.get("type") == "table" and isinstance(content, list):
+        return " ".join(str(cell) for row in content if row for cell in row if cell)
+    if element.get("type") in ("text", "table_html") and isinstance(content, str):
+        return content
+    return "" # Image references only carry a placeholder name
+
+
+def _majority(weights: Dict[str, int]) -> Optional[str]:
+    return max(weights, key=weights.get) if weights else None
+
+
 def detect_language(state: GraphState) -> Dict[str, Any]:
     """
-    Agent 1.5: Detects the language of the extracted text elements
-    and stores the full language name (e.g., 'Vietnamese').
+    Agent 1.5: Detects the language of every extracted element (full language name,
+    e.g. 'Vietnamese', in its 'language' metadata) and of the whole document.
 
     Args:
         state: The current graph state.
 
     Returns:
-        A dictionary with the updated 'language' field (full name) in the state.
+        A dictionary with the updated 'language' field (document language, full name)
+        and the 'raw_elements' with their per-element language.
     """
     print("Detecting language...")
     raw_elements = state.get("raw_elements", [])
-    detected_language_name = "English" # Default to English
+    detected_language_name = DEFAULT_LANGUAGE # Default to English
 
     if not raw_elements:
         print("No raw elements found to detect language. Defaulting to English.")
         return {"language": detected_language_name}
 
-    # Combine text from the first few text blocks for detection
-    text_sample = ""
-    text_count = 0
-    for element in raw_elements:
-        if element.get("type") == "text" and element.get("content"):
-            text_sample += element["content"] + "\n"
-            text_count += 1
-            if text_count >= 5 or len(text_sample) > 1000: # Limit sample size
-                break
-
-    if not text_sample.strip():
-        print("No text content found to detect language. Defaulting to English.")
-        return {"language": detected_language_name}
-
-    detected_language_code = None
+    texts = [_element_text(element) if not is_page_furniture(element) else "" for element in raw_elements]
     try:
-        detected_language_code = detect(text_sample)
-        print(f"Detected language code: {detected_language_code}")
-        # Convert code to full name
-        lang_name = get_language_name(detected_language_code)
-        if lang_name:
-            detected_language_name = lang_name
-            print(f"Language name: {detected_language_name}")
-        else:
-            print(f"Could not convert code '{detected_language_code}' to name. Using code as name.")
-            detected_language_name = detected_language_code # Use code if name not found
-    except LangDetectException:
-        print("Could not detect language with certainty. Defaulting to English.")
-        # Keep default English
+        codes = detect_language_codes(texts)
     except Exception as e:
         print(f"Error during language detection: {e}. Defaulting to English.")
-        # Keep default English
+        return {"language": detected_language_name}
+
+    # Majority votes, weighted by text length
+    document_votes: Dict[str, int] = {}
+    page_votes: Dict[Any, Dict[str, int]] = {}
+    for element, text, code in zip(raw_elements, texts, codes):
+        if code:
+            document_votes[code] = document_votes.get(code, 0) + len(text)
+            votes = page_votes.setdefault(element.get("metadata", {}).get("page_number"), {})
+            votes[code] = votes.get(code, 0) + len(text)
+    document_code = _majority(document_votes)
+    if document_code:
+        detected_language_name = get_language_name(document_code) or document_code # Use code if name not found
+        print(f"Document language: {detected_language_name} ({document_code})")
+    else:
+        print("Could not detect language with certainty. Defaulting to English.")
+
+    updated_elements = []
+    element_languages: Dict[str, int] = {}
+    for element, code in zip(raw_elements, codes):
+        metadata = element.get("metadata", {})
+        code = code or _majority(page_votes.get(metadata.get("page_number"), {})) or document_code
+        language_name = (get_language_name(code) or code) if code else detected_language_name
+        element_languages[language_name] = element_languages.get(language_name, 0) + 1
+        updated_elements.append({**element, "metadata": {**metadata, "language": language_name}})
+    if len(element_languages) > 1:
+        print(f"Languages per element: {element_languages}")
 
     # Update the main state with the detected language name
-    return {"language": detected_language_name}
-
-# --- Alternative: Per-element language detection ---
-# def detect_language_per_element(state: GraphState) -> Dict[str, Any]:
-#     """Detects language for each text element."""
-#     print("Detecting language per text element...")
-#     raw_elements = state.get("raw_elements", [])
-#     updated_elements = []
-#     detected_languages = set()
-#
-#     for element in raw_elements:
-#         if element.get("type") == "text" and element.get("content"):
-#             try:
-#                 lang = detect(element["content"][:500]) # Detect on first 500 chars
-#                 element["metadata"]["language"] = lang
-#                 detected_languages.add(lang)
-#             except LangDetectException:
-#                 element["metadata"]["language"] = "unknown"
-#             except Exception as e:
-#                  print(f"Error detecting language for element: {e}")
-#                  element["metadata"]["language"] = "error"
-#         updated_elements.append(element)
-#
-#     # Determine overall document language (e.g., most frequent)
-#     # This logic can be more sophisticated
-#     main_language = "multi" if len(detected_languages) > 1 else (list(detected_languages)[0] if detected_languages else "unknown")
-#     print(f"Detected languages: {detected_languages}. Main language set to: {main_language}")
-#
-#     return {"raw_elements": updated_elements, "language": main_language}
+    return {"language": detected_language_name, "raw_elements": updated_elements}
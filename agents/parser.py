@@ -1,19 +1,332 @@
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import fitz # PyMuPDF
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from graph_definition import GraphState # Import state definition for type hinting
+from utils.image_filter import IMAGE_FILTER_ENABLED, filter_images, image_occurrence
+from utils.image_utils import image_pixel_hash
+from utils.header_footer import header_footer_signatures, remove_headers_footers, is_page_furniture
 
 # Placeholder for more advanced parsing like unstructured.io
 # from unstructured.partition.pdf import partition_pdf
 
+# --- Configuration ---
+# Pages are sharded across a process pool for large documents (table detection is CPU-bound).
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", os.cpu_count() or 1))
+PARALLEL_PARSE_MIN_PAGES = int(os.getenv("PARALLEL_PARSE_MIN_PAGES", 40)) # Smaller docs aren't worth the pool start-up
+SHARDS_PER_WORKER = 4 # More shards than workers evens out pages with very different costs
+# "spawn" is safe even though the graph runs agents in threads; "fork" starts faster on Linux
+PARSER_MP_START_METHOD = os.getenv("PARSER_MP_START_METHOD", "spawn")
+# When to run page.find_tables(), the most expensive call of the parser:
+#   "always": on every page; "never": no table extraction;
+#   "auto" (default): only on pages whose vector drawings / text layout look like a table.
+# find_tables() builds table cells from ruling lines and rectangles, so a page without
+# them cannot produce a table and is skipped.
+TABLE_DETECTION_STRATEGY = os.getenv("TABLE_DETECTION_STRATEGY", "auto").strip().lower()
+MIN_RULING_LENGTH = 8 # Points; shorter segments (underlines of single letters, glyph-like paths) are ignored
+MIN_GRID_RULINGS = 2 # Horizontal and vertical rulings needed for a ruled grid
+MIN_HORIZONTAL_RULES = 2 # Horizontal-only tables (rules above/below the header) ...
+MIN_ALIGNED_COLUMNS = 3 # ... also need text starting at this many shared x positions
+MIN_LINES_PER_COLUMN = 3
+COLUMN_ALIGNMENT_TOLERANCE = 2.0 # Points
+
+
+# Bump when the fingerprint recipe changes, so old fingerprints are never matched against new ones
+FINGERPRINT_VERSION = 2
+
+
+def _fingerprint_page(elements: List[Dict[str, Any]]) -> str:
+    """
+    Content fingerprint of one page: its text blocks, the hashes of its image bytes
+    (not the xrefs, which change between revisions) and its table contents.
+    The page number is not part of it, so a page that only moved still matches; neither are
+    the running headers/footers (the caller leaves them out), which carry page numbers.
+    """
+    hasher = hashlib.sha256(f"v{FINGERPRINT_VERSION}".encode("utf-8"))
+    image_digests = []
+    for element in elements:
+        if element["type"] == "text":
+            hasher.update(b"T" + element["content"].encode("utf-8"))
+        elif element["type"] == "table":
+            hasher.update(b"B" + json.dumps(element["content"], ensure_ascii=False).encode("utf-8"))
+        elif element["type"] == "image_ref":
+            image_digests.append(element["metadata"]["image_digest"])
+    for digest in image_digests:
+        hasher.update(b"I" + digest.encode("ascii"))
+    return hasher.hexdigest()
+
+
+def _fingerprint_pages(elements: List[Dict[str, Any]], page_numbers: List[int]) -> Dict[str, str]:
+    """
+    Fingerprints of the parsed pages (0-based page_numbers), keyed by 1-based page number as
+    string, from their elements after header/footer removal: "Page 3 of 11" becoming
+    "Page 4 of 12" when a page is inserted does not make every later page look changed.
+    """
+    page_elements: Dict[int, List[Dict[str, Any]]] = {page_num + 1: [] for page_num in page_numbers}
+    for element in elements:
+        if not is_page_furniture(element):
+            page_elements[element["metadata"]["page_number"]].append(element)
+    return {str(page): _fingerprint_page(elements_of_page) for page, elements_of_page in page_elements.items()}
+
+
+def _count_rulings(page: fitz.Page) -> Tuple[int, int]:
+    """Counts the horizontal and vertical ruling segments (lines and rectangle edges) drawn on the page."""
+    horizontal = vertical = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                (x0, y0), (x1, y1) = item[1], item[2]
+                width, height = abs(x1 - x0), abs(y1 - y0)
+                horizontal += height < 1 and width >= MIN_RULING_LENGTH
+                vertical += width < 1 and height >= MIN_RULING_LENGTH
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height < 1 or rect.width < 1: # Filled thin rectangles drawn as rules
+                    horizontal += rect.width >= MIN_RULING_LENGTH
+                    vertical += rect.height >= MIN_RULING_LENGTH
+                elif rect.width >= MIN_RULING_LENGTH and rect.height >= MIN_RULING_LENGTH:
+                    horizontal += 2 # Cell/frame outline
+                    vertical += 2
+    return horizontal, vertical
+
+
+def _aligned_columns(text_blocks: List[Dict[str, Any]]) -> int:
+    """Number of x positions where at least MIN_LINES_PER_COLUMN text lines start (table columns)."""
+    starts = sorted(line["bbox"][0] for block in text_blocks if block["type"] == 0 for line in block["lines"])
+    columns, run_start, run_length = 0, None, 0
+    for x in starts:
+        if run_start is not None and x - run_start <= COLUMN_ALIGNMENT_TOLERANCE:
+            run_length += 1
+        else:
+            columns += run_length >= MIN_LINES_PER_COLUMN
+            run_start, run_length = x, 1
+    return columns + (run_length >= MIN_LINES_PER_COLUMN)
+
+
+def _is_table_candidate(page: fitz.Page, text_blocks: List[Dict[str, Any]]) -> bool:
+    """Cheap pre-check (vector drawings, text alignment): can find_tables() find a table on this page?"""
+    horizontal, vertical = _count_rulings(page)
+    if horizontal >= MIN_GRID_RULINGS and vertical >= MIN_GRID_RULINGS:
+        return True
+    return horizontal >= MIN_HORIZONTAL_RULES and _aligned_columns(text_blocks) >= MIN_ALIGNED_COLUMNS
+
+
+def _parse_page(doc: fitz.Document, page_num: int, table_strategy: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Extracts the text blocks, image references and tables of one page (0-based page_num).
+    table_strategy overrides TABLE_DETECTION_STRATEGY.
+    Returns the elements and the page's parse stats
+    (timings in seconds and the table detection decision).
+    """
+    table_strategy = table_strategy or TABLE_DETECTION_STRATEGY
+    elements = []
+    page_start = time.perf_counter()
+    page = doc.load_page(page_num)
+    page_metadata = {"page_number": page_num + 1}
+    page_area = abs(page.rect) or 1.0
+
+    # 1. Extract Text Blocks
+    text_blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+    for block in text_blocks:
+        if block['type'] == 0: # Text block
+            block_text = ""
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    block_text += span["text"] + " "
+                block_text += "\n" # Add newline after each line
+            if block_text.strip():
+                 elements.append({
+                     "type": "text",
+                     "content": block_text.strip(),
+                     "metadata": {**page_metadata, "bbox": block["bbox"]} # Add bounding box
+                 })
+
+    # 2. Extract Images (References)
+    image_list = page.get_images(full=True)
+    for img_index, img_info in enumerate(image_list):
+        xref = img_info[0]
+        base_image = doc.extract_image(xref)
+        image_bytes = base_image["image"]
+        image_ext = base_image["ext"]
+        image_digest = hashlib.md5(image_bytes).hexdigest()
+        # Size, placement and hashes for the document-level image filter (utils/image_filter.py)
+        rects = page.get_image_rects(xref)
+        # In a real scenario, you might save the image temporarily or pass bytes
+        # For simplicity here, we just note its existence and location.
+        # Agent 3 (Image Analyzer) would need access to the actual image data later.
+        # This might require saving images temporarily or passing bytes in the state (can be large).
+        # Let's store a reference for now.
+        elements.append({
+            "type": "image_ref",
+            "content": f"Image_{page_num + 1}_{img_index}.{image_ext}", # Placeholder name
+            "metadata": {
+                **page_metadata,
+                "xref": xref,
+                "bbox": tuple(rects[0]) if rects else None,
+                "width": base_image.get("width"),
+                "height": base_image.get("height"),
+                "area_ratio": round(abs(rects[0]) / page_area, 5) if rects else None,
+                "image_digest": image_digest,
+                "pixel_hash": image_pixel_hash(image_bytes) if IMAGE_FILTER_ENABLED else None,
+                # Storing image_bytes directly in state is usually not recommended
+                # Consider saving to a temp dir and passing the path, or using a shared store.
+                "temp_image_path": None # Placeholder for path if saved
+            }
+        })
+
+    # 3. Extract Tables (Basic Heuristics or use libraries like camelot-py or unstructured)
+    # PyMuPDF has basic table detection, but it's often not robust.
+    # find_tables() returns TableFinder object; see TABLE_DETECTION_STRATEGY for when it runs
+    check_start = time.perf_counter()
+    if table_strategy == "never":
+        table_check = "never"
+    elif table_strategy == "always":
+        table_check = "always"
+    else:
+        table_check = "candidate" if _is_table_candidate(page, text_blocks) else "skipped"
+    stats = {"table_check": table_check, "precheck_seconds": round(time.perf_counter() - check_start, 5)}
+    tables = []
+    if table_check in ("always", "candidate"):
+        tables_start = time.perf_counter()
+        tables = page.find_tables()
+        stats["find_tables_seconds"] = round(time.perf_counter() - tables_start, 5)
+    for i, tab in enumerate(tables):
+         # tab.extract() gives the table content as list of lists
+         table_content = tab.extract()
+         # You might want to convert this to Markdown or JSON
+         elements.append({
+             "type": "table",
+             "content": table_content, # Store as list of lists for now
+             "metadata": {**page_metadata, "bbox": tab.bbox, "table_index": i}
+         })
+
+    # 4. Placeholder for Charts (requires more advanced analysis)
+    # Chart detection is complex. Often treated as images initially.
+    stats["tables"] = sum(element["type"] == "table" for element in elements)
+    stats["page_height"] = round(page.rect.height, 2)
+    stats["seconds"] = round(time.perf_counter() - page_start, 5)
+    return elements, stats
+
+
+def _parse_pages(pdf_path: str, page_numbers: List[int],
+                 table_strategy: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Parses the given pages (0-based) in order. Opens its own document, so it can run
+    in a worker process (fitz documents cannot be shared between processes).
+    Returns the elements, and the parse stats keyed by 1-based page number
+    (as string, JSON-friendly).
+    """
+    elements = []
+    page_stats = {}
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in page_numbers:
+            page_elements, page_stats[str(page_num + 1)] = _parse_page(doc, page_num, table_strategy)
+            elements.extend(page_elements)
+    finally:
+        doc.close()
+    return elements, page_stats
+
+
+def _shard_pages(page_numbers: List[int], shard_count: int) -> List[List[int]]:
+    """Splits the page list into contiguous shards of (almost) equal size, keeping page order."""
+    shard_size = max(1, -(-len(page_numbers) // shard_count)) # ceil division
+    return [page_numbers[i:i + shard_size] for i in range(0, len(page_numbers), shard_size)]
+
+
+def _parse_pages_parallel(pdf_path: str, page_numbers: List[int], workers: int,
+                          table_strategy: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Parses page shards on a process pool and merges the results in page order."""
+    shards = _shard_pages(page_numbers, workers * SHARDS_PER_WORKER)
+    print(f"Parsing {len(page_numbers)} pages in {len(shards)} shards on {workers} worker processes...")
+    mp_context = multiprocessing.get_context(PARSER_MP_START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        # map() yields results in submission order, i.e. page order
+        elements = []
+        page_stats = {}
+        for shard_elements, shard_stats in executor.map(
+                _parse_pages, [pdf_path] * len(shards), shards, [table_strategy] * len(shards)):
+            elements.extend(shard_elements)
+            page_stats.update(shard_stats)
+        return elements, page_stats
+
+
+def _parse(pdf_path: str, page_numbers: List[int], table_strategy: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], int]:
+    """Parses the pages, on the process pool if there are enough of them. Also returns the number of workers used."""
+    workers = min(PARSER_WORKERS, len(page_numbers))
+    if workers > 1 and len(page_numbers) >= PARALLEL_PARSE_MIN_PAGES:
+        try:
+            return (*_parse_pages_parallel(pdf_path, page_numbers, workers, table_strategy), workers)
+        except (OSError, BrokenProcessPool, AssertionError) as pool_error:
+            # e.g. no permission to start processes, or running inside a daemonic worker
+            print(f"Parallel parsing unavailable ({pool_error}). Parsing sequentially.")
+    return (*_parse_pages(pdf_path, page_numbers, table_strategy), 1)
+
+
+def _page_heights(page_stats: Dict[str, Dict[str, Any]]) -> Dict[int, float]:
+    return {int(page): stats["page_height"] for page, stats in page_stats.items()}
+
+
+def document_layout(elements: List[Dict[str, Any]], page_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    What the document-level filters need to know about the pages a parse does not cover,
+    from the elements of all pages: the page count, the running header/footer signatures
+    and the image occurrences (for the repeated-image filter).
+    """
+    return {"page_count": len(page_stats),
+            "headers_footers": header_footer_signatures(elements, _page_heights(page_stats)),
+            "images": [image_occurrence(element) for element in elements if element.get("type") == "image_ref"]}
+
+
+def scan_document(pdf_path: str, table_strategy: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Parses every page. Returns the page fingerprints (see compute_page_fingerprints; only
+    comparable with other fingerprints if table_strategy is the default) and the document
+    layout (see document_layout), to pass to the parse of a page subset.
+    """
+    doc = fitz.open(pdf_path)
+    page_numbers = list(range(doc.page_count))
+    doc.close()
+    elements, page_stats, _ = _parse(pdf_path, page_numbers, table_strategy)
+    layout = document_layout(elements, page_stats)
+    elements, _ = remove_headers_footers(elements, _page_heights(page_stats), layout["headers_footers"])
+    return _fingerprint_pages(elements, page_numbers), layout
+
+
+def compute_document_layout(pdf_path: str) -> Dict[str, Any]:
+    """The document layout (see document_layout), without table detection (tables play no part in it)."""
+    return scan_document(pdf_path, table_strategy="never")[1]
+
+
+def compute_page_fingerprints(pdf_path: str) -> Dict[str, str]:
+    """
+    Fingerprints of every page (keyed by 1-based page number as string).
+    Used by incremental reprocessing to find the pages of a revised PDF that changed.
+    """
+    return scan_document(pdf_path)[0]
+
+
 def parse_document(state: GraphState) -> Dict[str, Any]:
     """
     Agent 1: Parses the PDF document to extract raw elements.
+    Large documents are parsed page-parallel on a process pool (see PARSER_WORKERS);
+    the element schema and order are the same as in a sequential parse.
 
     Args:
-        state: The current graph state containing the pdf_path.
+        state: The current graph state containing the pdf_path and, optionally,
+               'page_numbers' (0-based pages to parse, e.g. one streaming window) and
+               'document_layout' (see document_layout; computed here if a page subset is
+               parsed without it).
 
     Returns:
-        A dictionary with the updated 'raw_elements' and 'metadata'.
+        A dictionary with the updated 'raw_elements', 'metadata', 'page_fingerprints'
+        (per-page content hashes used for incremental reprocessing) and 'page_parse_stats'
+        (per-page timings and table detection decisions, written to the metrics file).
     """
     pdf_path = state["pdf_path"]
     raw_elements = []
@@ -22,76 +335,48 @@ def parse_document(state: GraphState) -> Dict[str, Any]:
     try:
         print(f"Parsing document: {pdf_path}")
         doc = fitz.open(pdf_path)
-        doc_metadata["page_count"] = doc.page_count
+        page_count = doc.page_count
+        doc.close()
+        doc_metadata["page_count"] = page_count
         # Add more metadata extraction if needed (title, author, etc.)
         # doc_metadata.update(doc.metadata) # Be careful, metadata can be messy
 
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            page_metadata = {"page_number": page_num + 1}
-
-            # 1. Extract Text Blocks
-            text_blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
-            for block in text_blocks:
-                if block['type'] == 0: # Text block
-                    block_text = ""
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            block_text += span["text"] + " "
-                        block_text += "\n" # Add newline after each line
-                    if block_text.strip():
-                         raw_elements.append({
-                             "type": "text",
-                             "content": block_text.strip(),
-                             "metadata": {**page_metadata, "bbox": block["bbox"]} # Add bounding box
-                         })
-
-            # 2. Extract Images (References)
-            image_list = page.get_images(full=True)
-            for img_index, img_info in enumerate(image_list):
-                xref = img_info[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                # In a real scenario, you might save the image temporarily or pass bytes
-                # For simplicity here, we just note its existence and location.
-                # Agent 3 (Image Analyzer) would need access to the actual image data later.
-                # This might require saving images temporarily or passing bytes in the state (can be large).
-                # Let's store a reference for now.
-                raw_elements.append({
-                    "type": "image_ref",
-                    "content": f"Image_{page_num + 1}_{img_index}.{image_ext}", # Placeholder name
-                    "metadata": {
-                        **page_metadata,
-                        "xref": xref,
-                        # "bbox": page.get_image_bbox(img_info).irect # Get bbox if needed
-                        # Storing image_bytes directly in state is usually not recommended
-                        # Consider saving to a temp dir and passing the path, or using a shared store.
-                        "temp_image_path": None # Placeholder for path if saved
-                    }
-                })
-
-            # 3. Extract Tables (Basic Heuristics or use libraries like camelot-py or unstructured)
-            # PyMuPDF has basic table detection, but it's often not robust.
-            # find_tables() returns TableFinder object
-            tables = page.find_tables()
-            for i, tab in enumerate(tables):
-                 # tab.extract() gives the table content as list of lists
-                 table_content = tab.extract()
-                 # You might want to convert this to Markdown or JSON
-                 raw_elements.append({
-                     "type": "table",
-                     "content": table_content, # Store as list of lists for now
-                     "metadata": {**page_metadata, "bbox": tab.bbox, "table_index": i}
-                 })
+        page_numbers = list(range(page_count))
+        if state.get("page_numbers") is not None:
+            page_numbers = [p for p in state["page_numbers"] if 0 <= p < page_count]
+        raw_elements, page_stats, workers = _parse(pdf_path, page_numbers)
+        if workers > 1:
+            doc_metadata["parser_workers"] = workers
 
-            # 4. Placeholder for Charts (requires more advanced analysis)
-            # Chart detection is complex. Often treated as images initially.
+        # Repetition across pages is judged over the whole document, also when only some pages are parsed
+        layout = state.get("document_layout")
+        if layout is None and len(page_numbers) < page_count:
+            print("Scanning all pages for running headers/footers and repeated images...")
+            layout = compute_document_layout(pdf_path)
 
-        print(f"Parsed {len(raw_elements)} raw elements from {doc.page_count} pages.")
-        doc.close()
+        # Running headers/footers (repeated text in the margins), removed before any LLM sees them
+        raw_elements, furniture = remove_headers_footers(
+            raw_elements, _page_heights(page_stats), layout["headers_footers"] if layout else None)
+        for page, stats in page_stats.items():
+            stats["headers_footers"] = furniture.get(int(page), 0)
+        if furniture:
+            print(f"Found {sum(furniture.values())} running header/footer blocks on {len(furniture)} pages.")
+        page_fingerprints = _fingerprint_pages(raw_elements, page_numbers)
+
+        # Tiny, decorative and repeated images (needs all pages, so it runs after the page workers)
+        image_actions = filter_images(raw_elements, layout["page_count"] if layout else len(page_numbers),
+                                      layout["images"] if layout else None)
+        if image_actions["reuse"] or image_actions["skip"]:
+            print(f"Image filter: {image_actions['analyze']} images to analyze, "
+                  f"{image_actions['reuse']} reuse another analysis, {image_actions['skip']} skipped.")
+
+        checked = sum(stats["table_check"] in ("always", "candidate") for stats in page_stats.values())
+        print(f"Parsed {len(raw_elements)} raw elements from {len(page_numbers)} pages "
+              f"(table detection on {checked} pages, strategy '{TABLE_DETECTION_STRATEGY}').")
 
-        return {"raw_elements": raw_elements, "metadata": doc_metadata}
+        # Fingerprints and stats are kept out of 'metadata', which is copied into every chunk
+        return {"raw_elements": raw_elements, "metadata": doc_metadata, "page_fingerprints": page_fingerprints,
+                "page_parse_stats": page_stats}
 
     except Exception as e:
         print(f"Error parsing PDF {pdf_path}: {e}")
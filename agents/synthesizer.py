@@ -24,8 +24,8 @@ def synthesize_content(state: GraphState) -> Dict[str, Any]:
     all_elements = []
     all_elements.extend([{"type": "text", **item} for item in processed_text])
     all_elements.extend([{"type": "image_summary", **item} for item in image_desc])
-    # Note: Chart summaries might overlap with image descriptions if charts were treated as images.
-    # We might need a way to deduplicate or prioritize. For now, include both.
+    # Note: The vision agent only emits a chart summary for images it flagged as charts,
+    # so a chart appears both as an image description and as a chart summary.
     all_elements.extend([{"type": "chart_summary", **item} for item in chart_sum])
     all_elements.extend([{"type": "table_processed", **item} for item in table_data])
 
@@ -1,26 +1,37 @@
-from typing import Dict, Any, List
-from graph_definition import GraphState
+import os
+import re
 import json
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
+from graph_definition import GraphState
 import pandas as pd # Optional: For structured processing if needed
 import io # For using StringIO with pandas read_html
+from utils.llm_cache import acached_invoke
+from utils.llm_provider import get_chat_model, lazy_resource
+from utils.async_utils import run_coroutine
 
 # --- Configuration ---
 USE_LLM_FOR_TABLES = True
 TABLE_OUTPUT_FORMAT = 'markdown' # 'json', 'markdown', 'summary'
 DEFAULT_LANGUAGE = "English" # Fallback language
+# Well-formed tables (see score_table_quality) are converted locally to Markdown/JSON;
+# only malformed ones are sent to the LLM. Summaries always need the LLM.
+TABLE_FAST_PATH = os.getenv("TABLE_FAST_PATH", "true").lower() not in ("0", "false", "no", "off")
+# Tables with more data rows than this are processed in row windows that repeat the header row,
+# so no prompt gets too large for the model's context (and answers don't come back truncated).
+TABLE_WINDOW_ROWS = int(os.getenv("TABLE_WINDOW_ROWS", 100))
+# "merge": the windows' Markdown/JSON is reassembled into one table_processed element;
+# "separate": one table_processed element per window (summaries are always separate).
+TABLE_WINDOW_OUTPUT = os.getenv("TABLE_WINDOW_OUTPUT", "merge")
+# Max LLM requests in flight (windows and tables are sent concurrently)
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("TABLE_ANALYZER_MAX_CONCURRENCY", 4))
 
-# Initialize Ollama (if used for tables)
-llm_table = None
-table_chain = None
+# Prepare the prompt (if an LLM is used for tables); the Ollama client is built on first use
+table_prompt = None
 if USE_LLM_FOR_TABLES:
     try:
-        from langchain_ollama import ChatOllama
         from langchain_core.prompts import ChatPromptTemplate
         from langchain_core.output_parsers import StrOutputParser
-        import os
-
-        llm_table = ChatOllama(model=os.getenv("TABLE_ANALYZER_MODEL"), temperature=0)
-        print(f"LLM model for table analyzer: {os.getenv("TABLE_ANALYZER_MODEL")}")
 
         # Define prompts based on output format, including language
         prompt_text = None
@@ -39,8 +50,6 @@ if USE_LLM_FOR_TABLES:
 
         if prompt_text:
             table_prompt = ChatPromptTemplate.from_template(prompt_text)
-            table_chain = table_prompt | llm_table | StrOutputParser()
-            print("Initialized Ollama for table analysis.")
         else:
             # No LLM needed if just converting to JSON or passing through original
             USE_LLM_FOR_TABLES = False
@@ -49,30 +58,43 @@ if USE_LLM_FOR_TABLES:
     except ImportError:
         print("Required libraries for LLM table analysis not found.")
         USE_LLM_FOR_TABLES = False
-    except Exception as e:
-        print(f"Failed to initialize Ollama for tables: {e}")
-        USE_LLM_FOR_TABLES = False
+
+
+def _build_table_chain() -> Dict[str, Any]:
+    llm_table = get_chat_model(os.getenv("TABLE_ANALYZER_MODEL"), temperature=0)
+    print(f"LLM model for table analyzer: {llm_table.model}")
+    table_chain = table_prompt | llm_table | StrOutputParser()
+    print("Initialized Ollama for table analysis.")
+    return {"llm": llm_table, "chain": table_chain}
+
+table_llm = lazy_resource("table_analyzer.chain", _build_table_chain)
+
+
+def _md_cell(value: Any) -> str:
+    """Cell text that cannot break the Markdown table (no line breaks or unescaped pipes)."""
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).replace("|", "\\|")
 
 
 def format_table_to_md(table_data: List[List[str]]) -> str:
     """Converts a list of lists into a Markdown table."""
-    # ... (function remains the same)
     if not table_data:
         return ""
     try:
         # Assume first row is header
-        header = table_data[0]
+        header = [_md_cell(h) for h in table_data[0]]
         rows = table_data[1:]
 
         # Create header line and separator
-        md = "| " + " | ".join(map(str, header)) + " |\n"
-        md += "|-" + "-|".join(['-' * len(str(h)) for h in header]) + "-|\n"
+        md = "| " + " | ".join(header) + " |\n"
+        md += "|-" + "-|".join(['-' * len(h) for h in header]) + "-|\n"
 
         # Create rows
         for row in rows:
             # Ensure row has same number of columns as header, pad if necessary
-            padded_row = row + ["" for _ in range(len(header) - len(row))]
-            md += "| " + " | ".join(map(str, padded_row[:len(header)])) + " |\n" # Use only expected number of cells
+            padded_row = list(row) + ["" for _ in range(len(header) - len(row))]
+            md += "| " + " | ".join(_md_cell(cell) for cell in padded_row[:len(header)]) + " |\n" # Use only expected number of cells
 
         return md.strip()
     except Exception as e:
@@ -81,17 +103,142 @@ def format_table_to_md(table_data: List[List[str]]) -> str:
         return "\n".join(["\t".join(map(str, row)) for row in table_data])
 
 
+def score_table_quality(table_data: Any) -> Dict[str, Any]:
+    """
+    Checks whether a table (list of rows) can be converted without the LLM.
+    Returns its size and a list of issues; a table without issues is well-formed:
+      - "empty": no rows, or no cells
+      - "ragged_rows": rows with different column counts
+      - "empty_header": the header row is blank (a blank first header cell, e.g. above
+        row labels, is fine)
+      - "merged_cells": None cells (PyMuPDF's find_tables() marks cells covered by a merged cell with None)
+    """
+    if not isinstance(table_data, list) or not table_data or not all(isinstance(row, (list, tuple)) for row in table_data):
+        return {"rows": 0, "columns": 0, "issues": ["empty"]}
+    column_counts = {len(row) for row in table_data}
+    columns = max(column_counts)
+    issues = []
+    if columns == 0:
+        issues.append("empty")
+    if len(column_counts) > 1:
+        issues.append("ragged_rows")
+    header = table_data[0]
+    if any(cell is None or not str(cell).strip() for cell in header[1:]) or (header and not any(
+            cell is not None and str(cell).strip() for cell in header)):
+        issues.append("empty_header")
+    none_cells = sum(cell is None for row in table_data for cell in row)
+    if none_cells:
+        issues.append("merged_cells")
+    return {"rows": len(table_data), "columns": columns, "issues": issues}
+
+
+def _json_keys(header: List[Any]) -> List[str]:
+    """JSON object keys of a header row: the stripped cell text, repeated names numbered (Amount, Amount_2)."""
+    keys, used = [], set()
+    for cell in header:
+        name = str(cell).strip() if cell is not None else ""
+        key, n = name, 1
+        while key in used:
+            n += 1
+            key = f"{name}_{n}"
+        used.add(key)
+        keys.append(key)
+    return keys
+
+
+def convert_table_locally(table_data: List[List[Any]]) -> Tuple[str, str]:
+    """Markdown or JSON (TABLE_OUTPUT_FORMAT) of a well-formed table, without the LLM. Returns (content, format)."""
+    if TABLE_OUTPUT_FORMAT == 'json':
+        header = _json_keys(table_data[0])
+        data = [dict(zip(header, row)) for row in table_data[1:]]
+        return json.dumps(data, indent=2, ensure_ascii=False), 'json_local'
+    return format_table_to_md(table_data), 'markdown_local'
+
+
+def split_table_rows(table_data: List[List[Any]], window_rows: int) -> List[Tuple[int, List[List[Any]]]]:
+    """
+    Splits a table (first row = header) into windows of at most window_rows data rows,
+    each starting with the header row. Returns (first data row index, window) pairs.
+    """
+    header, rows = table_data[0], table_data[1:]
+    if window_rows <= 0 or len(rows) <= window_rows:
+        return [(0, table_data)]
+    return [(start, [header] + rows[start:start + window_rows]) for start in range(0, len(rows), window_rows)]
+
+
+MD_SEPARATOR_PATTERN = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+
+def merge_window_outputs(outputs: List[str]) -> str:
+    """Reassembles the Markdown/JSON results of a table's row windows (repeated headers are dropped)."""
+    if TABLE_OUTPUT_FORMAT == 'json':
+        try:
+            rows = []
+            for output in outputs:
+                rows.extend(json.loads(output))
+            return json.dumps(rows, indent=2, ensure_ascii=False)
+        except (ValueError, TypeError):
+            pass # Not a JSON list: concatenate as text below
+    merged = [outputs[0].strip()]
+    for output in outputs[1:]:
+        lines = output.strip().splitlines()
+        # Drop the window's header and separator rows ("| a | b |" / "|---|---|")
+        separator = next((i for i, line in enumerate(lines[:3]) if MD_SEPARATOR_PATTERN.match(line)), None)
+        merged.append("\n".join(lines[separator + 1:] if separator is not None else lines))
+    return "\n".join(part for part in merged if part)
+
+
+def _convert_without_llm(table_type: Optional[str], content: Any, input_for_llm: str) -> Tuple[Any, str]:
+    """Conversion used when the LLM is disabled or unavailable. Returns (content, format)."""
+    if table_type == "table" and isinstance(content, list):
+        if TABLE_OUTPUT_FORMAT == 'markdown':
+            return input_for_llm, 'markdown_basic'
+        if TABLE_OUTPUT_FORMAT == 'json':
+            if content and len(content) > 0:
+                header = content[0]
+                return json.dumps([dict(zip(header, row)) for row in content[1:]], indent=2), 'json'
+            return json.dumps([]), 'json'
+    if TABLE_OUTPUT_FORMAT == 'markdown':
+        return input_for_llm, 'markdown_fallback' if table_type != "table" else 'markdown_basic'
+    if TABLE_OUTPUT_FORMAT == 'json':
+        try:
+            # This might fail if input_for_llm isn't valid JSON structure
+            return json.dumps(input_for_llm), 'json_fallback' # Less likely to be useful
+        except TypeError:
+            return input_for_llm, 'original_string'
+    # e.g., summary requested but LLM disabled
+    return f"Table content (Format: {table_type}):\n" + input_for_llm, 'original_string'
+
+
+async def _run_table_prompts(inputs: List[Tuple[str, str]], table_resources: Dict[str, Any]) -> List[Any]:
+    """
+    Sends all (table content, language) prompts concurrently (at most MAX_CONCURRENT_LLM_CALLS
+    in flight). Failed calls return their exception.
+    """
+    llm_slots = asyncio.Semaphore(max(1, MAX_CONCURRENT_LLM_CALLS))
+
+    async def _invoke(table_content: str, language: str):
+        async with llm_slots:
+            return await acached_invoke(table_resources["chain"], {
+                "table_content": table_content,
+                "language": language # Pass language to the prompt context
+            }, model=table_resources["llm"].model, prompt=table_prompt, language=language)
+
+    return await asyncio.gather(*(_invoke(table_content, language) for table_content, language in inputs),
+                                return_exceptions=True)
+
+
 def analyze_tables(state: GraphState) -> Dict[str, Any]:
     """
     Agent 5: Analyzes and standardizes tables, considering language for summaries.
+    Well-formed tables are converted locally; the others go to the LLM, large ones in row
+    windows. All LLM requests of the document are sent concurrently.
     """
     print("Analyzing tables...")
     raw_elements = state.get("raw_elements", [])
     # Get detected language from state, fallback to default
     language = state.get("language", DEFAULT_LANGUAGE)
-    print(f"  Using language: {language}")
-
-    processed_tables = []
+    print(f"  Document language: {language} (tables are processed in their own language)")
 
     table_elements = [el for el in raw_elements if el.get("type") in ["table", "table_html"]]
     if not table_elements:
@@ -99,90 +246,116 @@ def analyze_tables(state: GraphState) -> Dict[str, Any]:
         return {}
 
     print(f"Found {len(table_elements)} table elements.")
+    fast_path = TABLE_FAST_PATH and TABLE_OUTPUT_FORMAT in ('markdown', 'json')
+    qualities = [score_table_quality(el.get("content")) if el.get("type") == "table" else None for el in table_elements]
+    local_tables = sum(1 for quality in qualities if quality is not None and not quality["issues"]) if fast_path else 0
+    if fast_path:
+        print(f"  {local_tables} well-formed tables are converted locally; {len(table_elements) - local_tables} need the LLM.")
+    # Falls back to the non-LLM conversions if the model cannot be initialized
+    # (not built at all when every table takes the fast path)
+    table_resources = table_llm.get() if USE_LLM_FOR_TABLES and local_tables < len(table_elements) else None
+    use_llm = table_resources is not None
+    separate_windows = TABLE_WINDOW_OUTPUT == "separate" or TABLE_OUTPUT_FORMAT == 'summary'
 
+    # 1. Decide per table: local conversion, or LLM prompts (one per row window)
+    plans = []
+    prompts = []
     for i, table_el in enumerate(table_elements):
-        print(f"  Processing table {i+1}/{len(table_elements)}...")
         content = table_el.get("content")
         metadata = table_el.get("metadata", {})
         table_type = table_el.get("type")
-        output_content = content
-        format_used = "original"
-        input_for_llm = "" # Prepare input string for LLM
+        quality = qualities[i]
+        if quality is not None:
+            metadata = {**metadata, "table_quality": quality}
+        table_language = metadata.get("language") or language # Per-element language from the language detector
+        plan = {"index": i, "type": table_type, "metadata": metadata, "language": table_language, "windows": []}
+        plans.append(plan)
 
         try:
-            # --- Prepare input for LLM or direct conversion ---
-            if table_type == "table" and isinstance(content, list):
-                # Convert list of lists to Markdown for LLM or direct use
-                input_for_llm = format_table_to_md(content)
-                if TABLE_OUTPUT_FORMAT == 'markdown' and not USE_LLM_FOR_TABLES:
-                    output_content = input_for_llm
-                    format_used = 'markdown_basic'
-                elif TABLE_OUTPUT_FORMAT == 'json' and not USE_LLM_FOR_TABLES:
-                     if content and len(content) > 0:
-                         header = content[0]
-                         data = [dict(zip(header, row)) for row in content[1:]]
-                         output_content = json.dumps(data, indent=2)
-                         format_used = 'json'
-                     else:
-                         output_content = json.dumps([])
-                         format_used = 'json'
-                # Else, input_for_llm will be used by LLM below
-
-            elif table_type == "table_html" and isinstance(content, str):
-                input_for_llm = content # Pass HTML to LLM
-                # Optionally use pandas to convert HTML to MD first
-                # try:
-                #     dfs = pd.read_html(io.StringIO(content))
-                #     if dfs: input_for_llm = dfs[0].to_markdown(index=False)
-                # except Exception: pass # Keep original HTML if parse fails
-
-            else:
-                 input_for_llm = str(content) # Fallback
-
-            # --- Use LLM if configured ---
-            if USE_LLM_FOR_TABLES and table_chain and input_for_llm:
-                print(f"    Processing table with LLM (Output: {TABLE_OUTPUT_FORMAT}, Lang: {language})...")
-                llm_result = table_chain.invoke({
-                    "table_content": input_for_llm,
-                    "language": language # Pass language to the prompt context
-                })
-                output_content = llm_result.strip()
-                format_used = f"llm_{TABLE_OUTPUT_FORMAT}"
-            elif not format_used.startswith('llm') and format_used == 'original':
-                # Handle cases where no direct conversion happened and LLM wasn't used
-                if TABLE_OUTPUT_FORMAT == 'markdown':
-                     output_content = input_for_llm # Use the prepared MD/HTML/str
-                     format_used = 'markdown_fallback' if table_type != "table" else 'markdown_basic'
-                elif TABLE_OUTPUT_FORMAT == 'json':
-                     # Attempt JSON conversion if possible, otherwise keep original string
-                     try:
-                         # This might fail if input_for_llm isn't valid JSON structure
-                         output_content = json.dumps(input_for_llm) # Less likely to be useful
-                         format_used = 'json_fallback'
-                     except TypeError:
-                         output_content = input_for_llm # Keep original
-                         format_used = 'original_string'
-                else: # e.g., summary requested but LLM disabled
-                    output_content = f"Table content (Format: {table_type}):\n" + input_for_llm
-                    format_used = 'original_string'
+            is_grid = table_type == "table" and isinstance(content, list) and bool(content)
+            windows = split_table_rows(content, TABLE_WINDOW_ROWS) if is_grid else [(0, content)]
+            if not (separate_windows or use_llm) or (fast_path and quality is not None and not quality["issues"]
+                                                      and not separate_windows):
+                windows = [(0, content)] # Local conversions handle the whole table at once
+            for start, window in windows:
+                # Prepare input for LLM or direct conversion
+                if table_type == "table" and isinstance(window, list):
+                    input_for_llm = format_table_to_md(window) # List of lists to Markdown
+                elif table_type == "table_html" and isinstance(window, str):
+                    input_for_llm = window # Pass HTML to LLM
+                else:
+                    input_for_llm = str(window) # Fallback
+                rows = len(window) - 1 if is_grid else None
+                entry = {"start": start, "rows": rows, "content": window}
+                if fast_path and quality is not None and not quality["issues"]:
+                    # Well-formed grid: no LLM round trip needed
+                    entry["output"], entry["format"] = convert_table_locally(window)
+                elif use_llm and input_for_llm:
+                    entry["prompt"] = len(prompts)
+                    prompts.append((input_for_llm, table_language))
+                else:
+                    entry["output"], entry["format"] = _convert_without_llm(table_type, window, input_for_llm)
+                plan["windows"].append(entry)
+        except Exception as e:
+            plan["error"] = e
 
+    # 2. All LLM requests at once
+    results = []
+    if prompts:
+        windowed = sum(1 for plan in plans if len(plan["windows"]) > 1)
+        languages = ", ".join(sorted({prompt_language for _, prompt_language in prompts}))
+        print(f"    Processing {len(prompts)} table prompts with LLM (Output: {TABLE_OUTPUT_FORMAT}, Lang: {languages}"
+              f"{f', {windowed} tables in row windows' if windowed else ''})...")
+        results = run_coroutine(_run_table_prompts(prompts, table_resources))
 
-            processed_tables.append({
-                "table_ref": f"table_{metadata.get('page_number', 'N')}_{metadata.get('table_index', i)}",
-                "data": output_content,
-                "format": format_used,
-                "analysis_language": language if format_used.startswith('llm_summary') else None, # Track lang only if summary generated
-                "metadata": metadata
-            })
+    # 3. Assemble the table_processed elements
+    processed_tables = []
+    for plan in plans:
+        i, metadata = plan["index"], plan["metadata"]
+        table_ref = f"table_{metadata.get('page_number', 'N')}_{metadata.get('table_index', i)}"
+        windows = plan["windows"]
+        for entry in windows:
+            if "prompt" in entry:
+                result = results[entry["prompt"]]
+                if isinstance(result, Exception):
+                    plan.setdefault("error", result)
+                    continue
+                entry["output"], entry["format"] = result.strip(), f"llm_{TABLE_OUTPUT_FORMAT}"
 
-        except Exception as e:
-            print(f"    Error processing table {i+1}: {e}")
+        if plan.get("error") is not None:
+            print(f"    Error processing table {i+1}: {plan['error']}")
             processed_tables.append({
-                "table_ref": f"table_{metadata.get('page_number', 'N')}_{metadata.get('table_index', i)}",
-                "data": f"Error processing table: {e}",
+                "table_ref": table_ref,
+                "data": f"Error processing table: {plan['error']}",
                 "format": "error",
                 "metadata": metadata
             })
+            continue
+
+        if len(windows) > 1 and separate_windows:
+            for window_index, entry in enumerate(windows):
+                processed_tables.append({
+                    "table_ref": f"{table_ref}_w{window_index + 1}",
+                    "data": entry["output"],
+                    "format": entry["format"],
+                    "analysis_language": plan["language"] if entry["format"].startswith('llm_summary') else None,
+                    "metadata": {**metadata, "table_window": {"index": window_index + 1, "count": len(windows),
+                                                              "first_row": entry["start"] + 1,
+                                                              "last_row": entry["start"] + entry["rows"]}}
+                })
+            continue
+
+        output_content = merge_window_outputs([entry["output"] for entry in windows]) if len(windows) > 1 else windows[0]["output"]
+        format_used = windows[0]["format"]
+        if len(windows) > 1:
+            metadata = {**metadata, "table_windows": len(windows)}
+        processed_tables.append({
+            "table_ref": table_ref,
+            "data": output_content,
+            "format": format_used,
+            "analysis_language": plan["language"] if format_used.startswith('llm_summary') else None, # Track lang only if summary generated
+            "metadata": metadata
+        })
 
     print(f"Finished table analysis. Processed {len(processed_tables)} tables.")
     return {"table_data": processed_tables}
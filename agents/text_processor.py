@@ -1,10 +1,15 @@
 import re
 import os
-from typing import Dict, Any, List
+import asyncio
+from typing import Dict, Any, List, Optional
 from graph_definition import GraphState
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from utils.llm_cache import acached_invoke
+from utils.async_utils import run_coroutine
+from utils.llm_provider import get_chat_model, lazy_resource
+from utils.header_footer import is_page_furniture
+from utils.tokenizer import count_tokens, tokenizer_name
 
 # Optional: NLTK for sentence splitting, SpaCy for NER
 # import nltk
@@ -27,10 +32,16 @@ USE_LLM_FOR_CLEANING = True
 PERFORM_NER = False
 USE_LLM_FOR_NER_ACRONYMS = True and USE_LLM_FOR_CLEANING
 DEFAULT_LANGUAGE = "English" # Fallback language
+# Max LLM requests in flight at once (blocks are processed concurrently, results keep their order).
+# Match it to what the Ollama host can serve in parallel (OLLAMA_NUM_PARALLEL).
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("TEXT_PROCESSOR_MAX_CONCURRENCY", 4))
+# Consecutive text blocks are consolidated into work units (one cleaning prompt each) of at most
+# TEXT_UNIT_MAX_TOKENS tokens (TEXT_UNIT_MAX_CHARS characters if no tokenizer is available,
+# see utils/tokenizer.py). With TEXT_UNIT_SPLIT_PAGES a unit never spans two pages.
+TEXT_UNIT_MAX_TOKENS = int(os.getenv("TEXT_UNIT_MAX_TOKENS", 1024))
+TEXT_UNIT_MAX_CHARS = int(os.getenv("TEXT_UNIT_MAX_CHARS", 4000))
+TEXT_UNIT_SPLIT_PAGES = os.getenv("TEXT_UNIT_SPLIT_PAGES", "true").lower() not in ("0", "false", "no", "off")
 
-# Initialize Ollama LLM
-llm = ChatOllama(model=os.getenv("TEXT_PROCESSOR_MODEL"), temperature=0)
-print(f"LLM model for text processing: {os.getenv("TABLE_ANALYZER_MODEL")}")
 
 # --- Basic Cleaning Functions ---
 def basic_text_cleaning(text: str) -> str:
@@ -73,14 +84,242 @@ cleaning_prompt_template = ChatPromptTemplate.from_messages([
     ("system", "You are an expert text processing assistant. Your task is to clean and reformat the provided text extracted from a PDF. Focus on creating well-structured paragraphs and sentences in {language}. Remove redundant whitespace, correct broken sentences, and eliminate artifacts like page numbers or simple headers/footers if they appear within the main text flow. Do NOT remove meaningful content. Preserve the original meaning and structure. If the text contains lists or code blocks, try to format them appropriately using markdown. Respond ONLY with the cleaned text."),
     ("user", "Please clean and reformat the following text:\n\n---\n{text_chunk}\n---")
 ])
-cleaning_chain = cleaning_prompt_template | llm | StrOutputParser()
 
 # NER/Acronym Prompt
 ner_acronym_prompt_template = ChatPromptTemplate.from_messages([
     ("system", "You are an expert linguistic analyst. Analyze the provided text chunk ({language}). Identify key Named Entities (like Person, Organization, Location, Date, Product) and any Acronyms used. For acronyms, provide their likely full form if discernible from the context or common knowledge. Present the results clearly in {language}. If no entities or acronyms are found, state that clearly in {language}.\n\nRespond ONLY in the following format:\nNamed Entities:\n[List entities here, e.g., PERSON: John Doe, ORG: Acme Corp]\n\nAcronyms:\n[List acronyms here, e.g., NLP: Natural Language Processing]"),
     ("user", "Analyze the following text for Named Entities and Acronyms:\n\n---\n{cleaned_text}\n---")
 ])
-ner_acronym_chain = ner_acronym_prompt_template | llm | StrOutputParser()
+
+
+# Ollama LLM (or the fake backend, see utils/llm_provider.py) and its chains are built on first use
+def _build_text_chains() -> Dict[str, Any]:
+    llm = get_chat_model(os.getenv("TEXT_PROCESSOR_MODEL"), temperature=0)
+    print(f"LLM model for text processing: {llm.model}")
+    return {
+        "llm": llm,
+        "cleaning": cleaning_prompt_template | llm | StrOutputParser(),
+        "ner_acronym": ner_acronym_prompt_template | llm | StrOutputParser(),
+    }
+
+text_chains = lazy_resource("text_processor.chains", _build_text_chains)
+
+
+# --- NER/Acronym output parsing ---
+def parse_ner_acronym_result(analysis_result: str):
+    """Parses the 'Named Entities:/Acronyms:' answer of ner_acronym_chain into (entities, acronyms) dicts."""
+    entities = {}
+    acronyms = {}
+    entities_str = re.search(r"Named Entities:\n(.*?)\n\nAcronyms:", analysis_result, re.DOTALL)
+    acronyms_str = re.search(r"Acronyms:\n(.*)", analysis_result, re.DOTALL)
+    if entities_str:
+        entities_list = entities_str.group(1).strip().split('\n')
+        for item in entities_list:
+            if ':' in item:
+                etype, evalue = item.split(':', 1)
+                if etype.strip() not in entities:
+                    entities[etype.strip()] = []
+                entities[etype.strip()].append(evalue.strip())
+    if acronyms_str:
+         acronyms_list = acronyms_str.group(1).strip().split('\n')
+         for item in acronyms_list:
+             if ':' in item:
+                 acr, full = item.split(':', 1)
+                 acronyms[acr.strip()] = full.strip()
+             else:
+                 if "detected" not in acronyms: acronyms["detected"] = []
+                 acronyms["detected"].append(item.strip())
+    return entities, acronyms
+
+
+# --- Per-block processing (async) ---
+async def _process_block(index: int, total: int, text_block: Dict[str, Any], language: str,
+                         llm_slots: asyncio.Semaphore, chains: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Cleans one consolidated block and runs NER/acronym detection on it, in the block's own
+    language (language is the document language, used if the block has none).
+    The two LLM calls of a block stay sequential (NER needs the cleaned text); llm_slots
+    bounds how many LLM requests are in flight across all blocks.
+    chains is None if the LLM could not be initialized (basic cleaning only).
+    """
+    print(f"  Processing block {index+1}/{total}...")
+    original_text = text_block["content"]
+    metadata = text_block["metadata"]
+    language = metadata.get("language") or language # Per-element language, document language as fallback
+    cleaned_text = ""
+    entities = {}
+    acronyms = {}
+
+    use_llm_cleaning = USE_LLM_FOR_CLEANING and chains is not None
+    if use_llm_cleaning:
+        try:
+            # Pass language to the chain
+            async with llm_slots:
+                cleaned_text = await acached_invoke(chains["cleaning"], {
+                    "text_chunk": original_text,
+                    "language": language
+                }, model=chains["llm"].model, prompt=cleaning_prompt_template, language=language)
+        except Exception as e:
+            print(f"    Block {index+1}: LLM cleaning failed: {e}. Falling back to basic cleaning.")
+            cleaned_text = basic_text_cleaning(original_text)
+    else:
+        cleaned_text = basic_text_cleaning(original_text)
+
+    # --- Optional: NER and Acronym Handling ---
+    if PERFORM_NER and nlp_ner:
+        # ... (SpaCy NER logic - might need language-specific model)
+        # Consider loading a language-specific spaCy model based on 'language' if available
+        # doc = nlp_ner(cleaned_text)
+        # entities = ...
+        # acronyms = ...
+        pass # Placeholder
+
+    elif USE_LLM_FOR_NER_ACRONYMS and chains is not None:
+        try:
+            # Pass language and cleaned text to the chain
+            async with llm_slots:
+                analysis_result = await acached_invoke(chains["ner_acronym"], {
+                    "cleaned_text": cleaned_text,
+                    "language": language
+                }, model=chains["llm"].model, prompt=ner_acronym_prompt_template, language=language)
+            entities, acronyms = parse_ner_acronym_result(analysis_result)
+            print(f"    Block {index+1}: LLM analysis found {len(entities)} entity types, {len(acronyms)} acronyms.")
+        except Exception as e:
+            print(f"    Block {index+1}: LLM NER/Acronym analysis failed: {e}")
+
+    return {
+        "text": cleaned_text,
+        "metadata": {
+            **metadata,
+            "cleaned_with": "llm" if use_llm_cleaning else "basic",
+            "entities": entities if entities else None,
+            "acronyms": acronyms if acronyms else None,
+            "processed_language": language # Add language used for processing
+        }
+    }
+
+
+async def _process_blocks(text_to_process: List[Dict[str, Any]], language: str) -> List[Dict[str, Any]]:
+    """Processes all blocks concurrently; results come back in the original block order."""
+    llm_slots = asyncio.Semaphore(max(1, MAX_CONCURRENT_LLM_CALLS))
+    # Built here, once, before the blocks start (and not at all for documents without text)
+    chains = text_chains.get() if (USE_LLM_FOR_CLEANING or USE_LLM_FOR_NER_ACRONYMS) and text_to_process else None
+    return await asyncio.gather(*(
+        _process_block(i, len(text_to_process), text_block, language, llm_slots, chains)
+        for i, text_block in enumerate(text_to_process)
+    ))
+
+
+# --- Work units ---
+def _unit_budget():
+    """(length function, max length) of a work unit: tokens if a tokenizer is available, else characters."""
+    if tokenizer_name():
+        return count_tokens, TEXT_UNIT_MAX_TOKENS
+    return len, TEXT_UNIT_MAX_CHARS
+
+
+# Boundaries an oversized block is split at, coarsest first: (split pattern, joiner)
+OVERSIZED_SPLIT_LEVELS = [(r"\n", "\n"), (r"(?<=[.!?])\s+", " "), (r"\s+", " ")]
+
+
+def _pack(segments: List[str], joiner: str, length_function, max_length: int) -> List[str]:
+    """Joins consecutive segments into pieces within the budget (a segment over it stays a piece of its own)."""
+    pieces, current = [], ""
+    for segment in segments:
+        candidate = f"{current}{joiner}{segment}" if current else segment
+        if current and length_function(candidate) > max_length:
+            pieces.append(current)
+            current = segment
+        else:
+            current = candidate
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def _cut(text: str, length_function, max_length: int) -> List[str]:
+    """Cuts text without any boundary into pieces of the longest prefix within the budget."""
+    pieces = []
+    while text:
+        low, high = 1, len(text) # Binary search: the length function may count tokens
+        while low < high:
+            middle = (low + high + 1) // 2
+            if length_function(text[:middle]) <= max_length:
+                low = middle
+            else:
+                high = middle - 1
+        pieces.append(text[:low])
+        text = text[low:]
+    return pieces
+
+
+def _split_oversized(text: str, length_function, max_length: int, level: int = 0) -> List[str]:
+    """
+    Splits a single block longer than the budget at line breaks, then sentence ends, then
+    spaces (see OVERSIZED_SPLIT_LEVELS); a piece without any of them is cut at the budget.
+    """
+    if level == len(OVERSIZED_SPLIT_LEVELS):
+        return _cut(text, length_function, max_length)
+    pattern, joiner = OVERSIZED_SPLIT_LEVELS[level]
+    pieces = []
+    for piece in _pack(re.split(pattern, text), joiner, length_function, max_length):
+        if length_function(piece) > max_length:
+            pieces.extend(_split_oversized(piece, length_function, max_length, level + 1))
+        else:
+            pieces.append(piece)
+    return pieces
+
+
+def consolidate_text_blocks(raw_elements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Groups consecutive text elements into bounded work units.
+    A unit ends at a non-text element, at a page change (TEXT_UNIT_SPLIT_PAGES), at a language
+    change (per-element 'language' of the language detector) and before it would exceed the
+    length budget (see _unit_budget). Each unit keeps the metadata of its first element plus
+    'page_numbers', 'page_start'/'page_end', 'bboxes' (one per source block) and 'element_count'.
+    """
+    length_function, max_length = _unit_budget()
+    separator_length = length_function("\n\n")
+    units = []
+    parts, blocks, length = [], [], 0
+
+    def flush():
+        nonlocal parts, blocks, length
+        if parts:
+            pages = sorted({block.get("page_number") for block in blocks if block.get("page_number") is not None})
+            units.append({"content": "\n\n".join(parts).strip(), "metadata": {
+                **blocks[0],
+                "page_numbers": pages,
+                "page_start": pages[0] if pages else None,
+                "page_end": pages[-1] if pages else None,
+                "bboxes": [block.get("bbox") for block in blocks],
+                "element_count": len(blocks),
+            }})
+        parts, blocks, length = [], [], 0
+
+    for element in raw_elements:
+        if is_page_furniture(element):
+            continue # Running header/footer tagged by the parser (HEADER_FOOTER_POLICY=tag)
+        if element.get("type") != "text" or not element.get("content"):
+            flush()
+            continue
+        metadata = element.get("metadata", {})
+        if TEXT_UNIT_SPLIT_PAGES and blocks and metadata.get("page_number") != blocks[-1].get("page_number"):
+            flush()
+        if blocks and metadata.get("language") != blocks[-1].get("language"):
+            flush() # One language per unit: it is processed with its own prompt language
+        content = element["content"]
+        content_length = length_function(content)
+        pieces = _split_oversized(content, length_function, max_length) if content_length > max_length else [content]
+        for piece in pieces:
+            piece_length = length_function(piece) if len(pieces) > 1 else content_length
+            if parts and length + separator_length + piece_length > max_length:
+                flush()
+            parts.append(piece)
+            blocks.append(metadata)
+            length += (separator_length if length else 0) + piece_length
+    flush()
+    return units
 
 
 # --- Main Agent Function ---
@@ -93,106 +332,15 @@ def process_text(state: GraphState) -> Dict[str, Any]:
     raw_elements = state.get("raw_elements", [])
     # Get detected language from state, fallback to default
     language = state.get("language", DEFAULT_LANGUAGE)
-    print(f"  Using language: {language}")
+    print(f"  Document language: {language} (blocks are processed in their own language)")
 
-    processed_chunks = []
-    text_to_process = []
-    # --- Consolidate text blocks (same as before) ---
-    current_text_block = ""
-    current_metadata = {}
-    for element in raw_elements:
-        if element.get("type") == "text" and element.get("content"):
-            if not current_text_block:
-                current_metadata = element.get("metadata", {})
-            current_text_block += element["content"] + "\n\n"
-        else:
-            if current_text_block:
-                text_to_process.append({"content": current_text_block.strip(), "metadata": current_metadata})
-                current_text_block = ""
-                current_metadata = {}
-    if current_text_block:
-        text_to_process.append({"content": current_text_block.strip(), "metadata": current_metadata})
-
-    print(f"Consolidated into {len(text_to_process)} text blocks for processing.")
-
-    for i, text_block in enumerate(text_to_process):
-        print(f"  Processing block {i+1}/{len(text_to_process)}...")
-        original_text = text_block["content"]
-        metadata = text_block["metadata"]
-        cleaned_text = ""
-        entities = {}
-        acronyms = {}
-
-        if USE_LLM_FOR_CLEANING:
-            print("    Cleaning with LLM...")
-            try:
-                # Pass language to the chain
-                cleaned_text = cleaning_chain.invoke({
-                    "text_chunk": original_text,
-                    "language": language
-                })
-            except Exception as e:
-                print(f"    LLM cleaning failed: {e}. Falling back to basic cleaning.")
-                cleaned_text = basic_text_cleaning(original_text)
-        else:
-            print("    Cleaning with basic rules...")
-            cleaned_text = basic_text_cleaning(original_text)
+    # --- Consolidate text blocks into bounded, page-aware work units ---
+    text_to_process = consolidate_text_blocks(raw_elements)
 
-        # --- Optional: NER and Acronym Handling ---
-        if PERFORM_NER and nlp_ner:
-            # ... (SpaCy NER logic - might need language-specific model)
-            print("    Performing NER with spaCy...")
-            # Consider loading a language-specific spaCy model based on 'language' if available
-            # doc = nlp_ner(cleaned_text)
-            # entities = ...
-            # acronyms = ...
-            pass # Placeholder
-
-        elif USE_LLM_FOR_NER_ACRONYMS:
-            print("    Performing NER/Acronym detection with LLM...")
-            try:
-                # Pass language and cleaned text to the chain
-                analysis_result = ner_acronym_chain.invoke({
-                    "cleaned_text": cleaned_text,
-                    "language": language
-                })
-                # --- Parse LLM output (same logic as before) ---
-                entities_str = re.search(r"Named Entities:\n(.*?)\n\nAcronyms:", analysis_result, re.DOTALL)
-                acronyms_str = re.search(r"Acronyms:\n(.*)", analysis_result, re.DOTALL)
-                if entities_str:
-                    entities_list = entities_str.group(1).strip().split('\n')
-                    entities = {}
-                    for item in entities_list:
-                        if ':' in item:
-                            etype, evalue = item.split(':', 1)
-                            if etype.strip() not in entities:
-                                entities[etype.strip()] = []
-                            entities[etype.strip()].append(evalue.strip())
-                if acronyms_str:
-                     acronyms_list = acronyms_str.group(1).strip().split('\n')
-                     acronyms = {}
-                     for item in acronyms_list:
-                         if ':' in item:
-                             acr, full = item.split(':', 1)
-                             acronyms[acr.strip()] = full.strip()
-                         else:
-                             if "detected" not in acronyms: acronyms["detected"] = []
-                             acronyms["detected"].append(item.strip())
-                print(f"    LLM analysis found: {len(entities)} entity types, {len(acronyms)} acronyms.")
-            except Exception as e:
-                print(f"    LLM NER/Acronym analysis failed: {e}")
-
-        # --- Store processed chunk ---
-        processed_chunks.append({
-            "text": cleaned_text,
-            "metadata": {
-                **metadata,
-                "cleaned_with": "llm" if USE_LLM_FOR_CLEANING else "basic",
-                "entities": entities if entities else None,
-                "acronyms": acronyms if acronyms else None,
-                "processed_language": language # Add language used for processing
-            }
-        })
+    print(f"Consolidated into {len(text_to_process)} text blocks for processing "
+          f"(max {MAX_CONCURRENT_LLM_CALLS} LLM requests in flight).")
+
+    processed_chunks = run_coroutine(_process_blocks(text_to_process, language))
 
     print(f"Finished processing text. Generated {len(processed_chunks)} processed chunks.")
     return {"processed_text_chunks": processed_chunks}
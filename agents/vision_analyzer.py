@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import base64
+from typing import Dict, Any, List, Optional
+from graph_definition import GraphState
+import fitz # To extract image bytes
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from utils.llm_cache import cached_invoke
+from utils.chart_classifier import classify_chart
+from utils.image_utils import prepare_image_for_vision
+from utils.image_filter import split_image_refs, reuse_analysis
+from utils.llm_provider import get_chat_model, lazy_resource
+
+# --- Configuration ---
+USE_MULTIMODAL_LLM = True
+DEFAULT_LANGUAGE = "English" # Fallback language
+# Local pre-classifier: images it confidently rejects as charts (photos, logos) get the
+# shorter image-only prompt instead of the combined image + chart prompt.
+USE_CHART_PREFILTER = os.getenv("CHART_PREFILTER", "true").lower() not in ("0", "false", "no", "off")
+CHART_PREFILTER_MIN_CONFIDENCE = 0.55
+
+# One Ollama client for the combined image + chart analysis, built on first use.
+# format="json" makes Ollama constrain the answer to a JSON object.
+def _build_vision_llm():
+    llm = get_chat_model(os.getenv("IMAGE_ANALYZER_MODEL"), temperature=0, format="json")
+    print(f"Initialized Ollama for combined image/chart analysis ({llm.model}).")
+    return llm
+
+vision_llm = lazy_resource("vision_analyzer.llm", _build_vision_llm)
+
+
+def build_vision_prompt(language: str, include_chart: bool = True) -> ChatPromptTemplate:
+    """
+    Builds the single structured prompt that replaces the separate image and chart prompts.
+    The image is passed as the {img_base64} and {img_mime} variables. With include_chart=False the chart
+    questions are left out (used for images the pre-classifier rejected as charts).
+    """
+    prompt = (f"Analyze this image and answer in {language}. "
+              "Respond ONLY with a JSON object with exactly these keys: "
+              f"\"description\" (a detailed description of what the image shows, in {language}), "
+              "\"ocr_text\" (all visible text extracted exactly as it appears, or null if there is none)")
+    if include_chart:
+        prompt += (", \"is_chart\" (true if the image is a chart or graph, otherwise false), "
+                   "\"chart_type\" (e.g. bar, line, pie; null if it is not a chart), "
+                   f"\"chart_summary\" (if it is a chart: the title, axis labels, main data, key trends and insights, in {language}; otherwise null)")
+    prompt += ". NO FURTHER EXPLANATION, JUST PROVIDE THE RESULT."
+    system_message_template = SystemMessagePromptTemplate.from_template(
+        "You are an assistant tasked with describing images and charts")
+    human_message_template = HumanMessagePromptTemplate.from_template([
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": "data:{img_mime};base64,{img_base64}",
+            },
+        },
+        {
+            "type": "text",
+            "text": prompt
+        },
+    ])
+    return ChatPromptTemplate.from_messages([system_message_template, human_message_template])
+
+
+def parse_vision_result(llm_result: str) -> Dict[str, Any]:
+    """
+    Parses the model's JSON answer. Falls back to treating the whole answer as a
+    plain description if the model did not return valid JSON.
+    """
+    text = llm_result.strip()
+    # Tolerate ```json fences around the object
+    fenced = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        parsed = json.loads(fenced.group(0) if fenced else text)
+        if not isinstance(parsed, dict):
+            raise ValueError("not a JSON object")
+    except (ValueError, json.JSONDecodeError):
+        return {"description": text, "ocr_text": None, "is_chart": False, "chart_type": None, "chart_summary": None}
+
+    is_chart = parsed.get("is_chart")
+    if isinstance(is_chart, str):
+        is_chart = is_chart.strip().lower() in ("true", "yes", "1")
+
+    def _clean(value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        value = str(value).strip()
+        return value if value and value.lower() not in ("null", "none", "n/a") else None
+
+    return {
+        "description": _clean(parsed.get("description")) or "",
+        "ocr_text": _clean(parsed.get("ocr_text")),
+        "is_chart": bool(is_chart),
+        "chart_type": _clean(parsed.get("chart_type")),
+        "chart_summary": _clean(parsed.get("chart_summary")),
+    }
+
+
+def _prefilter_metadata(prefilter: Optional[Dict[str, Any]], routed_to_chart_prompt: bool) -> Optional[Dict[str, Any]]:
+    """Compact, JSON-friendly record of the pre-classifier decision."""
+    if not prefilter:
+        return None
+    return {
+        "is_chart": prefilter["is_chart"],
+        "confidence": prefilter["confidence"],
+        "score": prefilter["score"],
+        "routed_to_chart_prompt": routed_to_chart_prompt,
+    }
+
+
+def analyze_visuals(state: GraphState) -> Dict[str, Any]:
+    """
+    Agent 3+4: Analyzes every image once with a single structured multimodal call
+    that returns the description, OCR text, a chart flag and a chart summary.
+    Fills both 'image_descriptions' and 'chart_summaries' (charts only).
+    """
+    print("Analyzing images and charts (single multimodal pass)...")
+    raw_elements = state.get("raw_elements", [])
+    pdf_path = state["pdf_path"]
+    # Get detected language from state, fallback to default
+    language = state.get("language") or DEFAULT_LANGUAGE
+    print(f"  Document language: {language} (images use the language of their page)")
+
+    image_descriptions = []
+    chart_summaries = []
+    doc = None
+
+    image_refs = [el for el in raw_elements if el.get("type") == "image_ref"]
+    if not image_refs:
+        print("No image references found to analyze.")
+        return {}
+
+    print(f"Found {len(image_refs)} image references.")
+    # The parser's image filter marks tiny/decorative images as skipped and repeated ones as reusing one analysis
+    image_refs, reused_refs = split_image_refs(image_refs)
+    if reused_refs or not image_refs:
+        print(f"  Analyzing {len(image_refs)} images; {len(reused_refs)} reuse another image's analysis.")
+
+    llm_vision = vision_llm.get() if USE_MULTIMODAL_LLM else None
+    vision_chains = {} # (language, include_chart) -> (prompt, chain), built on first use
+
+    def _vision_chain(image_language: str, include_chart: bool):
+        if (image_language, include_chart) not in vision_chains:
+            prompt = build_vision_prompt(image_language, include_chart)
+            vision_chains[(image_language, include_chart)] = (prompt, prompt | llm_vision | StrOutputParser())
+        return vision_chains[(image_language, include_chart)]
+
+    try:
+        if llm_vision:
+            doc = fitz.open(pdf_path)
+
+        for i, img_ref in enumerate(image_refs):
+            img_metadata = img_ref.get("metadata", {})
+            img_name = img_ref.get("content", f"image_{i}")
+            xref = img_metadata.get("xref")
+            image_language = img_metadata.get("language") or language # Per-element language from the language detector
+            print(f"  Analyzing image {i+1}/{len(image_refs)}: {img_name} (xref: {xref})")
+
+            result = {"description": f"Image: {img_name}", "ocr_text": None, "is_chart": False,
+                      "chart_type": None, "chart_summary": None}
+            analysis_method = "none"
+            image_bytes = None
+            prepared = None
+
+            # --- Get Image Data (extracted and decoded once, used for both analyses) ---
+            if xref and doc:
+                try:
+                    base_image = doc.extract_image(xref)
+                    if base_image:
+                        image_bytes = base_image["image"]
+                        prepared = prepare_image_for_vision(image_bytes, base_image.get("ext"), doc, xref)
+                    else: print(f"    Could not extract image for xref {xref}.")
+                except Exception as e: print(f"    Error extracting image bytes for xref {xref}: {e}")
+
+            # --- Cheap local chart pre-check (on the already decoded image) ---
+            prefilter = None
+            if USE_CHART_PREFILTER and prepared:
+                prefilter = classify_chart(image_bytes, prepared["image"], prepared["original_size"])
+            include_chart = not (prefilter and not prefilter["is_chart"]
+                                 and prefilter["confidence"] >= CHART_PREFILTER_MIN_CONFIDENCE)
+            if prefilter:
+                print(f"    Chart pre-filter: is_chart={prefilter['is_chart']} (confidence {prefilter['confidence']})"
+                      f"{'' if include_chart else ' -> image-only prompt'}")
+
+            # --- One multimodal call per image ---
+            if llm_vision and prepared:
+                try:
+                    img_base64 = base64.b64encode(prepared["data"]).decode('utf-8')
+                    vision_prompt, vision_chain = _vision_chain(image_language, include_chart)
+                    llm_result = cached_invoke(vision_chain,
+                                               {"img_base64": img_base64, "img_mime": prepared["mime_type"]},
+                                               model=llm_vision.model,
+                                               prompt=vision_prompt, language=image_language)
+                    print(f"    LLM Result (raw): {llm_result[:100]}...")
+                    result = parse_vision_result(llm_result)
+                    if not include_chart:
+                        result["is_chart"] = False
+                    analysis_method = "llm_combined" if include_chart else "llm_image_only"
+                except Exception as e:
+                    print(f"    Multi-modal LLM analysis failed: {e}")
+
+            # --- Store Results ---
+            image_descriptions.append({
+                "image_ref": img_name,
+                "description": result["description"] or f"Image: {img_name}",
+                "ocr_text": result["ocr_text"],
+                "analysis_method": analysis_method,
+                "analysis_language": image_language, # Store language used
+                "metadata": {**img_metadata, "is_chart": result["is_chart"],
+                             "chart_prefilter": _prefilter_metadata(prefilter, include_chart),
+                             "image_preprocessing": prepared["metadata"] if prepared else None}
+            })
+            if result["is_chart"]:
+                summary = result["chart_summary"] or result["description"]
+                if result["chart_type"]:
+                    summary = f"{result['chart_type']} chart. {summary}"
+                chart_summaries.append({
+                    "chart_ref": img_name,
+                    "summary": summary,
+                    "chart_type": result["chart_type"],
+                    "analysis_method": analysis_method,
+                    "analysis_language": image_language,
+                    "metadata": img_metadata
+                })
+
+        image_descriptions.extend(reuse_analysis(reused_refs, image_descriptions, "image_ref"))
+        chart_summaries.extend(reuse_analysis(reused_refs, chart_summaries, "chart_ref"))
+
+    except Exception as e:
+        print(f"Error during image/chart analysis setup or loop: {e}")
+        raise e
+    finally:
+        if doc: doc.close()
+
+    print(f"Finished image/chart analysis. Generated {len(image_descriptions)} descriptions and {len(chart_summaries)} chart summaries.")
+    return {"image_descriptions": image_descriptions, "chart_summaries": chart_summaries}
@@ -0,0 +1,185 @@
+import os
+import glob
+import time
+import argparse
+import traceback
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# Importing main loads the .env file and the graph builders
+from main import compile_app, run_document, run_document_streaming, run_document_incremental
+from utils.file_handler import save_json_output
+from utils.metrics import write_prometheus_metrics
+
+# Compiled graph of the current worker process (process pool) or of the whole batch (thread pool).
+# Compiling once per worker means langchain and every ChatOllama client are set up once, not per file.
+_worker_app = None
+
+
+def collect_pdf_paths(input_path: str, recursive: bool = False) -> List[str]:
+    """
+    Resolves a directory, a single file or a glob pattern into a sorted list of PDF paths.
+    """
+    if os.path.isdir(input_path):
+        pattern = os.path.join(input_path, "**", "*.pdf") if recursive else os.path.join(input_path, "*.pdf")
+        paths = glob.glob(pattern, recursive=recursive)
+        # Also pick up upper-case extensions
+        paths += glob.glob(pattern[:-len("*.pdf")] + "*.PDF", recursive=recursive)
+    elif os.path.isfile(input_path):
+        paths = [input_path]
+    else:
+        paths = glob.glob(input_path, recursive=True)
+    return sorted({p for p in paths if os.path.isfile(p) and p.lower().endswith(".pdf")})
+
+
+def output_path_for(pdf_path: str, input_root: str, output_dir: str) -> str:
+    """Mirrors the PDF's location below input_root into output_dir, with a .json extension."""
+    relative_path = os.path.relpath(pdf_path, input_root)
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + ".json")
+
+
+def _init_worker(parallel: bool, checkpoint: bool = True):
+    """Process pool initializer: compile the graph once per worker process."""
+    global _worker_app
+    _worker_app = compile_app(parallel=parallel, checkpoint=checkpoint)
+
+
+def _process_document(pdf_path: str, output_path: str, stream_pages: Optional[int] = None,
+                      incremental: bool = False, resume: bool = False) -> Dict[str, Any]:
+    """Runs one document with the worker's compiled graph. Never raises, so one bad PDF can't stop the batch."""
+    start_time = time.perf_counter()
+    try:
+        if incremental:
+            return run_document_incremental(_worker_app, pdf_path, output_path, resume=resume)
+        if stream_pages:
+            return run_document_streaming(_worker_app, pdf_path, output_path, stream_pages, resume=resume)
+        return run_document(_worker_app, pdf_path, output_path, resume=resume)
+    except Exception as e:
+        print(f"!!! Unhandled error while processing {pdf_path}: {e} !!!")
+        traceback.print_exc()
+        return {
+            "pdf_path": pdf_path,
+            "status": "error",
+            "output_path": None,
+            "chunk_count": 0,
+            "page_count": None,
+            "error": str(e),
+            "seconds": round(time.perf_counter() - start_time, 3),
+        }
+
+
+def run_batch(input_path: str, output_dir: str, workers: int = 2, executor: str = "thread",
+              parallel: bool = True, recursive: bool = False, manifest_path: Optional[str] = None,
+              stream_pages: Optional[int] = None, incremental: bool = False,
+              checkpoint: bool = True, resume: bool = False,
+              prometheus_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Processes every PDF found at input_path on a worker pool and writes a summary manifest.
+
+    Args:
+        input_path: Directory, single PDF or glob pattern (e.g. "inbox/**/*.pdf").
+        output_dir: Directory for the per-document JSON outputs (mirrors the input layout).
+        workers: Number of documents processed at the same time.
+        executor: "thread" (one compiled graph shared by all threads) or
+                  "process" (one compiled graph per worker process, better for CPU-bound parsing).
+        parallel: Whether the analysis agents run as parallel graph branches.
+        recursive: Whether to search sub-directories when input_path is a directory.
+        manifest_path: Where to write the manifest (default: <output_dir>/manifest.json).
+        stream_pages: If set, every document is processed in windows of this many pages (JSONL output).
+        incremental: If True, documents with a previous output only reprocess their changed pages.
+        checkpoint: Save graph checkpoints so failed documents can be resumed.
+        resume: Resume documents that failed in a previous batch from their last successful agent.
+        prometheus_path: If set, also write the per-agent metrics of all documents to this
+                         file in the Prometheus text format.
+
+    Returns:
+        The manifest dictionary.
+    """
+    global _worker_app
+
+    pdf_paths = collect_pdf_paths(input_path, recursive=recursive)
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.json")
+    print(f"--- Batch: found {len(pdf_paths)} PDF files in {input_path} ---")
+
+    if os.path.isdir(input_path) or not pdf_paths:
+        input_root = input_path
+    else:
+        # Glob or single file: mirror relative to the deepest common directory
+        input_root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in pdf_paths])
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    batch_start = time.perf_counter()
+    documents = []
+
+    if executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(parallel, checkpoint or resume))
+    else:
+        # Threads share a single compiled graph
+        _worker_app = compile_app(parallel=parallel, checkpoint=checkpoint or resume)
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    with pool:
+        futures = {
+            pool.submit(_process_document, pdf_path, output_path_for(pdf_path, input_root, output_dir),
+                        stream_pages, incremental, resume): pdf_path
+            for pdf_path in pdf_paths
+        }
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            pdf_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. a worker process crashed
+                result = {"pdf_path": pdf_path, "status": "error", "output_path": None,
+                          "chunk_count": 0, "page_count": None, "error": str(e), "seconds": None}
+            documents.append(result)
+            print(f"--- Batch progress: {done_count}/{len(pdf_paths)} ({result['status']}) {pdf_path} ---")
+
+    documents.sort(key=lambda doc: doc["pdf_path"])
+    status_counts = {}
+    for doc in documents:
+        status_counts[doc["status"]] = status_counts.get(doc["status"], 0) + 1
+
+    manifest = {
+        "input": input_path,
+        "output_dir": output_dir,
+        "executor": executor,
+        "workers": workers,
+        "started_at": started_at,
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "total_seconds": round(time.perf_counter() - batch_start, 3),
+        "document_count": len(documents),
+        "status_counts": status_counts,
+        "total_chunks": sum(doc.get("chunk_count") or 0 for doc in documents),
+        "documents": documents,
+    }
+    save_json_output(manifest, manifest_path)
+    if prometheus_path:
+        write_prometheus_metrics(documents, prometheus_path)
+    print(f"--- Batch finished: {status_counts} in {manifest['total_seconds']}s. Manifest: {manifest_path} ---")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the PDF Processing Pipeline on a directory (or glob) of PDF files.")
+    parser.add_argument("input", help="Directory containing PDF files, a single PDF, or a glob pattern (quote it).")
+    parser.add_argument("-o", "--output-dir", default="output", help="Directory for the per-document JSON outputs (default: output).")
+    parser.add_argument("-w", "--workers", type=int, default=int(os.getenv("BATCH_WORKERS", 2)), help="Number of documents processed concurrently (default: 2 or $BATCH_WORKERS).")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread", help="Worker pool type (default: thread).")
+    parser.add_argument("--recursive", action="store_true", help="Search sub-directories when the input is a directory.")
+    parser.add_argument("--manifest", default=None, help="Path of the summary manifest (default: <output-dir>/manifest.json).")
+    parser.add_argument("--sequential", action="store_true", help="Run the text/vision/table agents one after another inside each document.")
+    parser.add_argument("--stream-pages", type=int, default=None, metavar="N", help="Process each document in N-page windows and write .jsonl outputs incrementally.")
+    parser.add_argument("--incremental", action="store_true", help="Reprocess only the changed pages of documents that already have an output.")
+    parser.add_argument("--resume", action="store_true", help="Resume documents that failed in a previous batch from their last successful agent.")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not save graph checkpoints.")
+    parser.add_argument("--prometheus", default=None, metavar="PATH", help="Also write the per-agent metrics of all documents to PATH in the Prometheus text format.")
+
+    args = parser.parse_args()
+    run_batch(args.input, args.output_dir, workers=max(1, args.workers), executor=args.executor,
+              parallel=(not args.sequential), recursive=args.recursive, manifest_path=args.manifest,
+              stream_pages=args.stream_pages, incremental=args.incremental,
+              checkpoint=(not args.no_checkpoint), resume=args.resume,
+              prometheus_path=args.prometheus)
@@ -0,0 +1,174 @@
+import os
+import random
+import argparse
+from typing import Dict, Optional
+
+import fitz
+
+# Synthetic benchmark PDFs with a controlled size and content mix.
+# The same (pages, mix, seed) always produces the same content, so runs are comparable.
+
+# Share of pages of each kind; "columns" are two-column text pages.
+DEFAULT_MIX = {"text": 0.5, "columns": 0.2, "table": 0.2, "image": 0.1}
+
+PRESETS = {
+    "small": {"pages": 5, "mix": DEFAULT_MIX},
+    "medium": {"pages": 50, "mix": DEFAULT_MIX},
+    "large": {"pages": 200, "mix": DEFAULT_MIX},
+    "text_only": {"pages": 50, "mix": {"text": 0.7, "columns": 0.3}},
+    "tables": {"pages": 30, "mix": {"text": 0.3, "table": 0.7}},
+    "images": {"pages": 30, "mix": {"text": 0.4, "image": 0.6}},
+}
+
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+MARGIN = 56
+WORDS = ("analysis report market growth revenue quarter customer product service system data model "
+         "network process result region team strategy increase decrease forecast budget policy risk "
+         "operation performance quality research development support platform security cloud value "
+         "energy supply demand contract partner project delivery software hardware training").split()
+ACRONYMS = ["API", "GDP", "CEO", "ROI", "KPI", "EBITDA", "SLA", "ESG"]
+NAMES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Vandelay", "Stark", "Wayne"]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), rng.choice(NAMES))
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), rng.choice(ACRONYMS))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 7)))
+
+
+def _draw_text_page(page: fitz.Page, rng: random.Random, columns: int = 1):
+    page.insert_text((MARGIN, MARGIN), f"Section {page.number + 1}: {rng.choice(WORDS).title()} {rng.choice(WORDS)}",
+                     fontsize=14)
+    gap = 18
+    column_width = (PAGE_WIDTH - 2 * MARGIN - gap * (columns - 1)) / columns
+    for column in range(columns):
+        x0 = MARGIN + column * (column_width + gap)
+        text = "\n\n".join(_paragraph(rng) for _ in range(4 if columns == 1 else 3))
+        page.insert_textbox(fitz.Rect(x0, MARGIN + 24, x0 + column_width, PAGE_HEIGHT - MARGIN - 24),
+                            text, fontsize=10)
+    page.insert_text((PAGE_WIDTH / 2 - 10, PAGE_HEIGHT - MARGIN / 2), str(page.number + 1), fontsize=9)
+
+
+def _draw_table_page(page: fitz.Page, rng: random.Random):
+    page.insert_textbox(fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, MARGIN + 90), _paragraph(rng), fontsize=10)
+    rows, cols = rng.randint(6, 14), rng.randint(3, 6)
+    x0, y0 = MARGIN, MARGIN + 110
+    cell_width, cell_height = (PAGE_WIDTH - 2 * MARGIN) / cols, 20
+    header = [rng.choice(WORDS).title() for _ in range(cols)]
+    # Ruled grid so PyMuPDF's find_tables (line strategy) detects it
+    for r in range(rows + 2):
+        y = y0 + r * cell_height
+        page.draw_line((x0, y), (x0 + cols * cell_width, y), width=0.6)
+    for c in range(cols + 1):
+        x = x0 + c * cell_width
+        page.draw_line((x, y0), (x, y0 + (rows + 1) * cell_height), width=0.6)
+    for r in range(rows + 1):
+        for c in range(cols):
+            value = header[c] if r == 0 else (rng.choice(NAMES) if c == 0 else f"{rng.uniform(0, 10000):.2f}")
+            page.insert_text((x0 + c * cell_width + 4, y0 + r * cell_height + 14), value, fontsize=9)
+
+
+def _raster(rng: random.Random, width: int, height: int, kind: str) -> fitz.Pixmap:
+    """A 'photo' (noisy gradients) or a flat-colored bar 'chart' raster."""
+    samples = bytearray(width * height * 3)
+    if kind == "chart":
+        samples[:] = b"\xff" * len(samples)
+        bars = rng.randint(4, 8)
+        bar_width = width // (bars * 2)
+        for b in range(bars):
+            bar_height = rng.randint(height // 5, height - 10)
+            color = bytes(rng.choice([(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40)]))
+            for y in range(height - bar_height, height - 2):
+                start = (y * width + bar_width * (2 * b + 1)) * 3
+                samples[start:start + bar_width * 3] = color * bar_width
+        for x in range(width): # x axis
+            samples[((height - 2) * width + x) * 3:((height - 2) * width + x) * 3 + 3] = b"\x00\x00\x00"
+    else:
+        base = [rng.randint(0, 255) for _ in range(3)]
+        for y in range(height):
+            for x in range(width):
+                offset = (y * width + x) * 3
+                samples[offset:offset + 3] = bytes((base[i] + x * (i + 1) + y * (3 - i) + rng.randint(0, 40)) % 256
+                                                   for i in range(3))
+    return fitz.Pixmap(fitz.csRGB, width, height, bytes(samples), 0)
+
+
+def _draw_image_page(page: fitz.Page, rng: random.Random):
+    page.insert_textbox(fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, MARGIN + 120), _paragraph(rng), fontsize=10)
+    for i in range(rng.randint(1, 2)):
+        kind = rng.choice(["photo", "chart"])
+        pixmap = _raster(rng, 320, 200, kind)
+        top = MARGIN + 140 + i * 260
+        page.insert_image(fitz.Rect(MARGIN, top, MARGIN + 320, top + 200), pixmap=pixmap)
+        page.insert_text((MARGIN, top + 215), f"Figure {page.number + 1}.{i + 1}: {kind}", fontsize=9)
+
+
+def generate_pdf(output_path: str, pages: int, mix: Optional[Dict[str, float]] = None, seed: int = 0) -> str:
+    """
+    Writes a synthetic PDF of `pages` pages whose page kinds follow `mix`
+    (text, columns, table, image shares; normalized). Returns output_path.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    total = sum(mix.values())
+    # Deterministic page plan with the exact requested proportions, interleaved
+    plan = []
+    for kind, share in mix.items():
+        plan.extend([kind] * round(pages * share / total))
+    plan = (plan + ["text"] * pages)[:pages]
+    rng.shuffle(plan)
+
+    doc = fitz.open()
+    for kind in plan:
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if kind == "table":
+            _draw_table_page(page, rng)
+        elif kind == "image":
+            _draw_image_page(page, rng)
+        else:
+            _draw_text_page(page, rng, columns=2 if kind == "columns" else 1)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    doc.set_metadata({"title": os.path.basename(output_path), "producer": "poly-parser benchmarks"})
+    doc.save(output_path, garbage=3, deflate=True)
+    doc.close()
+    return output_path
+
+
+def generate_preset(name: str, output_dir: str, seed: int = 0) -> str:
+    """Generates (or reuses, if already present) the PDF of a named preset."""
+    preset = PRESETS[name]
+    output_path = os.path.join(output_dir, f"{name}_{preset['pages']}p_seed{seed}.pdf")
+    if not os.path.exists(output_path):
+        generate_pdf(output_path, preset["pages"], preset["mix"], seed=seed)
+    return output_path
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parses 'text=0.5,table=0.3,image=0.2' into a mix dict."""
+    mix = {}
+    for part in value.split(","):
+        kind, share = part.split("=")
+        if kind.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown page kind '{kind}'. Use: {', '.join(DEFAULT_MIX)}")
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark PDFs.")
+    parser.add_argument("output", help="Path of the PDF to write.")
+    parser.add_argument("--pages", type=int, default=20, help="Number of pages (default: 20).")
+    parser.add_argument("--mix", type=parse_mix, default=None, help="Page mix, e.g. 'text=0.5,columns=0.2,table=0.2,image=0.1'.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    args = parser.parse_args()
+    print(f"Wrote {generate_pdf(args.output, args.pages, args.mix, seed=args.seed)}")
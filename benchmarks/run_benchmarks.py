@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import platform
+import statistics
+from typing import Any, Dict, List, Optional
+
+# Reproducible throughput benchmarks: synthetic PDFs (benchmarks/generate_pdfs.py) run through
+# the full graph and through every agent in isolation, against the deterministic fake LLM
+# (LLM_BACKEND=fake, latency configurable) so no Ollama server is needed.
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks --presets small medium --check
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_PDF_DIR = os.path.join(".cache", "benchmark_pdfs")
+DEFAULT_TOLERANCE = 0.25 # Allowed slowdown before a result counts as a regression
+NOISE_FLOOR_SECONDS = 0.05 # Stage time differences below this are ignored
+
+# Agents timed in isolation: graph node name -> (module, function)
+ISOLATED_AGENTS = [
+    ("parser_agent", "agents.parser", "parse_document"),
+    ("language_detection_agent", "agents.language_detector", "detect_language"),
+    ("text_processor_agent", "agents.text_processor", "process_text"),
+    ("vision_analyzer_agent", "agents.vision_analyzer", "analyze_visuals"),
+    ("table_analyzer_agent", "agents.table_analyzer", "analyze_tables"),
+    ("synthesizer_agent", "agents.synthesizer", "synthesize_content"),
+    ("chunker_agent", "agents.chunker", "create_chunks"),
+    ("formatter_agent", "agents.formatter", "format_output"),
+]
+
+
+def configure_environment(latency_ms: float, ms_per_1k_chars: float, embedding_latency_ms: float, use_cache: bool):
+    """
+    Must run before the first lazy_resource().get() and before any module that reads its
+    configuration from the environment at import time is imported (models and chains are
+    created on first use with the environment of that moment; see utils/llm_provider.py).
+    The LLM and embedding caches live in a temporary directory, removed on exit: fake responses
+    and vectors never reach the user's real caches, and every benchmark run starts cold.
+    """
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(latency_ms)
+    os.environ["FAKE_LLM_MS_PER_1K_CHARS"] = str(ms_per_1k_chars)
+    os.environ["FAKE_EMBEDDING_LATENCY_MS"] = str(embedding_latency_ms)
+    cache_dir = tempfile.mkdtemp(prefix="benchmark_cache_")
+    atexit.register(shutil.rmtree, cache_dir, ignore_errors=True)
+    os.environ["LLM_CACHE_PATH"] = os.path.join(cache_dir, "llm_cache.sqlite")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(cache_dir, "embedding_cache.sqlite")
+    if not use_cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+
+
+def _median(values: List[float]) -> float:
+    return round(statistics.median(values), 4)
+
+
+def benchmark_graph(pdf_path: str, page_count: int, repeat: int, parallel: bool) -> Dict[str, Any]:
+    """Runs the compiled graph `repeat` times (after one warm-up run); reports the median wall time and per-stage times."""
+    from main import compile_app, invoke_graph
+
+    app = compile_app(parallel=parallel, checkpoint=False)
+    invoke_graph(app, pdf_path) # Warm-up: lazy imports, first model calls, OS file cache
+    walls, element_counts = [], []
+    stage_times: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        final_state = invoke_graph(app, pdf_path)
+        walls.append(time.perf_counter() - start)
+        if final_state.get("error_message"):
+            raise RuntimeError(f"Graph run failed: {final_state['error_message']}")
+        element_counts.append(len(final_state.get("raw_elements") or []))
+        for record in final_state.get("agent_metrics") or []:
+            stage_times.setdefault(record["agent"], []).append(record["wall_seconds"])
+
+    seconds = _median(walls)
+    return {
+        "seconds": seconds,
+        "pages_per_sec": round(page_count / seconds, 3) if seconds else None,
+        "elements_per_sec": round(element_counts[-1] / seconds, 3) if seconds else None,
+        "chunks": len(final_state.get("final_chunks") or []),
+        "stages": {agent: _median(times) for agent, times in stage_times.items()},
+    }
+
+
+def benchmark_agents(pdf_path: str, repeat: int) -> Dict[str, Any]:
+    """
+    Times every agent on its own: the state each agent sees is prepared by running the
+    previous agents once, then the agent alone is called `repeat` times (median reported).
+    """
+    import importlib
+    from main import create_initial_state
+
+    state = create_initial_state(pdf_path)
+    results = {}
+    for node_name, module_name, function_name in ISOLATED_AGENTS:
+        agent_func = getattr(importlib.import_module(module_name), function_name)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            update = agent_func(dict(state)) or {}
+            times.append(time.perf_counter() - start)
+        seconds = _median(times)
+        state.update(update)
+        output_count = sum(len(value) for value in update.values() if isinstance(value, list))
+        results[node_name] = {
+            "seconds": seconds,
+            "output_elements": output_count,
+            "elements_per_sec": round(output_count / seconds, 3) if seconds else None,
+        }
+    return results
+
+
+def run_benchmarks(presets: List[str], repeat: int = 3, parallel: bool = True, seed: int = 0,
+                   pdf_dir: str = DEFAULT_PDF_DIR, isolated: bool = True) -> Dict[str, Any]:
+    """Generates the preset PDFs and benchmarks each of them. Returns the results dict."""
+    import fitz
+    from benchmarks.generate_pdfs import generate_preset
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_llm_latency_ms": float(os.environ["FAKE_LLM_LATENCY_MS"]),
+            "fake_llm_ms_per_1k_chars": float(os.environ["FAKE_LLM_MS_PER_1K_CHARS"]),
+            "fake_embedding_latency_ms": float(os.environ["FAKE_EMBEDDING_LATENCY_MS"]),
+            "repeat": repeat,
+            "parallel": parallel,
+            "seed": seed,
+        },
+        "scenarios": {},
+    }
+    for preset in presets:
+        pdf_path = generate_preset(preset, pdf_dir, seed=seed)
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        print(f"=== Benchmark '{preset}' ({page_count} pages, {pdf_path}) ===")
+        scenario = {"pages": page_count, "graph": benchmark_graph(pdf_path, page_count, repeat, parallel)}
+        if isolated:
+            scenario["agents"] = benchmark_agents(pdf_path, repeat)
+        results["scenarios"][preset] = scenario
+    return results
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any],
+                          tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compares results with a stored baseline. Returns human-readable regressions:
+    throughput below (1 - tolerance) x baseline, or agent/stage times above (1 + tolerance) x baseline
+    (differences smaller than NOISE_FLOOR_SECONDS are ignored).
+    """
+    regressions = []
+
+    def _slower(label: str, current: Optional[float], reference: Optional[float]):
+        if current is None or reference is None:
+            return
+        if current > reference * (1 + tolerance) and current - reference > NOISE_FLOOR_SECONDS:
+            regressions.append(f"{label}: {current}s vs baseline {reference}s (+{(current / reference - 1) * 100:.0f}%)")
+
+    for name, scenario in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference:
+            print(f"No baseline for scenario '{name}'.")
+            continue
+        current_rate, reference_rate = scenario["graph"]["pages_per_sec"], reference["graph"]["pages_per_sec"]
+        if current_rate and reference_rate and current_rate < reference_rate * (1 - tolerance):
+            regressions.append(f"{name} pages/sec: {current_rate} vs baseline {reference_rate} "
+                               f"({(current_rate / reference_rate - 1) * 100:.0f}%)")
+        for stage, seconds in scenario["graph"]["stages"].items():
+            _slower(f"{name} stage {stage}", seconds, reference["graph"]["stages"].get(stage))
+        for agent, agent_result in (scenario.get("agents") or {}).items():
+            _slower(f"{name} agent {agent}", agent_result["seconds"],
+                    (reference.get("agents") or {}).get(agent, {}).get("seconds"))
+    return regressions
+
+
+def print_report(results: Dict[str, Any]):
+    for name, scenario in results["scenarios"].items():
+        graph = scenario["graph"]
+        print(f"\n{name}: {scenario['pages']} pages in {graph['seconds']}s -> "
+              f"{graph['pages_per_sec']} pages/s, {graph['elements_per_sec']} elements/s, {graph['chunks']} chunks")
+        for stage, seconds in graph["stages"].items():
+            print(f"  graph  {stage:<20} {seconds:>9.4f}s")
+        for agent, agent_result in (scenario.get("agents") or {}).items():
+            print(f"  alone  {agent:<26} {agent_result['seconds']:>9.4f}s  ({agent_result['output_elements']} outputs)")
+
+
+if __name__ == "__main__":
+    from benchmarks.generate_pdfs import PRESETS
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic PDFs with a fake LLM.")
+    parser.add_argument("--presets", nargs="+", default=["small", "medium"], choices=sorted(PRESETS), help="Scenarios to run (default: small medium).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the median is reported (default: 3).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic PDFs (default: 0).")
+    parser.add_argument("--sequential", action="store_true", help="Run the analysis agents sequentially in the graph.")
+    parser.add_argument("--no-isolated", action="store_true", help="Skip the per-agent isolated timings.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Fake LLM latency per call in ms (default: 50).")
+    parser.add_argument("--ms-per-1k-chars", type=float, default=5.0, help="Extra fake LLM latency per 1000 prompt characters (default: 5).")
+    parser.add_argument("--embedding-latency-ms", type=float, default=10.0, help="Fake embedding latency per request in ms (default: 10).")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the LLM and embedding caches enabled (off by default so every call is timed; a temporary cache is used either way).")
+    parser.add_argument("--pdf-dir", default=DEFAULT_PDF_DIR, help=f"Where the generated PDFs are kept (default: {DEFAULT_PDF_DIR}).")
+    parser.add_argument("-o", "--output", default=None, help="Write the results JSON to this path.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against (default: benchmarks/baseline.json).")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if a regression against the baseline is found.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help=f"Allowed relative slowdown (default: {DEFAULT_TOLERANCE}).")
+    args = parser.parse_args()
+
+    configure_environment(args.latency_ms, args.ms_per_1k_chars, args.embedding_latency_ms, args.use_cache)
+    results = run_benchmarks(args.presets, repeat=max(1, args.repeat), parallel=(not args.sequential),
+                             seed=args.seed, pdf_dir=args.pdf_dir, isolated=(not args.no_isolated))
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("cpu_count") != results["environment"]["cpu_count"]:
+            print("\nWarning: the baseline was recorded on a machine with a different CPU count.")
+        regressions = compare_with_baseline(results, baseline, tolerance=args.tolerance)
+        print(f"\nCompared with {args.baseline}: {len(regressions)} regression(s).")
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+    elif not args.save_baseline:
+        print(f"\nNo baseline at {args.baseline}. Record one with --save-baseline.")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.check and regressions:
+        sys.exit(1)
@@ -1,6 +1,22 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, Annotated
+import operator
 import importlib # Dùng để import động nếu cần, nhưng trực tiếp sẽ rõ hơn
 import traceback # Để in lỗi chi tiết hơn
+import time
+from utils.metrics import AgentMetrics
+
+# --- Reducers ---
+# The text/image/chart/table agents can run as parallel branches of the graph.
+# Keys written by more than one branch in the same step need a reducer,
+# otherwise LangGraph rejects the concurrent updates.
+def keep_first_error(current: Optional[str], new: Optional[str]) -> Optional[str]:
+    """Keeps the first error reported; a succeeding branch must not clear a sibling's error."""
+    return current if current else new
+
+def keep_last(current: Any, new: Any) -> Any:
+    """Last write wins (used for the debugging tracker)."""
+    return new
+
 
 # --- State Definition ---
 # Định nghĩa GraphState ở đây, trước khi import các agent cần nó
@@ -23,39 +39,58 @@ class GraphState(TypedDict):
         # Add other relevant fields as needed (e.g., document metadata, language info)
         language: Optional[str] # Detected language (if applicable)
         metadata: Optional[Dict[str, Any]] # Document-level metadata
+        page_numbers: Optional[List[int]] # 0-based pages to parse (None = whole document), e.g. one streaming window
+        page_fingerprints: Optional[Dict[str, str]] # Content hash per parsed page (1-based page number as key)
+        page_parse_stats: Optional[Dict[str, Dict]] # Parse timings and table detection decision per parsed page
+        document_layout: Optional[Dict[str, Any]] # Whole-document header/footer signatures and image occurrences for page-subset runs (agents/parser.py)
+        agent_metrics: One performance record per agent run (timings, element counts, LLM usage; see utils/metrics.py)
     """
     pdf_path: str
     raw_elements: List[Dict[str, Any]]
-    processed_text_chunks: List[Dict[str, Any]] # e.g., {'text': '...', 'metadata': {...}}
-    image_descriptions: List[Dict[str, Any]] # e.g., {'image_ref': 'img1', 'description': '...', 'metadata': {...}}
-    chart_summaries: List[Dict[str, Any]] # e.g., {'chart_ref': 'chart1', 'summary': '...', 'metadata': {...}}
-    table_data: List[Dict[str, Any]] # e.g., {'table_ref': 'tbl1', 'data': {...}, 'metadata': {...}}
+    # The four analysis outputs are appended (operator.add) so parallel branches merge cleanly
+    processed_text_chunks: Annotated[List[Dict[str, Any]], operator.add] # e.g., {'text': '...', 'metadata': {...}}
+    image_descriptions: Annotated[List[Dict[str, Any]], operator.add] # e.g., {'image_ref': 'img1', 'description': '...', 'metadata': {...}}
+    chart_summaries: Annotated[List[Dict[str, Any]], operator.add] # e.g., {'chart_ref': 'chart1', 'summary': '...', 'metadata': {...}}
+    table_data: Annotated[List[Dict[str, Any]], operator.add] # e.g., {'table_ref': 'tbl1', 'data': {...}, 'metadata': {...}}
     synthesized_content: List[Dict[str, Any]] # Combined content in logical order
     final_chunks: List[Dict[str, Any]] # Final output chunks
-    error_message: Optional[str]
-    current_agent: Optional[str]
+    error_message: Annotated[Optional[str], keep_first_error]
+    current_agent: Annotated[Optional[str], keep_last]
     language: Optional[str]
     metadata: Optional[Dict[str, Any]]
+    page_numbers: Optional[List[int]]
+    page_fingerprints: Optional[Dict[str, str]]
+    page_parse_stats: Optional[Dict[str, Dict[str, Any]]]
+    document_layout: Optional[Dict[str, Any]]
+    agent_metrics: Annotated[List[Dict[str, Any]], operator.add]
 
 
 # --- Node Creation Function ---
+GRAPH_AGENT_MODULES = ["parser", "language_detector", "text_processor", "vision_analyzer",
+                       "table_analyzer", "synthesizer", "chunker", "formatter"]
+# Import time (seconds) of each agent module, measured on its first import (see --profile-startup).
+# Shared dependencies are attributed to the first module that imports them.
+agent_import_seconds: Dict[str, float] = {}
+
+
+def _import_agent(name: str):
+    start = time.perf_counter()
+    module = importlib.import_module(f"agents.{name}")
+    agent_import_seconds.setdefault(name, round(time.perf_counter() - start, 4))
+    return module
+
+
 # Di chuyển import vào đây để tránh circular import
 def create_graph_nodes() -> Dict[str, callable]:
     """
     Creates and returns a dictionary mapping node names to their corresponding agent functions.
-    Imports agent modules only when this function is called.
+    Imports agent modules only when this function is called. Model clients and chains
+    are not built here: the agents create them on first use (utils/llm_provider.lazy_resource).
     """
     # Import agent modules *inside* the function
     try:
-        from agents import parser
-        from agents import language_detector
-        from agents import text_processor
-        from agents import image_analyzer
-        from agents import chart_analyzer
-        from agents import table_analyzer
-        from agents import synthesizer
-        from agents import chunker
-        from agents import formatter
+        parser, language_detector, text_processor, vision_analyzer, table_analyzer, synthesizer, chunker, formatter = (
+            _import_agent(name) for name in GRAPH_AGENT_MODULES)
     except ImportError as e:
         print(f"!!! Failed to import agent modules: {e} !!!")
         print("Ensure all agent files exist in the 'agents' directory and have no syntax errors.")
@@ -72,10 +107,12 @@ def create_graph_nodes() -> Dict[str, callable]:
                  # The error message persists from the previous state.
                  return {}
 
+            metrics = AgentMetrics(agent_name, state)
             try:
                 # Pass the relevant parts of the state to the agent
                 # The agent function should know what it needs from the state
-                updated_state_parts = agent_func(state) # Call the actual agent function
+                with metrics: # Times the agent and collects its LLM usage
+                    updated_state_parts = agent_func(state) # Call the actual agent function
                 if updated_state_parts is None: # Agent might return None if no changes
                     updated_state_parts = {}
 
@@ -86,11 +123,10 @@ def create_graph_nodes() -> Dict[str, callable]:
 
 
                 updated_state_parts["current_agent"] = agent_name # Update tracker
-                # Clear previous error message *only if* this agent succeeds *and* returns something
-                # We keep the error if the agent returns nothing or fails
-                if updated_state_parts: # Check if the agent actually returned updates
-                    updated_state_parts["error_message"] = None
+                # A succeeding agent never touches error_message: once set, an error is kept
+                # (keep_first_error), so a parallel sibling cannot wipe out a real error.
 
+                updated_state_parts["agent_metrics"] = [metrics.finish(updated_state_parts, "ok")]
                 return updated_state_parts
             except Exception as e:
                 print(f"!!! Error in Agent {agent_name}: {e} !!!")
@@ -98,7 +134,8 @@ def create_graph_nodes() -> Dict[str, callable]:
                 traceback.print_exc()
                 # Return the error message in the state update
                 # This will cause subsequent agents to be skipped by the check above
-                return {"error_message": f"Error in {agent_name}: {str(e)}", "current_agent": agent_name}
+                return {"error_message": f"Error in {agent_name}: {str(e)}", "current_agent": agent_name,
+                        "agent_metrics": [metrics.finish({}, "error")]}
         return node_func
 
     # Create the dictionary of nodes using the imported agent functions
@@ -106,8 +143,9 @@ def create_graph_nodes() -> Dict[str, callable]:
         "parser_agent": wrap_agent(parser.parse_document, "Parser"),
         "language_detection_agent": wrap_agent(language_detector.detect_language, "Language Detector"),
         "text_processor_agent": wrap_agent(text_processor.process_text, "Text Processor"),
-        "image_analyzer_agent": wrap_agent(image_analyzer.analyze_images, "Image Analyzer"),
-        "chart_analyzer_agent": wrap_agent(chart_analyzer.analyze_charts, "Chart Analyzer"),
+        # One multimodal call per image fills both image_descriptions and chart_summaries
+        # (agents/image_analyzer.py and agents/chart_analyzer.py remain usable on their own)
+        "vision_analyzer_agent": wrap_agent(vision_analyzer.analyze_visuals, "Vision Analyzer"),
         "table_analyzer_agent": wrap_agent(table_analyzer.analyze_tables, "Table Analyzer"),
         "synthesizer_agent": wrap_agent(synthesizer.synthesize_content, "Synthesizer"),
         "chunker_agent": wrap_agent(chunker.create_chunks, "Chunker"),
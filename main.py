@@ -1,28 +1,79 @@
 import os
 import json
+import time
+from typing import Dict, Any, List, Optional
+import fitz # PyMuPDF, only used to count pages for the streaming mode
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 # Ensure GraphState and create_graph_nodes are correctly imported
-from graph_definition import GraphState, create_graph_nodes
-from utils.file_handler import save_json_output
+from graph_definition import GraphState, create_graph_nodes, agent_import_seconds
+from utils.file_handler import (save_json_output, append_jsonl_output, load_json_data,
+                                extract_chunk_embeddings, save_embeddings_sidecar, load_embeddings_sidecar)
+from utils.incremental import page_manifest_path, plan_incremental_update, expand_changed_pages, splice_chunks
+from utils.checkpointing import open_checkpointer, document_hash, thread_id_for, find_resume_point
+from utils.metrics import summarize_agent_metrics, summarize_page_stats, metrics_path_for, write_prometheus_metrics
+from utils.llm_cache import get_llm_cache
+from utils.llm_provider import resource_init_report
 import argparse
 
 load_dotenv(override=True)
 
-def run_pipeline(pdf_path: str, output_path: str, visualize: bool = True, viz_path: str = "workflow_graph.png"):
+# Agents that only read 'raw_elements'/'language' and write disjoint state keys.
+# They can run as parallel branches between language detection and synthesis.
+ANALYSIS_AGENTS = [
+    "text_processor_agent",
+    "vision_analyzer_agent", # images and charts in a single multimodal pass
+    "table_analyzer_agent",
+]
+
+def build_workflow(parallel: bool = True) -> StateGraph:
     """
-    Initializes and runs the PDF processing pipeline.
+    Builds the (uncompiled) LangGraph workflow.
 
     Args:
-        pdf_path: Path to the input PDF file.
-        output_path: Path to save the final JSON output.
-        visualize: Whether to generate and save a visualization of the graph.
-        viz_path: Path to save the graph visualization image.
+        parallel: If True, fan out the analysis agents after language detection and
+                  join them before synthesis. If False, run them as a linear chain
+                  (useful for debugging, since the console output is not interleaved).
     """
-    print(f"--- Starting Pipeline for: {pdf_path} ---")
+    workflow = StateGraph(GraphState)
+
+    # --- Define Nodes ---
+    # create_graph_nodes returns a dictionary of node_name: node_function
+    nodes = create_graph_nodes()
+    for name, node_func in nodes.items():
+        workflow.add_node(name, node_func)
+
+    # --- Define Edges ---
+    workflow.set_entry_point("parser_agent")
+    workflow.add_edge("parser_agent", "language_detection_agent")
+
+    if parallel:
+        # Fan out: every analysis agent starts as soon as the language is known
+        for agent_name in ANALYSIS_AGENTS:
+            workflow.add_edge("language_detection_agent", agent_name)
+        # Join: synthesis waits for all branches (list fields are merged by their reducers)
+        workflow.add_edge(ANALYSIS_AGENTS, "synthesizer_agent")
+    else:
+        # Sequential flow, same order as the parallel branches
+        workflow.add_edge("language_detection_agent", ANALYSIS_AGENTS[0])
+        for previous_agent, next_agent in zip(ANALYSIS_AGENTS, ANALYSIS_AGENTS[1:]):
+            workflow.add_edge(previous_agent, next_agent)
+        workflow.add_edge(ANALYSIS_AGENTS[-1], "synthesizer_agent")
 
-    # Initial state definition (ensure all keys from GraphState are present)
-    initial_state: GraphState = {
+    workflow.add_edge("synthesizer_agent", "chunker_agent")
+    workflow.add_edge("chunker_agent", "formatter_agent")
+    workflow.add_edge("formatter_agent", END) # End of the graph
+    return workflow
+
+
+def create_initial_state(pdf_path: str, page_numbers: Optional[List[int]] = None,
+                         document_layout: Optional[Dict[str, Any]] = None) -> GraphState:
+    """
+    Returns a fresh initial state for one document (all GraphState keys present).
+    page_numbers restricts parsing to these 0-based pages (None = whole document);
+    document_layout is the whole document's layout for such a subset (see agents/parser.py).
+    """
+    return {
         "pdf_path": pdf_path,
         "raw_elements": [],
         "processed_text_chunks": [],
@@ -34,69 +85,146 @@ def run_pipeline(pdf_path: str, output_path: str, visualize: bool = True, viz_pa
         "error_message": None,
         "current_agent": None, # Track the current agent for debugging/logging
         "language": None,
-        "metadata": None
+        "metadata": None,
+        "page_numbers": page_numbers,
+        "page_fingerprints": None,
+        "page_parse_stats": None,
+        "document_layout": document_layout,
+        "agent_metrics": []
     }
 
 
-    # Create the graph workflow
-    workflow = StateGraph(GraphState)
+def save_page_manifest(output_path: str, pdf_path: str, page_fingerprints: Dict[str, str]):
+    """Stores the per-page fingerprints next to the output, as the baseline for incremental re-runs."""
+    from agents.parser import FINGERPRINT_VERSION
+    save_json_output({
+        "source": pdf_path,
+        "fingerprint_version": FINGERPRINT_VERSION,
+        "page_count": len(page_fingerprints),
+        "page_fingerprints": page_fingerprints,
+    }, page_manifest_path(output_path))
 
-    # --- Define Nodes ---
-    # create_graph_nodes returns a dictionary of node_name: node_function
-    nodes = create_graph_nodes()
-    for name, node_func in nodes.items():
-        workflow.add_node(name, node_func)
 
-    # --- Define Edges (Simplified Linear Flow for now) ---
-    # This defines the sequence of agents. More complex routing can be added later.
-    workflow.set_entry_point("parser_agent")
-    workflow.add_edge("parser_agent", "language_detection_agent")
-    workflow.add_edge("language_detection_agent", "text_processor_agent")
+def compile_app(parallel: bool = True, checkpoint: bool = True):
+    """
+    Builds and compiles the graph. The compiled app can be reused for many documents.
+    With checkpoint=True, every step is saved to a local SQLite checkpointer
+    (CHECKPOINT_DB, default .cache/checkpoints.sqlite) so failed runs can be resumed.
+    """
+    workflow = build_workflow(parallel=parallel)
+    checkpointer = open_checkpointer() if checkpoint else None
+    app = workflow.compile(checkpointer=checkpointer)
+    print(f"--- Graph Compiled ({'parallel' if parallel else 'sequential'} analysis agents"
+          f"{', checkpointing' if checkpointer else ''}) ---")
+    return app
 
-    # Sequential flow for simplicity (can be parallelized with conditional edges)
-    workflow.add_edge("text_processor_agent", "image_analyzer_agent")
-    workflow.add_edge("image_analyzer_agent", "chart_analyzer_agent")
-    workflow.add_edge("chart_analyzer_agent", "table_analyzer_agent")
 
-    # Join back for synthesis
-    workflow.add_edge("table_analyzer_agent", "synthesizer_agent")
-    workflow.add_edge("synthesizer_agent", "chunker_agent")
-    workflow.add_edge("chunker_agent", "formatter_agent")
-    workflow.add_edge("formatter_agent", END) # End of the graph
+def invoke_graph(app, pdf_path: str, page_numbers: Optional[List[int]] = None, resume: bool = False,
+                 doc_hash: Optional[str] = None, document_layout: Optional[Dict[str, Any]] = None) -> GraphState:
+    """
+    Runs the graph for one document (or page subset).
 
-    # Compile the graph
-    app = workflow.compile()
+    Without a checkpointer this is a plain app.invoke. With one, the run is stored in the
+    checkpoint thread of the document (keyed by its content hash). resume=True restarts
+    from the state after the last successful node of a previous (failed) run; otherwise
+    any old checkpoints of the thread are discarded and the run starts fresh.
+    doc_hash is the document's content hash if the caller already has it (hashing a large
+    PDF once per streaming window would re-read the whole file every time).
+    document_layout is passed to the parser of a page subset (see create_initial_state).
+    """
+    # Increase recursion limit if the graph is deep or has complex conditional logic
+    config = {"recursion_limit": 25}
+    initial_state = create_initial_state(pdf_path, page_numbers=page_numbers, document_layout=document_layout)
+    if app.checkpointer is None:
+        return app.invoke(initial_state, config=config)
 
-    print("--- Graph Compiled ---")
+    thread_id = thread_id_for(doc_hash or document_hash(pdf_path), page_numbers)
+    config["configurable"] = {"thread_id": thread_id}
+    if resume:
+        snapshot = find_resume_point(app, config)
+        if snapshot is not None and not snapshot.next:
+            print("--- Checkpoint: this run already completed. Reusing its final state. ---")
+            return snapshot.values
+        if snapshot is not None:
+            print(f"--- Resuming from checkpoint (next: {', '.join(snapshot.next)}) ---")
+            return app.invoke(None, config={**snapshot.config, "recursion_limit": 25})
+        print("--- No checkpoint to resume from. Starting a fresh run. ---")
+
+    # A fresh run must start from a clean thread: list fields are merged by reducers,
+    # so values from an older run of the same document would leak into this one.
+    app.checkpointer.delete_thread(thread_id)
+    return app.invoke(initial_state, config=config)
+
+
+def checkpoint_document_hash(app, pdf_path: str) -> Optional[str]:
+    """The document hash used for its checkpoint threads (None, and no hashing, without a checkpointer)."""
+    return document_hash(pdf_path) if app.checkpointer is not None else None
+
+
+def release_checkpoints(app, doc_hash: Optional[str], page_numbers: Optional[List[int]] = None):
+    """Drops the checkpoints of a run whose output has been saved (keeps the checkpoint DB small)."""
+    if app.checkpointer is not None and doc_hash:
+        app.checkpointer.delete_thread(thread_id_for(doc_hash, page_numbers))
 
-    # --- Visualize the graph (Optional) ---
-    if visualize:
-        try:
-            print(f"Attempting to visualize graph and save to {viz_path}...")
-            # Get the graph object
-            graph = app.get_graph()
-            # Draw the graph and save as PNG
-            # You might need write permissions in the target directory
-            graph.draw_mermaid_png(output_file_path=viz_path)
-            print(f"Graph visualization saved successfully to {viz_path}")
-        except ImportError:
-            print("!!! Visualization failed: `pygraphviz` not installed or Graphviz system library not found. !!!")
-            print("Install Graphviz (system) and then run: pip install pygraphviz")
-        except Exception as viz_error:
-            print(f"!!! An error occurred during graph visualization: {viz_error} !!!")
-            # Print traceback for detailed debugging if needed
-            import traceback
-            traceback.print_exc()
 
+def save_run_metrics(summary: Dict[str, Any], output_path: str, agent_records: List[Dict[str, Any]],
+                     page_stats: Optional[Dict[str, Dict[str, Any]]] = None):
+    """
+    Adds the per-agent totals to the run summary and writes them, together with the
+    individual agent records and the parser's per-page stats, to <output>.metrics.json next to the output.
+    """
+    summary["agents"] = summarize_agent_metrics(agent_records)
+    metrics = {
+        "pdf_path": summary["pdf_path"],
+        "status": summary["status"],
+        "seconds": summary.get("seconds"),
+        "agents": summary["agents"],
+        "agent_runs": agent_records,
+    }
+    if page_stats:
+        summary["table_detection"] = summarize_page_stats(page_stats)
+        metrics["table_detection"] = summary["table_detection"]
+        metrics["pages"] = page_stats
+    save_json_output(metrics, metrics_path_for(output_path))
+    for agent in summary["agents"]:
+        print(f"  {agent['agent']}: {agent['wall_seconds']}s wall, {agent['cpu_seconds']}s CPU, "
+              f"{agent['llm_calls']} LLM calls ({agent['llm_cache_hits']} cached), "
+              f"{agent['prompt_tokens']}+{agent['completion_tokens']} tokens")
+
+
+def run_document(app, pdf_path: str, output_path: str, resume: bool = False) -> Dict[str, Any]:
+    """
+    Runs an already compiled graph on one PDF and saves the result.
+
+    Args:
+        app: The compiled LangGraph app (see compile_app).
+        pdf_path: Path to the input PDF file.
+        output_path: Path to save the final JSON output.
+        resume: Resume a previously failed run of this document from its checkpoint.
 
+    Returns:
+        A summary dict with 'status' ('ok', 'error' or 'empty'), 'output_path',
+        'chunk_count', 'error', 'seconds' and the per-agent metrics under 'agents'
+        (also written to <output>.metrics.json).
+    """
+    start_time = time.perf_counter()
     print("--- Running Pipeline... ---")
 
     # Run the graph
-    # Increase recursion limit if the graph is deep or has complex conditional logic
-    final_state = app.invoke(initial_state, config={"recursion_limit": 25})
+    doc_hash = checkpoint_document_hash(app, pdf_path)
+    final_state = invoke_graph(app, pdf_path, resume=resume, doc_hash=doc_hash)
 
     print("--- Pipeline Finished ---")
 
+    summary = {
+        "pdf_path": pdf_path,
+        "status": "ok",
+        "output_path": output_path,
+        "chunk_count": len(final_state.get("final_chunks") or []),
+        "page_count": (final_state.get("metadata") or {}).get("page_count"),
+        "error": None,
+    }
+
     # Handle potential errors during pipeline execution
     if final_state.get("error_message"):
         print(f"Pipeline finished with error: {final_state['error_message']}")
@@ -107,18 +235,295 @@ def run_pipeline(pdf_path: str, output_path: str, visualize: bool = True, viz_pa
             # Ensure all keys from GraphState are present, even if None, for consistency
             "partial_state": {k: final_state.get(k) for k in GraphState.__annotations__ if k != 'error_message'}
         }
-        save_json_output(error_output, output_path.replace(".json", "_error.json"))
+        summary.update(status="error", error=final_state['error_message'],
+                       output_path=output_path.replace(".json", "_error.json"))
+        save_json_output(error_output, summary["output_path"])
+        if app.checkpointer is not None:
+            print("Checkpoints kept. Fix the problem and re-run with --resume to continue from the last successful agent.")
 
     elif final_state.get("final_chunks"):
         print(f"Saving output to: {output_path}")
         # Save the final JSON output using the utility function
-        # Pass only the final_chunks list to be saved
+        # Pass only the final_chunks list to be saved; chunk embeddings go to a .npy sidecar
+        chunk_embeddings = extract_chunk_embeddings(final_state["final_chunks"])
+        save_embeddings_sidecar(chunk_embeddings, output_path, len(final_state["final_chunks"]), final_state["final_chunks"])
         save_json_output(final_state["final_chunks"], output_path)
+        if final_state.get("page_fingerprints"):
+            save_page_manifest(output_path, pdf_path, final_state["page_fingerprints"])
+        release_checkpoints(app, doc_hash)
     else:
          print("Pipeline finished, but no final chunks were generated.")
          # Save the final state for debugging, ensuring all keys are present
          final_state_output = {k: final_state.get(k) for k in GraphState.__annotations__}
-         save_json_output(final_state_output, output_path.replace(".json", "_empty_state.json"))
+         summary.update(status="empty", output_path=output_path.replace(".json", "_empty_state.json"))
+         save_json_output(final_state_output, summary["output_path"])
+         release_checkpoints(app, doc_hash) # Nothing to resume: the run completed without error
+
+    llm_cache = get_llm_cache()
+    if llm_cache:
+        # Counters are per process (cumulative across documents in batch mode)
+        summary["llm_cache"] = llm_cache.stats()
+        print(f"LLM cache: {summary['llm_cache']['hits']} hits, {summary['llm_cache']['misses']} misses, "
+              f"{summary['llm_cache']['entries']} entries stored.")
+
+    summary["seconds"] = round(time.perf_counter() - start_time, 3)
+    save_run_metrics(summary, output_path, final_state.get("agent_metrics") or [], final_state.get("page_parse_stats"))
+    return summary
+
+
+def run_document_streaming(app, pdf_path: str, output_path: str, window_pages: int,
+                           resume: bool = False) -> Dict[str, Any]:
+    """
+    Streaming mode: runs the whole graph (parser -> agents -> synthesizer -> chunker -> formatter)
+    on windows of window_pages pages and appends each window's chunks to a JSON Lines file
+    as soon as the window is done. Only one window is held in memory at a time, and
+    'chunk_index' keeps counting across windows.
+
+    Args:
+        app: The compiled LangGraph app (see compile_app).
+        pdf_path: Path to the input PDF file.
+        output_path: Path of the JSONL output (a '.json' extension is replaced by '.jsonl').
+        window_pages: Number of pages per window.
+        resume: Resume windows that failed in a previous run from their checkpoints
+                (windows are checkpointed separately).
+
+    Returns:
+        A summary dict like run_document's, plus 'windows' and 'failed_windows'.
+    """
+    start_time = time.perf_counter()
+    if output_path.endswith(".json"):
+        output_path = output_path[:-len(".json")] + ".jsonl"
+
+    doc = fitz.open(pdf_path)
+    page_count = doc.page_count
+    doc.close()
+
+    # Start from an empty file: chunks are only ever appended
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    windows = [list(range(start, min(start + window_pages, page_count)))
+               for start in range(0, page_count, window_pages)]
+    print(f"--- Streaming {page_count} pages in {len(windows)} windows of up to {window_pages} pages to {output_path} ---")
+
+    doc_hash = checkpoint_document_hash(app, pdf_path) # Hashed once, not per window
+    document_layout = None
+    if len(windows) > 1:
+        # Header/footer and image repetition is judged over all pages, scanned once for all windows
+        from agents.parser import compute_document_layout
+        document_layout = compute_document_layout(pdf_path)
+    chunk_offset = 0
+    failed_windows = []
+    page_fingerprints = {}
+    agent_records = []
+    page_stats = {}
+    chunk_embeddings = {} # Written to the .npy sidecar once all windows are done
+    for window_index, page_numbers in enumerate(windows):
+        window_label = f"pages {page_numbers[0] + 1}-{page_numbers[-1] + 1}"
+        print(f"--- Window {window_index + 1}/{len(windows)} ({window_label}) ---")
+        final_state = invoke_graph(app, pdf_path, page_numbers=page_numbers, resume=resume, doc_hash=doc_hash,
+                                   document_layout=document_layout)
+        agent_records.extend(final_state.get("agent_metrics") or [])
+        page_stats.update(final_state.get("page_parse_stats") or {})
+
+        if final_state.get("error_message"):
+            print(f"Window {window_label} failed: {final_state['error_message']}")
+            failed_windows.append({"pages": [page_numbers[0] + 1, page_numbers[-1] + 1],
+                                   "error": final_state["error_message"]})
+            continue
+
+        window_chunks = final_state.get("final_chunks") or []
+        # Re-number so chunk_index is unique and increasing across the whole document
+        for i, chunk in enumerate(window_chunks):
+            chunk.setdefault("metadata", {})["chunk_index"] = chunk_offset + i
+        chunk_embeddings.update(extract_chunk_embeddings(window_chunks))
+        append_jsonl_output(window_chunks, output_path)
+        release_checkpoints(app, doc_hash, page_numbers)
+        chunk_offset += len(window_chunks)
+        page_fingerprints.update(final_state.get("page_fingerprints") or {})
+        print(f"Appended {len(window_chunks)} chunks ({chunk_offset} total) to {output_path}")
+
+    if not failed_windows and page_fingerprints:
+        save_page_manifest(output_path, pdf_path, page_fingerprints)
+    save_embeddings_sidecar(chunk_embeddings, output_path, chunk_offset)
+
+    status = "error" if failed_windows else ("ok" if chunk_offset else "empty")
+    summary = {
+        "pdf_path": pdf_path,
+        "status": status,
+        "output_path": output_path,
+        "chunk_count": chunk_offset,
+        "page_count": page_count,
+        "error": "; ".join(f"pages {w['pages'][0]}-{w['pages'][1]}: {w['error']}" for w in failed_windows) or None,
+        "windows": len(windows),
+        "failed_windows": failed_windows,
+        "seconds": round(time.perf_counter() - start_time, 3),
+    }
+    print(f"--- Streaming finished: {chunk_offset} chunks, {len(failed_windows)} failed windows ---")
+    save_run_metrics(summary, output_path, agent_records, page_stats)
+    return summary
+
+
+def run_document_incremental(app, pdf_path: str, output_path: str, resume: bool = False) -> Dict[str, Any]:
+    """
+    Re-runs a revised PDF, reprocessing only pages whose content fingerprint changed.
+
+    Needs the previous JSON output at output_path and its '.pages.json' fingerprint sidecar
+    (written by every successful run). Chunks of unchanged pages are reused (moved to their
+    new page numbers if pages were inserted/removed), only the changed pages go through
+    the graph, and the result is spliced back together with a contiguous 'chunk_index'.
+    Falls back to a full run when there is no usable previous output.
+    """
+    from agents.parser import scan_document, FINGERPRINT_VERSION
+    start_time = time.perf_counter()
+    manifest_path = page_manifest_path(output_path)
+    previous_manifest = load_json_data(manifest_path) if os.path.exists(manifest_path) else None
+    previous_chunks = load_json_data(output_path) if os.path.exists(output_path) else None
+
+    if (not previous_manifest or not isinstance(previous_chunks, list)
+            or previous_manifest.get("fingerprint_version") != FINGERPRINT_VERSION):
+        print("--- No usable previous output/fingerprints found. Running the full pipeline. ---")
+        return run_document(app, pdf_path, output_path, resume=resume)
+
+    # One parse of every page gives the fingerprints and the layout the changed pages are parsed with
+    current_fingerprints, document_layout = scan_document(pdf_path)
+    reused_pages, changed_pages = plan_incremental_update(previous_manifest["page_fingerprints"], current_fingerprints)
+    # Chunks spanning several pages (text units, native semantic chunks) are only reused if all their pages are
+    reused_pages, changed_pages = expand_changed_pages(previous_chunks, reused_pages, changed_pages)
+    print(f"--- Incremental run: {len(changed_pages)} changed pages, {len(reused_pages)} reused ---")
+
+    new_chunks = []
+    agent_records = []
+    page_stats = None
+    changed_page_numbers = [p - 1 for p in changed_pages]
+    if changed_pages:
+        doc_hash = checkpoint_document_hash(app, pdf_path)
+        final_state = invoke_graph(app, pdf_path, page_numbers=changed_page_numbers, resume=resume, doc_hash=doc_hash,
+                                   document_layout=document_layout)
+        agent_records = final_state.get("agent_metrics") or []
+        page_stats = final_state.get("page_parse_stats")
+        if final_state.get("error_message"):
+            # Keep the previous output untouched; report the failure
+            print(f"Incremental run failed: {final_state['error_message']}")
+            summary = {"pdf_path": pdf_path, "status": "error", "output_path": output_path,
+                       "chunk_count": len(previous_chunks), "page_count": len(current_fingerprints),
+                       "error": final_state["error_message"], "changed_pages": changed_pages,
+                       "seconds": round(time.perf_counter() - start_time, 3)}
+            save_run_metrics(summary, output_path, agent_records, page_stats)
+            return summary
+        new_chunks = final_state.get("final_chunks") or []
+
+    # Reused chunks keep their vectors: move them from the previous sidecar onto the chunks,
+    # so they are written at their new rows below
+    previous_embeddings = load_embeddings_sidecar(output_path)
+    if previous_embeddings is not None:
+        for chunk in previous_chunks:
+            row = (chunk.get("metadata") or {}).pop("embedding_row", None)
+            if row is not None and row < len(previous_embeddings):
+                chunk["embedding"] = previous_embeddings[row].tolist()
+    final_chunks = splice_chunks(previous_chunks, new_chunks, reused_pages)
+    # Document-level metadata copied into reused chunks must describe the new revision
+    for chunk in final_chunks:
+        chunk["metadata"]["source"] = pdf_path
+        if "page_count" in chunk["metadata"]:
+            chunk["metadata"]["page_count"] = len(current_fingerprints)
+    chunk_embeddings = extract_chunk_embeddings(final_chunks)
+    save_embeddings_sidecar(chunk_embeddings, output_path, len(final_chunks), final_chunks)
+    save_json_output(final_chunks, output_path)
+    save_page_manifest(output_path, pdf_path, current_fingerprints)
+    if changed_pages:
+        release_checkpoints(app, doc_hash, changed_page_numbers)
+
+    summary = {
+        "pdf_path": pdf_path,
+        "status": "ok" if final_chunks else "empty",
+        "output_path": output_path,
+        "chunk_count": len(final_chunks),
+        "page_count": len(current_fingerprints),
+        "error": None,
+        "changed_pages": changed_pages,
+        "reused_page_count": len(reused_pages),
+        "seconds": round(time.perf_counter() - start_time, 3),
+    }
+    save_run_metrics(summary, output_path, agent_records, page_stats)
+    return summary
+
+
+def print_startup_profile(compile_seconds: float):
+    """Prints the import time of every agent module and the (first-use) init time of every model/chain."""
+    print("--- Startup profile ---")
+    print(f"  Graph build + compile (incl. agent imports): {compile_seconds:.4f}s")
+    for name, seconds in agent_import_seconds.items():
+        print(f"  import {'agents.' + name:<28} {seconds:>8.4f}s")
+    for name, info in resource_init_report().items():
+        if not info["built"]:
+            print(f"  init   {name:<28} not used")
+        else:
+            status = f" (failed: {info['error'].splitlines()[0]})" if info["error"] else ""
+            print(f"  init   {name:<28} {info['init_seconds']:>8.4f}s{status}")
+
+
+def run_pipeline(pdf_path: str, output_path: str, visualize: bool = True, viz_path: str = "workflow_graph.png",
+                 parallel: bool = True, stream_pages: Optional[int] = None, incremental: bool = False,
+                 checkpoint: bool = True, resume: bool = False, prometheus_path: Optional[str] = None,
+                 profile_startup: bool = False):
+    """
+    Initializes and runs the PDF processing pipeline.
+
+    Args:
+        pdf_path: Path to the input PDF file.
+        output_path: Path to save the final JSON output.
+        visualize: Whether to generate and save a visualization of the graph.
+        viz_path: Path to save the graph visualization image.
+        parallel: Whether to run the text/vision/table agents as parallel branches.
+        stream_pages: If set, process the document in windows of this many pages and
+                      append the chunks to a JSONL file as each window completes.
+        incremental: If True, reprocess only the pages that changed since the previous
+                     output at output_path (see run_document_incremental).
+        checkpoint: Save graph checkpoints to SQLite so a failed run can be resumed.
+        resume: Continue a previously failed run from its last successful agent.
+        prometheus_path: If set, also write the per-agent metrics to this file in the
+                         Prometheus text format.
+        profile_startup: Print the import time of each agent and the init time of each
+                         model/chain (models are built lazily, on first use during the run).
+    """
+    print(f"--- Starting Pipeline for: {pdf_path} ---")
+
+    # Create and compile the graph
+    compile_start = time.perf_counter()
+    app = compile_app(parallel=parallel, checkpoint=checkpoint or resume)
+    compile_seconds = time.perf_counter() - compile_start
+
+    # --- Visualize the graph (Optional) ---
+    if visualize:
+        try:
+            print(f"Attempting to visualize graph and save to {viz_path}...")
+            # Get the graph object
+            graph = app.get_graph()
+            # Draw the graph and save as PNG
+            # You might need write permissions in the target directory
+            graph.draw_mermaid_png(output_file_path=viz_path)
+            print(f"Graph visualization saved successfully to {viz_path}")
+        except ImportError:
+            print("!!! Visualization failed: `pygraphviz` not installed or Graphviz system library not found. !!!")
+            print("Install Graphviz (system) and then run: pip install pygraphviz")
+        except Exception as viz_error:
+            print(f"!!! An error occurred during graph visualization: {viz_error} !!!")
+            # Print traceback for detailed debugging if needed
+            import traceback
+            traceback.print_exc()
+
+    if incremental:
+        summary = run_document_incremental(app, pdf_path, output_path, resume=resume)
+    elif stream_pages:
+        summary = run_document_streaming(app, pdf_path, output_path, stream_pages, resume=resume)
+    else:
+        summary = run_document(app, pdf_path, output_path, resume=resume)
+    if prometheus_path:
+        write_prometheus_metrics([summary], prometheus_path)
+    if profile_startup:
+        print_startup_profile(compile_seconds)
+    return summary
 
 
 if __name__ == "__main__":
@@ -127,6 +532,13 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", default="output.json", help="Path to save the output JSON file (default: output.json).")
     parser.add_argument("--noviz", action="store_true", help="Disable graph visualization generation.")
     parser.add_argument("--vizpath", default="workflow_graph.png", help="Path to save the graph visualization image (default: workflow_graph.png).")
+    parser.add_argument("--sequential", action="store_true", help="Run the text/vision/table agents one after another instead of in parallel (for debugging).")
+    parser.add_argument("--resume", action="store_true", help="Resume a failed run of this document from its last successful agent (uses the SQLite checkpoints).")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not save graph checkpoints (a failed run can then not be resumed).")
+    parser.add_argument("--prometheus", default=None, metavar="PATH", help="Also write the per-agent metrics to PATH in the Prometheus text format (e.g. for the node_exporter textfile collector).")
+    parser.add_argument("--profile-startup", action="store_true", help="Print the import time of each agent and the init time of each model/chain.")
+    parser.add_argument("--incremental", action="store_true", help="Reprocess only pages whose content changed since the previous output at --output (uses its .pages.json fingerprints).")
+    parser.add_argument("--stream-pages", type=int, default=None, metavar="N", help="Streaming mode: process N-page windows and append chunks to a .jsonl file as each window completes.")
 
     args = parser.parse_args()
 
@@ -134,4 +546,7 @@ if __name__ == "__main__":
         print(f"Error: Input PDF file not found at {args.pdf_file}")
     else:
         # Pass visualization flag and path to the function
-        run_pipeline(args.pdf_file, args.output, visualize=(not args.noviz), viz_path=args.vizpath)
+        run_pipeline(args.pdf_file, args.output, visualize=(not args.noviz), viz_path=args.vizpath,
+                     parallel=(not args.sequential), stream_pages=args.stream_pages, incremental=args.incremental,
+                     checkpoint=(not args.no_checkpoint), resume=args.resume,
+                     prometheus_path=args.prometheus, profile_startup=args.profile_startup)
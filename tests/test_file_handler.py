@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.file_handler import embeddings_path_for, load_embeddings_sidecar, save_embeddings_sidecar
+
+
+def test_sidecar_creates_missing_output_directory(tmp_path):
+    output_path = str(tmp_path / "new_dir" / "doc.json")
+
+    save_embeddings_sidecar({0: [1.0, 0.0], 1: [0.0, 1.0]}, output_path, row_count=2)
+
+    assert os.path.exists(embeddings_path_for(output_path))
+    assert load_embeddings_sidecar(output_path).shape == (2, 2)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.parser import compute_page_fingerprints
+from utils.incremental import plan_incremental_update
+
+
+def _write_report(path: str, bodies):
+    """A PDF with a running header and a numbered footer ("Page n of N") on every page."""
+    doc = fitz.open()
+    for number, body in enumerate(bodies, start=1):
+        page = doc.new_page()
+        page.insert_text((72, 40), "ACME Corp - Annual Report 2024")
+        page.insert_text((260, 810), f"Page {number} of {len(bodies)}")
+        page.insert_text((72, 300), body)
+    doc.save(path)
+    doc.close()
+
+
+def test_inserted_page_only_changes_itself(tmp_path):
+    bodies = [f"Body paragraph {i} about revenue, unique to this page." for i in range(1, 12)]
+    old_path, new_path = str(tmp_path / "old.pdf"), str(tmp_path / "new.pdf")
+    _write_report(old_path, bodies)
+    _write_report(new_path, bodies[:5] + ["An inserted page about costs."] + bodies[5:])
+
+    reused_pages, changed_pages = plan_incremental_update(compute_page_fingerprints(old_path),
+                                                          compute_page_fingerprints(new_path))
+
+    assert changed_pages == [6]
+    assert len(reused_pages) == 11
+    assert reused_pages[7] == 6 and reused_pages[12] == 11
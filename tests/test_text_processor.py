@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents import text_processor
+
+
+def _text_element(content: str, page_number: int = 1):
+    return {"type": "text", "content": content, "metadata": {"page_number": page_number, "bbox": (0, 0, 1, 1)}}
+
+
+def test_long_unbroken_line_is_split_within_budget(monkeypatch):
+    monkeypatch.setattr(text_processor, "_unit_budget", lambda: (len, 100))
+    line = "x" * 450 # No line break, sentence end or space to split at
+
+    units = text_processor.consolidate_text_blocks([_text_element(line)])
+
+    assert all(len(unit["content"]) <= 100 for unit in units)
+    assert "".join(unit["content"] for unit in units) == line
+
+
+def test_long_line_is_split_at_words_before_cutting(monkeypatch):
+    monkeypatch.setattr(text_processor, "_unit_budget", lambda: (len, 100))
+    line = " ".join(f"word{i}" for i in range(60)) # One line, one sentence
+
+    units = text_processor.consolidate_text_blocks([_text_element(line)])
+
+    assert all(len(unit["content"]) <= 100 for unit in units)
+    assert " ".join(unit["content"] for unit in units).split() == line.split()
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+import contextvars
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+def run_coroutine(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine to completion from synchronous code (e.g. a graph node).
+    If the calling thread already runs an event loop (Jupyter notebooks), the
+    coroutine is run on a fresh loop in a helper thread instead (with a copy of the
+    caller's context, so e.g. the running agent's metrics are still found).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+    def _runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(_runner,))
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
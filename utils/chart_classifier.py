@@ -0,0 +1,130 @@
+import io
+from typing import Dict, Any, Optional
+
+# Optional dependencies: without Pillow/NumPy the pre-filter is disabled and every
+# image is routed to the chart prompt, exactly as before.
+try:
+    import numpy as np
+    from PIL import Image
+    CLASSIFIER_AVAILABLE = True
+except ImportError:
+    print("Pillow/NumPy not available. Chart pre-classifier disabled.")
+    CLASSIFIER_AVAILABLE = False
+
+# --- Configuration ---
+ANALYSIS_MAX_EDGE = 256 # Images are downsampled to this size before computing statistics
+CHART_SCORE_THRESHOLD = 0.5 # Score >= threshold => likely chart
+MIN_CHART_EDGE_PX = 48 # Smaller images are icons/bullets, never charts
+# Feature thresholds (tuned on typical report graphics: charts are flat-colored,
+# mostly background, with long straight axis/grid lines; photos are not)
+TOP_COLORS = 8
+FLAT_COLOR_COVERAGE = 0.80 # Share of pixels covered by the TOP_COLORS most frequent colors
+BACKGROUND_RATIO = 0.35 # Share of near-white/background pixels
+LINE_RUN_RATIO = 0.6 # A row/column counts as a line if edge pixels span this share of it
+MIN_LINE_COUNT = 2
+
+
+def _load_gray_and_rgb(image_bytes: Optional[bytes], image=None, original_size=None):
+    """Decodes the image (unless already decoded) and returns downsampled (rgb, gray) uint8 arrays."""
+    if image is None:
+        image = Image.open(io.BytesIO(image_bytes))
+    original_size = original_size or image.size
+    image = image.convert("RGB")
+    image.thumbnail((ANALYSIS_MAX_EDGE, ANALYSIS_MAX_EDGE))
+    rgb = np.asarray(image, dtype=np.uint8)
+    gray = (rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114).astype(np.float32)
+    return rgb, gray, original_size
+
+
+def compute_image_features(image_bytes: Optional[bytes], image=None, original_size=None) -> Optional[Dict[str, float]]:
+    """
+    Computes cheap global statistics of an image:
+      - palette_size: distinct colors after quantizing to 32 levels per channel
+      - top_color_coverage: share of pixels covered by the most frequent colors
+      - background_ratio: share of near-white pixels (white space)
+      - edge_density: share of pixels with a strong gradient
+      - line_count: rows/columns with long straight edge runs (axes, grid lines, bars)
+      - aspect_ratio: width / height
+    image/original_size: An already decoded (e.g. downsized) Pillow image and the size of
+    the original, to avoid decoding image_bytes again.
+    Returns None if the image cannot be decoded.
+    """
+    if not CLASSIFIER_AVAILABLE:
+        return None
+    try:
+        rgb, gray, (width, height) = _load_gray_and_rgb(image_bytes, image, original_size)
+    except Exception as e:
+        print(f"    Chart pre-classifier could not decode image: {e}")
+        return None
+
+    pixel_count = gray.size
+    # Palette statistics on 5-bit quantized colors
+    quantized = (rgb >> 3).astype(np.int32)
+    color_ids = (quantized[..., 0] << 10) | (quantized[..., 1] << 5) | quantized[..., 2]
+    _, counts = np.unique(color_ids, return_counts=True)
+    counts = np.sort(counts)[::-1]
+    top_color_coverage = float(counts[:TOP_COLORS].sum() / pixel_count)
+
+    # White space: near-white pixels
+    background_ratio = float(np.mean(gray > 235))
+
+    # Edges via simple finite differences
+    grad_x = np.abs(np.diff(gray, axis=1))
+    grad_y = np.abs(np.diff(gray, axis=0))
+    edges_x = grad_x > 40
+    edges_y = grad_y > 40
+    edge_density = float((edges_x.sum() + edges_y.sum()) / (2 * pixel_count))
+
+    # Straight lines: a horizontal line creates a row of vertical-gradient edges and vice versa
+    horizontal_lines = int(np.sum(edges_y.mean(axis=1) >= LINE_RUN_RATIO))
+    vertical_lines = int(np.sum(edges_x.mean(axis=0) >= LINE_RUN_RATIO))
+
+    return {
+        "width": int(width),
+        "height": int(height),
+        "aspect_ratio": round(width / height, 3) if height else 0.0,
+        "palette_size": int(len(counts)),
+        "top_color_coverage": round(top_color_coverage, 3),
+        "background_ratio": round(background_ratio, 3),
+        "edge_density": round(edge_density, 4),
+        "line_count": horizontal_lines + vertical_lines,
+    }
+
+
+def classify_chart(image_bytes: Optional[bytes], image=None, original_size=None) -> Optional[Dict[str, Any]]:
+    """
+    Fast CPU-only guess whether an image is a chart/graph (vs. photo, logo, icon).
+
+    Returns:
+        {"is_chart": bool, "confidence": float, "score": float, "features": {...}}
+        or None if the classifier is unavailable or the image cannot be decoded
+        (callers should then fall back to asking the vision model).
+    """
+    features = compute_image_features(image_bytes, image, original_size)
+    if features is None:
+        return None
+
+    if min(features["width"], features["height"]) < MIN_CHART_EDGE_PX:
+        return {"is_chart": False, "confidence": 0.95, "score": 0.0, "features": features}
+
+    # Weighted vote of the individual cues, each scaled to [0, 1]
+    flat_colors = min(1.0, features["top_color_coverage"] / FLAT_COLOR_COVERAGE)
+    white_space = min(1.0, features["background_ratio"] / BACKGROUND_RATIO)
+    lines = min(1.0, features["line_count"] / MIN_LINE_COUNT)
+    # Charts have clear but sparse edges; photos are either smooth or very busy
+    sparse_edges = 1.0 if 0.01 <= features["edge_density"] <= 0.25 else 0.3
+    # Extremely elongated images are usually separators/banners
+    shape = 1.0 if 0.33 <= features["aspect_ratio"] <= 3.0 else 0.2
+
+    score = (0.30 * flat_colors + 0.25 * white_space + 0.25 * lines + 0.10 * sparse_edges + 0.10 * shape)
+    # Photos: large palettes that are not dominated by a few flat colors
+    if features["palette_size"] > 2000 and features["top_color_coverage"] < 0.5:
+        score *= 0.5
+    # Logos/icons: flat colors but neither axis lines nor much structure
+    if features["line_count"] == 0 and features["edge_density"] < 0.01:
+        score *= 0.6
+
+    is_chart = score >= CHART_SCORE_THRESHOLD
+    # Confidence grows with the distance from the decision threshold
+    confidence = 0.5 + min(0.5, abs(score - CHART_SCORE_THRESHOLD) / CHART_SCORE_THRESHOLD * 0.5)
+    return {"is_chart": is_chart, "confidence": round(confidence, 3), "score": round(score, 3), "features": features}
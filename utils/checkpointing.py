@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# Durable LangGraph checkpoints in a local SQLite file.
+# Every graph run is a checkpoint "thread" keyed by the document's content hash, so a run
+# that failed late (e.g. in the chunker or formatter) can be resumed from its last
+# successful node instead of repeating all parsing and LLM work.
+# Requires: pip install langgraph-checkpoint-sqlite
+DEFAULT_CHECKPOINT_DB = os.path.join(".cache", "checkpoints.sqlite")
+
+
+def document_hash(pdf_path: str) -> str:
+    """SHA-256 of the file content (the same document gets the same checkpoint thread wherever it lives)."""
+    hasher = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def thread_id_for(doc_hash: str, page_numbers: Optional[List[int]] = None) -> str:
+    """
+    Checkpoint thread id of a run: the document hash (see document_hash; computed once per
+    document by the caller), plus the page subset for windowed/incremental runs.
+    """
+    thread_id = doc_hash
+    if page_numbers is not None:
+        pages_key = hashlib.sha256(",".join(map(str, page_numbers)).encode("ascii")).hexdigest()[:16]
+        thread_id += f":pages-{pages_key}"
+    return thread_id
+
+
+def open_checkpointer(db_path: Optional[str] = None):
+    """
+    Opens the SQLite checkpointer (the connection is shared by the threads of one process).
+    Returns None (and runs without checkpoints) if langgraph-checkpoint-sqlite is not installed.
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        print("langgraph-checkpoint-sqlite not installed. Running without checkpoints (no --resume).")
+        return None
+    db_path = db_path or os.getenv("CHECKPOINT_DB", DEFAULT_CHECKPOINT_DB)
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    checkpointer = SqliteSaver(conn)
+    checkpointer.setup()
+    return checkpointer
+
+
+def find_resume_point(app, thread_config: Dict[str, Any]) -> Optional[Any]:
+    """
+    Finds the newest checkpoint of the thread that has no error and still has nodes to run,
+    i.e. the state right after the last successful step.
+
+    Returns:
+        The StateSnapshot to resume from, or None if the thread has no usable checkpoint.
+        A thread whose newest checkpoint finished without error is returned as-is
+        (its 'next' is empty, so there is nothing left to run).
+    """
+    history = list(app.get_state_history(thread_config)) # Newest first
+    if not history:
+        return None
+    latest = history[0]
+    if not latest.next and not latest.values.get("error_message"):
+        return latest # Completed successfully already
+    for snapshot in history:
+        if snapshot.next and not snapshot.values.get("error_message"):
+            return snapshot
+    return None
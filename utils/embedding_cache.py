@@ -0,0 +1,231 @@
+import os
+import re
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from utils.metrics import current_agent_metrics
+
+# --- Configuration (environment variables) ---
+# EMBEDDING_CACHE_ENABLED: "false"/"0" disables the cache (embeddings are computed on every call).
+# EMBEDDING_CACHE_PATH: SQLite file that stores the vectors.
+# EMBEDDING_CACHE_MAX_ENTRIES: least recently used vectors beyond this count are evicted.
+# EMBEDDING_BATCH_SIZE: max texts per embedding request sent to the model.
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join(".cache", "embedding_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 1_000_000
+DEFAULT_BATCH_SIZE = 64
+SQLITE_MAX_VARIABLES = 500 # Keys per SELECT ... IN (...) query
+EVICTION_INTERVAL = 5000 # Run eviction every N stored vectors
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC and collapsed whitespace: texts differing only in layout share one vector."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_key(model: Optional[str], dimensions: Optional[int], normalized_text: str) -> str:
+    return hashlib.sha256(f"{model}\x1f{dimensions}\x1f{normalized_text}".encode("utf-8")).hexdigest()
+
+
+def embeddings_model_id(embeddings: Embeddings) -> str:
+    """Backend class and model name: the fake backend and Ollama never share vectors of the same model name."""
+    return f"{type(embeddings).__name__}:{getattr(embeddings, 'model', None)}"
+
+
+class EmbeddingCache:
+    """
+    Persistent sentence-embedding cache backed by SQLite, keyed by (embeddings class and model,
+    vector size, normalized text). Vectors are stored as float32 blobs. Safe to share between threads; every process
+    opens its own connection.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " dimensions INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache(last_access)")
+        self._conn.commit()
+        self.evict()
+
+    def get_many(self, keys: List[str], dimensions: Optional[int] = None) -> Dict[str, List[float]]:
+        """
+        Returns the cached vectors of the given keys (missing keys are absent from the result).
+        With dimensions set, vectors of another size are not returned (counted as misses).
+        """
+        found = {}
+        rejected = 0
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                rows = self._conn.execute(
+                    f"SELECT key, dimensions, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, row_dimensions, blob in rows:
+                    if dimensions and (row_dimensions != dimensions or len(blob) != 4 * dimensions):
+                        rejected += 1
+                        continue
+                    vector = array.array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        if rejected:
+            print(f"    Embedding cache: ignored {rejected} cached vectors of the wrong size (expected {dimensions}).")
+        return found
+
+    def set_many(self, vectors: Dict[str, List[float]], model: Optional[str] = None):
+        """Stores vectors by key."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, dimensions, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                [(key, model, len(vector), array.array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+            previous_writes = self.writes
+            self.writes += len(vectors)
+            run_eviction = self.writes // EVICTION_INTERVAL > previous_writes // EVICTION_INTERVAL
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used vectors beyond max_entries."""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            if self.max_entries > 0 and count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN"
+                    " (SELECT key FROM embedding_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                self._conn.commit()
+                print(f"Embedding cache: evicted {count - self.max_entries} vectors.")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "entries": count}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Process-wide cache instance ---
+_cache: Optional[EmbeddingCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the embedding cache of the current process (created on first use), or None if disabled."""
+    global _cache, _cache_pid
+    if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("0", "false", "no", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            try:
+                _cache = EmbeddingCache(
+                    path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_EMBEDDING_CACHE_PATH),
+                    max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                )
+                _cache_pid = os.getpid()
+            except Exception as e:
+                print(f"Could not open embedding cache: {e}. Running without cache.")
+                return None
+        return _cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with the persistent cache. embed_documents deduplicates its
+    input, looks all texts up in one pass and embeds only the misses, in requests of at
+    most batch_size texts. The vector size is part of the key: it is taken from the model's
+    'dimensions' attribute, or learned from the first vector it returns.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, batch_size: Optional[int] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = embeddings_model_id(embeddings)
+        self.dimensions: Optional[int] = getattr(embeddings, "dimensions", None)
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        normalized = [normalize_text(text) for text in texts]
+        metrics = current_agent_metrics()
+        probe = {}
+        if self.dimensions is None and normalized:
+            # Vector size not declared by the model: learn it from one fresh vector
+            vector = self.embeddings.embed_documents([normalized[0]])[0]
+            self.dimensions = len(vector)
+            probe[embedding_key(self.model, self.dimensions, normalized[0])] = vector
+            if metrics is not None:
+                metrics.add(embedding_requests=1, embedded_texts=1)
+            self._store(probe)
+        keys = [embedding_key(self.model, self.dimensions, text) for text in normalized]
+        unique = dict(zip(keys, normalized)) # key -> text, first occurrence order
+        try:
+            vectors = self.cache.get_many([key for key in unique if key not in probe], dimensions=self.dimensions)
+        except sqlite3.Error as e:
+            print(f"    Embedding cache lookup failed: {e}")
+            vectors = {}
+        vectors.update(probe)
+
+        missing = [key for key in unique if key not in vectors]
+        if metrics is not None:
+            metrics.add(embedding_cache_hits=len(unique) - len(missing))
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            new_vectors = dict(zip(batch, self.embeddings.embed_documents([unique[key] for key in batch])))
+            if metrics is not None:
+                metrics.add(embedding_requests=1, embedded_texts=len(batch))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        """Caches freshly computed vectors, except any whose size differs from the model's."""
+        valid = {key: vector for key, vector in vectors.items() if len(vector) == self.dimensions}
+        if len(valid) < len(vectors):
+            print(f"    Embedding cache: not storing {len(vectors) - len(valid)} vectors of the wrong size (expected {self.dimensions}).")
+        try:
+            self.cache.set_many(valid, model=self.model)
+        except sqlite3.Error as e:
+            print(f"    Embedding cache write failed: {e}")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def with_embedding_cache(embeddings: Embeddings) -> Embeddings:
+    """Returns the model wrapped with the persistent cache, or unchanged if the cache is disabled."""
+    cache = get_embedding_cache()
+    return CachedEmbeddings(embeddings, cache) if cache is not None else embeddings
@@ -0,0 +1,128 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Deterministic stand-ins for the Ollama chat/embedding models (LLM_BACKEND=fake, see utils/llm_provider.py).
+# Answers are derived from the prompt only (same prompt -> same answer), in the formats the
+# agents parse, and every call sleeps for a configurable, size-dependent "inference" latency:
+#   FAKE_LLM_LATENCY_MS: fixed latency per chat call (default 0)
+#   FAKE_LLM_MS_PER_1K_CHARS: extra latency per 1000 prompt characters (images count by base64 size)
+#   FAKE_EMBEDDING_LATENCY_MS: fixed latency per embedding request (default 0)
+#   FAKE_EMBEDDING_MS_PER_TEXT: extra latency per embedded text
+FAKE_EMBEDDING_DIMENSIONS = 256
+
+
+def _env_ms(name: str) -> float:
+    return float(os.getenv(name, 0)) / 1000.0
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _message_text(message: BaseMessage) -> str:
+    """Text parts of a message (multimodal content lists contain text and image_url parts)."""
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(part.get("text", "") for part in message.content if isinstance(part, dict))
+
+
+def _message_size(message: BaseMessage) -> int:
+    if isinstance(message.content, str):
+        return len(message.content)
+    size = 0
+    for part in message.content:
+        if isinstance(part, dict):
+            image_url = part.get("image_url")
+            size += len(part.get("text", "")) + len(image_url.get("url", "") if isinstance(image_url, dict) else image_url or "")
+    return size
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers deterministically after a simulated latency."""
+    model: str = "fake-chat"
+    response_format: Optional[str] = None # "json" mimics ChatOllama(format="json")
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _latency(self, messages: List[BaseMessage]) -> float:
+        prompt_chars = sum(_message_size(m) for m in messages)
+        return _env_ms("FAKE_LLM_LATENCY_MS") + _env_ms("FAKE_LLM_MS_PER_1K_CHARS") * prompt_chars / 1000
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = "\n".join(_message_text(m) for m in messages if isinstance(m, SystemMessage))
+        user = _message_text(messages[-1]) if messages else ""
+        fingerprint = _digest(json.dumps([_message_size(m) for m in messages]) + system + user)[:8]
+        framed = re.search(r"---\n(.*)\n---", user, re.DOTALL)
+        payload = framed.group(1) if framed else user
+
+        if self.response_format == "json" or "JSON object" in user:
+            return json.dumps({"description": f"Synthetic image {fingerprint}.", "ocr_text": None,
+                               "is_chart": False, "chart_type": None, "chart_summary": None})
+        if "Named Entities" in system:
+            acronyms = sorted(set(re.findall(r"\b[A-Z]{2,6}\b", payload)))[:3]
+            names = sorted(set(re.findall(r"\b[A-Z][a-z]{3,}\b", payload)))[:3]
+            return ("Named Entities:\n" + ("\n".join(f"MISC: {name}" for name in names) or "None")
+                    + "\n\nAcronyms:\n" + ("\n".join(f"{acr}: {acr} (expanded)" for acr in acronyms) or "None"))
+        table = re.search(r"Table Data:\n(.*?)\n\n(Markdown Table|Summary)", user, re.DOTALL)
+        if table:
+            return table.group(1).strip()
+        if "clean" in system.lower():
+            return payload.strip()
+        return f"Synthetic answer {fingerprint}: {payload[:200].strip()}"
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        text = self._respond(messages)
+        prompt_tokens = sum(_message_size(m) for m in messages) // 4
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": len(text) // 4,
+            "total_tokens": prompt_tokens + len(text) // 4})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency(messages))
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency(messages))
+        return self._result(messages)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings: hashed bag of words, L2-normalized.
+    Texts sharing words get similar vectors, so semantic chunking still finds breakpoints.
+    """
+
+    def __init__(self, model: str = "fake-embeddings", dimensions: int = FAKE_EMBEDDING_DIMENSIONS):
+        self.model = model
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            digest = _digest(word)
+            # Signed feature hashing: the bucket and the sign come from different hash bits
+            vector[int(digest[:8], 16) % self.dimensions] += 1.0 if int(digest[8], 16) % 2 == 0 else -1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(_env_ms("FAKE_EMBEDDING_LATENCY_MS") + _env_ms("FAKE_EMBEDDING_MS_PER_TEXT") * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -1,6 +1,14 @@
 import json
+import math
 import os
-from typing import Any
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Optional dependency: only needed to write/read the chunk embedding sidecar
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 def save_json_output(data: Any, output_path: str):
     """
@@ -39,6 +47,122 @@ def save_json_output(data: Any, output_path: str):
         print(f"An unexpected error occurred during saving: {e}")
 
 
+def append_jsonl_output(records: List[Any], output_path: str):
+    """
+    Appends records to a JSON Lines file (one JSON object per line), creating it if needed.
+    Used by the streaming mode so consumers can read chunks while the document is still processed.
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print(f"Created output directory: {output_dir}")
+
+    with open(output_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            try:
+                line = json.dumps(record, ensure_ascii=False)
+            except TypeError as e:
+                print(f"Warning: Record is not JSON serializable ({e}). Converting to strings.")
+                line = json.dumps(_force_serializable(record), ensure_ascii=False)
+            f.write(line + "\n")
+        # Make the lines visible to readers right away
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def embeddings_path_for(output_path: str) -> str:
+    """Sidecar file holding the chunk embeddings of an output (output/doc.json -> output/doc.embeddings.npy)."""
+    return os.path.splitext(output_path)[0] + ".embeddings.npy"
+
+
+def extract_chunk_embeddings(chunks: List[Dict[str, Any]]) -> Dict[int, List[float]]:
+    """
+    Removes the 'embedding' vectors from the chunks (they are not written to the JSON output)
+    and records each chunk's row in the sidecar file as metadata 'embedding_row' (= chunk_index).
+    Returns {row: vector}.
+    """
+    vectors = {}
+    for chunk in chunks:
+        vector = chunk.pop("embedding", None)
+        if vector is None:
+            continue
+        metadata = chunk.setdefault("metadata", {})
+        row = metadata.get("chunk_index", len(vectors))
+        metadata["embedding_row"] = row
+        vectors[row] = vector
+    return vectors
+
+
+def _valid_vector(vector: Any) -> bool:
+    return isinstance(vector, (list, tuple)) and bool(vector) and all(
+        isinstance(value, (int, float)) and math.isfinite(value) for value in vector)
+
+
+def find_invalid_embeddings(vectors: Dict[Any, Any]) -> Tuple[Optional[int], Set[Any]]:
+    """
+    The document's embedding dimensions (the most common size among the valid vectors, None
+    if there is none) and the keys of the vectors that are not a non-empty list of finite
+    numbers of that size. Shared by the formatter and the sidecar writer, so the chunk JSON
+    and the .npy file agree on which rows are valid.
+    """
+    dimensions = Counter(len(vector) for vector in vectors.values() if _valid_vector(vector))
+    expected = dimensions.most_common(1)[0][0] if dimensions else None
+    return expected, {key for key, vector in vectors.items() if not _valid_vector(vector) or len(vector) != expected}
+
+
+def save_embeddings_sidecar(vectors: Dict[int, List[float]], output_path: str, row_count: int,
+                            chunks: Optional[List[Dict[str, Any]]] = None):
+    """
+    Writes the chunk embeddings as a float32 (row_count x dimensions) .npy array next to the
+    output, row i holding the vector of chunk_index i (zeros for chunks without one).
+    The dimensions are the most common ones over the whole document (streaming windows and
+    reused chunks of incremental runs may come from another model); other vectors are dropped
+    with a warning and, if the chunks are given, lose their 'embedding_row' metadata.
+    Load it with numpy.load(path, mmap_mode="r") to avoid reading it all into memory.
+    A stale sidecar is removed when there are no vectors.
+    """
+    sidecar_path = embeddings_path_for(output_path)
+    if vectors and np is None:
+        print("Warning: NumPy not available. Chunk embeddings are not saved.")
+        return
+    expected, dropped = find_invalid_embeddings(vectors)
+    if dropped:
+        print(f"Warning: Dropping {len(dropped)} invalid chunk embeddings (expected {expected} dimensions; "
+              f"rows {sorted(dropped)[:10]}{'...' if len(dropped) > 10 else ''}).")
+        vectors = {row: vector for row, vector in vectors.items() if row not in dropped}
+        for chunk in chunks or []:
+            metadata = chunk.get("metadata") or {}
+            if metadata.get("embedding_row") in dropped:
+                del metadata["embedding_row"]
+    if not vectors:
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        return
+    output_dir = os.path.dirname(sidecar_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True) # Written before the JSON output, which would create it
+    matrix = np.zeros((max(row_count, max(vectors) + 1), expected), dtype=np.float32)
+    for row, vector in vectors.items():
+        matrix[row] = vector
+    tmp_path = sidecar_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, sidecar_path)
+    print(f"Successfully saved {len(vectors)} chunk embeddings ({expected} dimensions) to {sidecar_path}")
+
+
+def load_embeddings_sidecar(output_path: str) -> Optional[Any]:
+    """The (memory-mapped) embedding matrix of an output, or None if there is none."""
+    sidecar_path = embeddings_path_for(output_path)
+    if np is None or not os.path.exists(sidecar_path):
+        return None
+    try:
+        return np.load(sidecar_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read chunk embeddings from {sidecar_path}: {e}")
+        return None
+
+
 def _force_serializable(obj: Any) -> Any:
     """Recursively converts non-serializable items to strings."""
     if isinstance(obj, dict):
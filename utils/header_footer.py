@@ -0,0 +1,145 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Optional dependency: without NumPy running headers/footers are left to the LLM cleaning prompt.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    print("NumPy not available. Header/footer detection disabled.")
+    NUMPY_AVAILABLE = False
+
+# Document-level detection of running headers and footers, run by the parser after all pages
+# are parsed. A text block is a header/footer if its normalized text (lowercase, digits
+# masked, so "Page 3 of 40" matches "Page 4 of 40") occurs in the top or bottom margin band
+# at the same vertical position on many pages. Positions are compared as one array per
+# distinct text: blocks within HEADER_FOOTER_POSITION_TOLERANCE of the median position form
+# the repeated cluster. When only some pages are parsed (streaming windows, incremental runs)
+# the repetition is counted over the whole document: the parser passes the signatures
+# (band, normalized text, y0/y1) found on all pages, and blocks matching one are removed.
+# --- Configuration (environment variables) ---
+# HEADER_FOOTER_POLICY: "drop" (default): remove the blocks from the raw elements;
+#   "tag": keep them with 'page_furniture' metadata ("header"/"footer"), excluded from the
+#   text processing and language detection; "off": disable detection.
+HEADER_FOOTER_POLICY = os.getenv("HEADER_FOOTER_POLICY", "drop").strip().lower()
+HEADER_FOOTER_MIN_PAGES = 3 # A block repeated on at least this many pages ...
+HEADER_FOOTER_MIN_PAGE_RATIO = 0.3 # ... and on this share of the parsed pages
+HEADER_FOOTER_MARGIN_RATIO = 0.15 # Top/bottom share of the page height where headers/footers sit
+HEADER_FOOTER_POSITION_TOLERANCE = 4.0 # Points
+HEADER_FOOTER_MAX_CHARS = 200 # Longer blocks are body text, even if repeated
+
+
+def normalize_furniture_text(text: str) -> str:
+    """Lowercase, digits masked and whitespace collapsed: page numbers and dates don't break a match."""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "#", text.lower())).strip()
+
+
+def _margin_blocks(elements: List[Dict[str, Any]], page_heights: Dict[int, float]) -> List[Tuple[int, str, str]]:
+    """(element index, normalized text, "header"/"footer") of the short text blocks in the margin bands."""
+    blocks = []
+    for index, element in enumerate(elements):
+        metadata = element.get("metadata", {})
+        bbox = metadata.get("bbox")
+        height = page_heights.get(metadata.get("page_number"))
+        if element.get("type") != "text" or not bbox or not height:
+            continue
+        if len(element.get("content", "")) > HEADER_FOOTER_MAX_CHARS:
+            continue
+        if bbox[3] <= height * HEADER_FOOTER_MARGIN_RATIO:
+            blocks.append((index, normalize_furniture_text(element["content"]), "header"))
+        elif bbox[1] >= height * (1 - HEADER_FOOTER_MARGIN_RATIO):
+            blocks.append((index, normalize_furniture_text(element["content"]), "footer"))
+    return blocks
+
+
+def _find_repeated(elements: List[Dict[str, Any]], page_heights: Dict[int, float]) -> Tuple[Dict[int, str], List[Dict[str, Any]]]:
+    """Running headers/footers among the elements: {element index: band} and their signatures."""
+    min_pages = max(HEADER_FOOTER_MIN_PAGES, HEADER_FOOTER_MIN_PAGE_RATIO * len(page_heights))
+
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for index, text, band in _margin_blocks(elements, page_heights):
+        if text:
+            groups.setdefault((band, text), []).append(index)
+
+    found, signatures = {}, []
+    for (band, text), indices in groups.items():
+        if len(indices) < min_pages:
+            continue
+        positions = np.array([elements[i]["metadata"]["bbox"][1::2] for i in indices], dtype=float) # (y0, y1)
+        pages = np.array([elements[i]["metadata"]["page_number"] for i in indices])
+        median = np.median(positions, axis=0)
+        near = np.all(np.abs(positions - median) <= HEADER_FOOTER_POSITION_TOLERANCE, axis=1)
+        if np.unique(pages[near]).size >= min_pages:
+            found.update({indices[i]: band for i in np.flatnonzero(near)})
+            signatures.append({"band": band, "text": text, "y0": float(median[0]), "y1": float(median[1])})
+    return found, signatures
+
+
+def header_footer_signatures(elements: List[Dict[str, Any]], page_heights: Dict[int, float]) -> List[Dict[str, Any]]:
+    """
+    Signatures of the running headers and footers of a document, from the elements of all
+    its pages: [{"band": "header" | "footer", "text": normalized text, "y0": ..., "y1": ...}].
+    """
+    if not NUMPY_AVAILABLE or HEADER_FOOTER_POLICY == "off":
+        return []
+    return _find_repeated(elements, page_heights)[1]
+
+
+def find_headers_footers(elements: List[Dict[str, Any]], page_heights: Dict[int, float],
+                         signatures: Optional[List[Dict[str, Any]]] = None) -> Dict[int, str]:
+    """
+    Finds running headers and footers.
+
+    Args:
+        elements: Raw elements (text blocks need 'page_number' and 'bbox' metadata).
+        page_heights: Page height in points by 1-based page number, for the parsed pages.
+        signatures: Signatures found over the whole document (see header_footer_signatures)
+                    when the elements are only some of its pages; None to detect the
+                    repetition among the elements themselves.
+
+    Returns:
+        {element index: "header" | "footer"}
+    """
+    if not NUMPY_AVAILABLE or HEADER_FOOTER_POLICY == "off":
+        return {}
+    if signatures is None:
+        return _find_repeated(elements, page_heights)[0]
+
+    by_text: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for signature in signatures:
+        by_text.setdefault((signature["band"], signature["text"]), []).append(signature)
+    found = {}
+    for index, text, band in _margin_blocks(elements, page_heights):
+        y0, y1 = elements[index]["metadata"]["bbox"][1::2]
+        if any(abs(y0 - signature["y0"]) <= HEADER_FOOTER_POSITION_TOLERANCE
+               and abs(y1 - signature["y1"]) <= HEADER_FOOTER_POSITION_TOLERANCE
+               for signature in by_text.get((band, text), [])):
+            found[index] = band
+    return found
+
+
+def remove_headers_footers(elements: List[Dict[str, Any]], page_heights: Dict[int, float],
+                           signatures: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+    """
+    Drops (or tags, see HEADER_FOOTER_POLICY) the running headers and footers
+    (signatures: see find_headers_footers).
+
+    Returns:
+        The elements, and the number of header/footer blocks found per page number.
+    """
+    found = find_headers_footers(elements, page_heights, signatures)
+    per_page: Dict[int, int] = {}
+    for index in found:
+        page_number = elements[index]["metadata"]["page_number"]
+        per_page[page_number] = per_page.get(page_number, 0) + 1
+    if HEADER_FOOTER_POLICY == "tag":
+        for index, band in found.items():
+            elements[index]["metadata"]["page_furniture"] = band
+        return elements, per_page
+    return [element for index, element in enumerate(elements) if index not in found], per_page
+
+
+def is_page_furniture(element: Dict[str, Any]) -> bool:
+    """True for text blocks tagged as running header/footer (kept with HEADER_FOOTER_POLICY=tag)."""
+    return bool(element.get("metadata", {}).get("page_furniture"))
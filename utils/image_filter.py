@@ -0,0 +1,157 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# Document-level filter for image references, run by the parser after all pages are parsed.
+# Tiny images (icons, bullets, spacer pixels) and separator strips are skipped; an image that
+# recurs on many pages (logo, letterhead, page background) is recognized by its xref, the
+# hash of its bytes or the hash of its pixels, analyzed once and its later occurrences
+# skipped (or dropped altogether, see REPEATED_IMAGE_POLICY); any other image embedded more
+# than once is analyzed once and the result copied to the other occurrences.
+# When only some pages are parsed (streaming windows, incremental runs), the pages an image
+# occurs on are counted over the whole document (image occurrences from the parser's scan).
+# The decision is stored in the 'image_filter' metadata of every image_ref:
+#   {"action": "analyze" | "reuse" | "skip", "reasons": [...], "pages": <pages it occurs on>,
+#    "primary": <image_ref whose analysis is reused, for "reuse" and repeated "skip">}
+# --- Configuration (environment variables) ---
+# IMAGE_FILTER: "false"/"0" disables the filter (every image is analyzed).
+# REPEATED_IMAGE_POLICY: "once" (default): analyze the first occurrence of a repeated image,
+#   skip the others; "reuse": copy its analysis to every occurrence; "drop": skip all of them.
+IMAGE_FILTER_ENABLED = os.getenv("IMAGE_FILTER", "true").lower() not in ("0", "false", "no", "off")
+REPEATED_IMAGE_POLICY = os.getenv("REPEATED_IMAGE_POLICY", "once").strip().lower()
+MIN_IMAGE_EDGE_PX = 32 # Images with a smaller side are icons or bullets
+MIN_IMAGE_AREA_RATIO = 0.003 # Images covering less of the page are too small to carry content
+MAX_IMAGE_ASPECT_RATIO = 12.0 # Longer strips are rules, separators and borders
+REPEATED_IMAGE_MIN_PAGES = 3 # An image on at least this many pages ...
+REPEATED_IMAGE_PAGE_RATIO = 0.5 # ... and on this share of the parsed pages is page decoration
+
+
+def _size_reasons(metadata: Dict[str, Any]) -> List[str]:
+    reasons = []
+    width, height = metadata.get("width"), metadata.get("height")
+    if width and height:
+        if min(width, height) < MIN_IMAGE_EDGE_PX:
+            reasons.append("tiny")
+        elif max(width, height) / min(width, height) > MAX_IMAGE_ASPECT_RATIO:
+            reasons.append("separator")
+    area_ratio = metadata.get("area_ratio")
+    if area_ratio is not None and area_ratio < MIN_IMAGE_AREA_RATIO and "tiny" not in reasons:
+        reasons.append("small_on_page")
+    return reasons
+
+
+def _group_occurrences(image_refs: List[Dict[str, Any]]) -> List[int]:
+    """
+    Group id per image: images sharing an xref, a byte digest or a pixel hash are the same
+    picture (union-find over the three keys).
+    """
+    parent = list(range(len(image_refs)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_with_key: Dict[Tuple[str, Any], int] = {}
+    for i, image_ref in enumerate(image_refs):
+        metadata = image_ref.get("metadata", {})
+        for key_name in ("xref", "image_digest", "pixel_hash"):
+            value = metadata.get(key_name)
+            if value is None:
+                continue
+            first = first_with_key.setdefault((key_name, value), i)
+            parent[find(i)] = find(first)
+    return [find(i) for i in range(len(image_refs))]
+
+
+def image_occurrence(image_ref: Dict[str, Any]) -> Dict[str, Any]:
+    """The page and identity keys of an image_ref, as listed in document_images (see filter_images)."""
+    metadata = image_ref.get("metadata", {})
+    return {key: metadata.get(key) for key in ("page_number", "xref", "image_digest", "pixel_hash")}
+
+
+def filter_images(elements: List[Dict[str, Any]], page_count: int,
+                  document_images: Optional[List[Dict[str, Any]]] = None) -> Dict[str, int]:
+    """
+    Sets the 'image_filter' decision on the image_ref elements (in place).
+
+    Args:
+        elements: Raw elements in page order.
+        page_count: Number of pages of the document (the base of REPEATED_IMAGE_PAGE_RATIO).
+        document_images: Image occurrences (see image_occurrence) on all pages of the document,
+                         when the elements are only some of its pages.
+
+    Returns:
+        Number of image_refs per action.
+    """
+    image_refs = [element for element in elements if element.get("type") == "image_ref"]
+    counts = {"analyze": 0, "reuse": 0, "skip": 0}
+    if not image_refs:
+        return counts
+
+    # Occurrences on other pages only count towards the recurrence of the image_refs' groups
+    occurrences = image_refs + [{"metadata": occurrence} for occurrence in document_images or []]
+    all_groups = _group_occurrences(occurrences)
+    groups = all_groups[:len(image_refs)]
+    group_pages: Dict[int, set] = {}
+    for group, occurrence in zip(all_groups, occurrences):
+        group_pages.setdefault(group, set()).add(occurrence["metadata"].get("page_number"))
+    repeated_min_pages = max(REPEATED_IMAGE_MIN_PAGES, REPEATED_IMAGE_PAGE_RATIO * page_count)
+
+    primaries: Dict[int, str] = {} # group -> content of the occurrence that is analyzed
+    for group, image_ref in zip(groups, image_refs):
+        metadata = image_ref["metadata"]
+        pages = len(group_pages[group])
+        reasons = _size_reasons(metadata) if IMAGE_FILTER_ENABLED else []
+        decision = {"action": "analyze", "reasons": reasons, "pages": pages}
+        if reasons:
+            decision["action"] = "skip"
+        elif IMAGE_FILTER_ENABLED:
+            repeated = pages >= repeated_min_pages
+            primary = primaries.get(group)
+            if repeated:
+                reasons.append("repeated")
+                if REPEATED_IMAGE_POLICY == "drop":
+                    decision["action"] = "skip"
+                elif primary is not None:
+                    decision.update(action="reuse" if REPEATED_IMAGE_POLICY == "reuse" else "skip", primary=primary)
+            elif primary is not None:
+                reasons.append("duplicate")
+                decision.update(action="reuse", primary=primary)
+            if decision["action"] == "analyze":
+                primaries[group] = image_ref["content"]
+        metadata["image_filter"] = decision
+        counts[decision["action"]] += 1
+    return counts
+
+
+def split_image_refs(image_refs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Splits image_refs into the ones to analyze and the ones that reuse another image's analysis.
+    Skipped images are in neither list. Image refs without a filter decision are analyzed.
+    """
+    to_analyze, to_reuse = [], []
+    for image_ref in image_refs:
+        action = image_ref.get("metadata", {}).get("image_filter", {}).get("action", "analyze")
+        if action == "analyze":
+            to_analyze.append(image_ref)
+        elif action == "reuse":
+            to_reuse.append(image_ref)
+    return to_analyze, to_reuse
+
+
+def reuse_analysis(to_reuse: List[Dict[str, Any]], results: List[Dict[str, Any]], ref_key: str) -> List[Dict[str, Any]]:
+    """
+    Copies of the analysis results (image descriptions or chart summaries, identified by ref_key)
+    for the images that reuse them, with their own name and metadata.
+    """
+    by_ref = {result[ref_key]: result for result in results}
+    copies = []
+    for image_ref in to_reuse:
+        metadata = image_ref.get("metadata", {})
+        source = by_ref.get(metadata["image_filter"].get("primary"))
+        if source is None:
+            continue
+        copies.append({**source, ref_key: image_ref["content"], "analysis_method": "reused",
+                       "metadata": {**source.get("metadata", {}), **metadata, "reused_from": source[ref_key]}})
+    return copies
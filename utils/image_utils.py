@@ -0,0 +1,174 @@
+import io
+import os
+from typing import Any, Dict, Optional
+
+import fitz # Decodes image formats Pillow cannot read (JPX, unusual colorspaces) from the PDF
+
+# Optional dependency: without Pillow images are sent to the vision model exactly as
+# extracted (full resolution, original encoding).
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    print("Pillow not available. Images are sent to the vision model unprocessed.")
+    PIL_AVAILABLE = False
+
+# Preprocessing of images before they are sent to the vision model.
+# Every image is decoded once, converted to RGB (or grayscale), downsized so that its longer
+# edge is at most VISION_IMAGE_MAX_EDGE pixels and re-encoded: flat graphics (charts, diagrams,
+# screenshots) as PNG, photos as JPEG. The original encoding is kept when it is already smaller.
+# --- Configuration (environment variables) ---
+# VISION_IMAGE_MAX_EDGE: longer edge in pixels sent to the model (0 disables downsizing).
+# VISION_IMAGE_FORMAT: "auto", "png" or "jpeg".
+# VISION_JPEG_QUALITY: JPEG quality for re-encoded photos.
+VISION_IMAGE_MAX_EDGE = int(os.getenv("VISION_IMAGE_MAX_EDGE", 1024))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "auto").lower()
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", 85))
+FLAT_IMAGE_MAX_COLORS = 256 # Images with at most this many distinct colors are encoded as PNG
+SENDABLE_FORMATS = {"PNG": "image/png", "JPEG": "image/jpeg"} # Original encodings the model can take as they are
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "gif": "image/gif",
+              "bmp": "image/bmp", "tiff": "image/tiff", "jpx": "image/jp2", "jp2": "image/jp2"}
+
+
+def _decode_with_fitz(doc, xref: int) -> "Image.Image":
+    """Decodes a PDF image with MuPDF (handles JPX, CMYK, ICC and indexed colorspaces)."""
+    pix = fitz.Pixmap(doc, xref)
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    mode = "RGBA" if pix.alpha else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def decode_image(image_bytes: bytes, doc=None, xref: Optional[int] = None) -> Optional["Image.Image"]:
+    """Decodes the image with Pillow, falling back to MuPDF if doc and xref are given. None if both fail."""
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+        return image
+    except Exception as e:
+        if doc is None or not xref:
+            print(f"    Could not decode image: {e}")
+            return None
+    try:
+        return _decode_with_fitz(doc, xref)
+    except Exception as e:
+        print(f"    Could not decode image xref {xref}: {e}")
+        return None
+
+
+def _to_rgb(image: "Image.Image") -> "Image.Image":
+    """RGB (or L for grayscale) image; transparency is flattened onto a white background."""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode == "1":
+        return image.convert("L")
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB") # CMYK, YCbCr, LAB, P, ...
+
+
+def _encode(image: "Image.Image", image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _target_format(image: "Image.Image") -> str:
+    if VISION_IMAGE_FORMAT in ("png", "jpeg"):
+        return VISION_IMAGE_FORMAT.upper()
+    # Few colors: charts, diagrams, text. PNG keeps them sharp and small; JPEG suits photos.
+    return "PNG" if image.getcolors(FLAT_IMAGE_MAX_COLORS) is not None else "JPEG"
+
+
+def prepare_image_for_vision(image_bytes: bytes, ext: Optional[str] = None,
+                             doc=None, xref: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Decodes, converts and downsizes an extracted image for the vision model.
+
+    Args:
+        image_bytes: The bytes returned by fitz's extract_image.
+        ext: Their format as reported by extract_image (used when Pillow is unavailable).
+        doc, xref: The PDF and image xref, to decode images Pillow cannot read with MuPDF.
+
+    Returns:
+        {"data": bytes to send, "mime_type": their MIME type,
+         "image": the decoded, converted and downsized Pillow image (None if not decoded;
+                  reuse it instead of decoding the bytes again),
+         "original_size": (width, height) of the original image or None,
+         "metadata": original/sent dimensions, byte counts and formats}
+    """
+    image = decode_image(image_bytes, doc, xref)
+    if image is None:
+        # Send the bytes as extracted, with their real MIME type
+        return {"data": image_bytes, "mime_type": MIME_TYPES.get((ext or "").lower(), "image/png"),
+                "image": None, "original_size": None,
+                "metadata": {"original_format": ext, "original_bytes": len(image_bytes),
+                             "sent_format": ext, "sent_bytes": len(image_bytes), "processed": False}}
+
+    original_format = image.format or (ext or "").upper() or None
+    original_mode = image.mode
+    original_size = image.size
+    converted = _to_rgb(image)
+    if VISION_IMAGE_MAX_EDGE > 0 and max(converted.size) > VISION_IMAGE_MAX_EDGE:
+        converted.thumbnail((VISION_IMAGE_MAX_EDGE, VISION_IMAGE_MAX_EDGE), Image.LANCZOS)
+    unchanged = converted.size == original_size and original_mode in ("RGB", "L")
+
+    if unchanged and original_format == "JPEG":
+        # Re-encoding a JPEG at the same size only loses quality
+        data, sent_format = image_bytes, original_format
+    else:
+        sent_format = _target_format(converted)
+        data = _encode(converted, sent_format)
+        if unchanged and original_format in SENDABLE_FORMATS and len(image_bytes) <= len(data):
+            data, sent_format = image_bytes, original_format
+
+    return {
+        "data": data,
+        "mime_type": SENDABLE_FORMATS[sent_format],
+        "image": converted,
+        "original_size": original_size,
+        "metadata": {
+            "original_format": original_format,
+            "original_mode": original_mode,
+            "original_width": original_size[0],
+            "original_height": original_size[1],
+            "original_bytes": len(image_bytes),
+            "sent_format": sent_format,
+            "sent_width": converted.size[0],
+            "sent_height": converted.size[1],
+            "sent_bytes": len(data),
+            "processed": data is not image_bytes,
+        },
+    }
+
+
+PIXEL_HASH_SIZE = 16 # Difference hash of a 17x16 grayscale thumbnail: 256 bits
+
+
+def image_pixel_hash(image_bytes: bytes) -> Optional[str]:
+    """
+    Hash of the downsampled pixels (difference hash): the same picture embedded several times,
+    even re-encoded or at another resolution, gets the same hash. None if it cannot be decoded.
+    """
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("L", (PIXEL_HASH_SIZE * 4, PIXEL_HASH_SIZE * 4)) # JPEGs are decoded at reduced scale
+        pixels = list(image.convert("L").resize((PIXEL_HASH_SIZE + 1, PIXEL_HASH_SIZE), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(PIXEL_HASH_SIZE):
+        offset = row * (PIXEL_HASH_SIZE + 1)
+        for col in range(PIXEL_HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{PIXEL_HASH_SIZE * PIXEL_HASH_SIZE // 4}x}"
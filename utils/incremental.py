@@ -0,0 +1,114 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+# Helpers for incremental reprocessing of revised PDFs.
+# Pages are matched by content fingerprint (see agents/parser.py), so a page whose
+# content is unchanged is reused even if an insertion/deletion moved it.
+
+
+def page_manifest_path(output_path: str) -> str:
+    """Sidecar file holding the page fingerprints of an output (output/doc.json -> output/doc.pages.json)."""
+    return os.path.splitext(output_path)[0] + ".pages.json"
+
+
+def plan_incremental_update(previous_fingerprints: Dict[str, str],
+                            current_fingerprints: Dict[str, str]) -> Tuple[Dict[int, int], List[int]]:
+    """
+    Compares two fingerprint maps (1-based page number as string -> hash).
+
+    Returns:
+        reused_pages: {new page number: old page number} for pages whose content is unchanged.
+        changed_pages: 1-based page numbers of the new revision that must be reprocessed.
+    """
+    # Old pages by fingerprint. Duplicate pages (e.g. blank pages) are consumed in order.
+    old_pages_by_fingerprint: Dict[str, List[int]] = {}
+    for page, fingerprint in sorted(previous_fingerprints.items(), key=lambda item: int(item[0])):
+        old_pages_by_fingerprint.setdefault(fingerprint, []).append(int(page))
+
+    reused_pages = {}
+    changed_pages = []
+    for page, fingerprint in sorted(current_fingerprints.items(), key=lambda item: int(item[0])):
+        candidates = old_pages_by_fingerprint.get(fingerprint)
+        if candidates:
+            # Prefer the same position if it is among the candidates
+            old_page = int(page) if int(page) in candidates else candidates[0]
+            candidates.remove(old_page)
+            reused_pages[int(page)] = old_page
+        else:
+            changed_pages.append(int(page))
+    return reused_pages, changed_pages
+
+
+def _chunk_pages(chunk: Dict[str, Any]) -> List[int]:
+    metadata = chunk.get("metadata") or {}
+    pages = metadata.get("pages") or metadata.get("page_numbers") or [metadata.get("page_number")]
+    return [page for page in pages if page is not None]
+
+
+def expand_changed_pages(previous_chunks: List[Dict[str, Any]], reused_pages: Dict[int, int],
+                         changed_pages: List[int]) -> Tuple[Dict[int, int], List[int]]:
+    """
+    Moves pages from reused to changed until no previous chunk mixes reused and reprocessed pages.
+    A previous chunk spanning a changed page is dropped by splice_chunks, so the other pages it
+    covers must be reprocessed too, or their part of the chunk would be lost. Repeats until
+    nothing changes, since every page moved can drop further chunks.
+
+    Returns:
+        The updated (reused_pages, changed_pages).
+    """
+    reused_pages = dict(reused_pages)
+    changed = set(changed_pages)
+    new_page_of = {old_page: new_page for new_page, old_page in reused_pages.items()}
+    chunk_pages = [set(_chunk_pages(chunk)) for chunk in previous_chunks]
+    grown = True
+    while grown:
+        grown = False
+        for pages in chunk_pages:
+            reused = {page for page in pages if page in new_page_of}
+            if reused and reused != pages: # Also covers a page that is reprocessed (or gone)
+                for old_page in reused:
+                    new_page = new_page_of.pop(old_page)
+                    del reused_pages[new_page]
+                    changed.add(new_page)
+                grown = True
+    return reused_pages, sorted(changed)
+
+
+def splice_chunks(previous_chunks: List[Dict[str, Any]], new_chunks: List[Dict[str, Any]],
+                  reused_pages: Dict[int, int]) -> List[Dict[str, Any]]:
+    """
+    Builds the output of the new revision: previous chunks of reused pages (with their
+    page numbers moved to the new positions) plus the freshly generated chunks of the
+    changed pages, ordered by page and renumbered with a contiguous 'chunk_index'.
+    Previous chunks touching any page that is not reused are dropped.
+    """
+    old_to_new_page = {old_page: new_page for new_page, old_page in reused_pages.items()}
+    spliced = []
+
+    for order, chunk in enumerate(previous_chunks):
+        pages = _chunk_pages(chunk)
+        if not pages or not all(page in old_to_new_page for page in pages):
+            continue
+        metadata = dict(chunk.get("metadata") or {})
+        metadata["page_number"] = old_to_new_page[pages[0]]
+        if "pages" in metadata:
+            metadata["pages"] = [old_to_new_page[page] for page in pages]
+        if metadata.get("page_numbers"): # Text work units (agents/text_processor.py)
+            metadata["page_numbers"] = [old_to_new_page[page] for page in metadata["page_numbers"]]
+            metadata["page_start"], metadata["page_end"] = metadata["page_numbers"][0], metadata["page_numbers"][-1]
+        if "provenance" in metadata:
+            metadata["provenance"] = [{**entry, "page_number": old_to_new_page.get(entry.get("page_number"), entry.get("page_number"))}
+                                      for entry in metadata["provenance"]]
+        spliced.append(((metadata["page_number"], 0, order), {**chunk, "metadata": metadata}))
+
+    for order, chunk in enumerate(new_chunks):
+        pages = _chunk_pages(chunk)
+        page = pages[0] if pages else float("inf")
+        spliced.append(((page, 1, order), chunk))
+
+    spliced.sort(key=lambda item: item[0])
+    result = []
+    for chunk_index, (_, chunk) in enumerate(spliced):
+        chunk.setdefault("metadata", {})["chunk_index"] = chunk_index
+        result.append(chunk)
+    return result
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+from utils.metrics import current_agent_metrics, llm_callbacks
+from utils.llm_provider import llm_backend
+
+# --- Configuration (environment variables) ---
+# LLM_CACHE_ENABLED: "false"/"0" disables the cache entirely.
+# LLM_CACHE_PATH: SQLite file that stores the responses.
+# LLM_CACHE_MAX_ENTRIES / LLM_CACHE_MAX_SIZE_MB / LLM_CACHE_MAX_AGE_DAYS: eviction limits.
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 200_000
+DEFAULT_MAX_SIZE_MB = 1024
+DEFAULT_MAX_AGE_DAYS = 30
+EVICTION_INTERVAL = 500 # Run eviction every N writes (it is also run when the cache is opened)
+# Bump when the key recipe changes: entries of an older schema can never be hit again and are
+# dropped when the cache is opened. 2: the LLM backend is part of the key.
+CACHE_SCHEMA_VERSION = 2
+
+
+def _sha256(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def prompt_fingerprint(prompt: Any) -> str:
+    """
+    Hash of a prompt template. Editing a prompt changes the hash, so stale answers are never reused.
+    Plain strings are hashed as-is; LangChain templates are hashed through their (deterministic) repr.
+    """
+    return _sha256(prompt if isinstance(prompt, str) else repr(prompt))
+
+
+def input_fingerprint(inputs: Any) -> str:
+    """Hash of the chain inputs (a dict of prompt variables or a single string, e.g. a base64 image)."""
+    if isinstance(inputs, str):
+        return _sha256(inputs)
+    return _sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str))
+
+
+class LLMCache:
+    """
+    Content-addressed, on-disk cache of LLM responses backed by SQLite.
+
+    Entries are keyed by (LLM backend, model name, prompt template hash, language, input hash):
+    the fake backend's answers are never served as answers of the real model of the same name.
+    Old entries are evicted by age, and least recently used entries are evicted
+    when the entry count or the total stored size exceeds the limits.
+    Safe to share between threads; every process opens its own connection.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_size_mb: float = DEFAULT_MAX_SIZE_MB, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets several batch worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " hit_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        schema_version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version != CACHE_SCHEMA_VERSION:
+            removed = self._conn.execute("DELETE FROM llm_cache").rowcount
+            self._conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+            if removed:
+                print(f"LLM cache: dropped {removed} entries of cache schema {schema_version}.")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: Optional[str], prompt: Any, language: Optional[str], inputs: Any,
+                 backend: Optional[str] = None) -> str:
+        """Builds the cache key from the backend, model, prompt template, language and input."""
+        parts = [f"v{CACHE_SCHEMA_VERSION}", str(backend), str(model), prompt_fingerprint(prompt), str(language),
+                 input_fingerprint(inputs)]
+        return _sha256("\x1f".join(parts))
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response for key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, response: str, model: Optional[str] = None):
+        """Stores a response. Non-string responses are not cached."""
+        if not isinstance(response, str):
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, last_access, hit_count)"
+                " VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, model, response, len(response.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self.writes += 1
+            run_eviction = self.writes % EVICTION_INTERVAL == 0
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones until the count/size limits hold."""
+        with self._lock:
+            removed = 0
+            if self.max_age_seconds > 0:
+                cursor = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?",
+                                            (time.time() - self.max_age_seconds,))
+                removed += cursor.rowcount
+
+            count, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            if self.max_entries > 0 and count > self.max_entries:
+                cursor = self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                removed += cursor.rowcount
+                total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+            if self.max_size_bytes > 0 and total_size > self.max_size_bytes:
+                # Walk from the least recently used entry until enough bytes are freed
+                excess = total_size - self.max_size_bytes
+                stale_keys = []
+                for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC"):
+                    stale_keys.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale_keys)
+                removed += len(stale_keys)
+
+            self._conn.commit()
+            self.evictions += removed
+        if removed:
+            print(f"LLM cache: evicted {removed} entries.")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of this process plus the current size of the cache."""
+        with self._lock:
+            count, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": count,
+            "size_bytes": total_size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Process-wide cache instance ---
+_cache: Optional[LLMCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Returns the cache of the current process (created on first use), or None if disabled.
+    A new connection is opened after a fork, since SQLite connections must not be shared between processes.
+    """
+    global _cache, _cache_pid
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("0", "false", "no", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            try:
+                _cache = LLMCache(
+                    path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                    max_size_mb=float(os.getenv("LLM_CACHE_MAX_SIZE_MB", DEFAULT_MAX_SIZE_MB)),
+                    max_age_days=float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)),
+                )
+                _cache_pid = os.getpid()
+            except Exception as e:
+                print(f"Could not open LLM cache: {e}. Running without cache.")
+                return None
+        return _cache
+
+
+def _lookup(cache: LLMCache, key: str) -> Optional[str]:
+    try:
+        return cache.get(key)
+    except sqlite3.Error as e:
+        print(f"    LLM cache lookup failed: {e}")
+        return None
+
+
+def _record_cache_hit():
+    metrics = current_agent_metrics()
+    if metrics is not None:
+        metrics.add(llm_cache_hits=1)
+
+
+def _store(cache: LLMCache, key: str, response: Any, model: Optional[str]):
+    try:
+        cache.set(key, response, model=model)
+    except sqlite3.Error as e:
+        print(f"    LLM cache write failed: {e}")
+
+
+def cached_invoke(chain: Any, inputs: Any, model: Optional[str], prompt: Any, language: Optional[str] = None) -> Any:
+    """
+    Invokes a LangChain runnable through the LLM cache.
+
+    Args:
+        chain: The runnable to invoke on a miss (e.g. prompt | llm | StrOutputParser()).
+        inputs: The chain input (dict of prompt variables, or a single string).
+        model: Model name, part of the cache key (with the configured LLM_BACKEND).
+        prompt: The prompt template (or its text), part of the cache key.
+        language: Language the answer is requested in, part of the cache key.
+
+    Returns:
+        The cached or freshly generated response. Failed calls raise and are not cached.
+        Calls and cache hits are counted in the metrics of the running agent (utils/metrics.py).
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return chain.invoke(inputs, config=llm_callbacks())
+
+    backend = llm_backend()
+    key = LLMCache.make_key(model, prompt, language, inputs, backend)
+    cached_response = _lookup(cache, key)
+    if cached_response is not None:
+        _record_cache_hit()
+        return cached_response
+
+    response = chain.invoke(inputs, config=llm_callbacks())
+    _store(cache, key, response, f"{backend}:{model}")
+    return response
+
+
+async def acached_invoke(chain: Any, inputs: Any, model: Optional[str], prompt: Any, language: Optional[str] = None) -> Any:
+    """Async version of cached_invoke (uses chain.ainvoke on a miss)."""
+    cache = get_llm_cache()
+    if cache is None:
+        return await chain.ainvoke(inputs, config=llm_callbacks())
+
+    backend = llm_backend()
+    key = LLMCache.make_key(model, prompt, language, inputs, backend)
+    cached_response = _lookup(cache, key)
+    if cached_response is not None:
+        _record_cache_hit()
+        return cached_response
+
+    response = await chain.ainvoke(inputs, config=llm_callbacks())
+    _store(cache, key, response, f"{backend}:{model}")
+    return response
@@ -0,0 +1,93 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Single place where the agents get their chat models and embeddings.
+# LLM_BACKEND selects the implementation:
+#   "ollama" (default): langchain_ollama.ChatOllama / OllamaEmbeddings
+#   "fake": deterministic local stand-ins with configurable latency (utils/fake_llm.py),
+#           used by the benchmarks and for running the pipeline without an Ollama server.
+# The backend is read when a model is created, i.e. on first use (see lazy_resource).
+
+
+def llm_backend() -> str:
+    return os.getenv("LLM_BACKEND", "ollama").strip().lower()
+
+
+def get_chat_model(model: Optional[str], temperature: float = 0, **kwargs):
+    """
+    Returns a chat model for the configured backend.
+    Extra keyword arguments (e.g. format="json") are passed to ChatOllama.
+    Raises ImportError if the backend's package is not installed.
+    """
+    if llm_backend() == "fake":
+        from utils.fake_llm import FakeChatModel
+        return FakeChatModel(model=model or "fake-chat", response_format=kwargs.get("format"))
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=model, temperature=temperature, **kwargs)
+
+
+def get_embeddings(model: Optional[str]):
+    """Returns an embeddings model for the configured backend."""
+    if llm_backend() == "fake":
+        from utils.fake_llm import FakeEmbeddings
+        return FakeEmbeddings(model=model or "fake-embeddings")
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=model)
+
+
+# --- Lazy resource registry ---
+# Clients, chains and splitters are registered by the agent modules at import time but only
+# built on first use, so importing the agents (and the CLI start-up) stays cheap and
+# disabled agents, or agents with nothing to do, never pay for their backend.
+_resources: Dict[str, "LazyResource"] = {}
+_registry_lock = threading.RLock() # Re-entrant: a factory may use other lazy resources
+
+
+class LazyResource:
+    """A named resource built by its factory on the first get() (thread-safe, built once per process)."""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.built = False
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.init_seconds: Optional[float] = None
+
+    def get(self) -> Any:
+        """
+        Returns the resource, building it on the first call.
+        If the factory fails, the error is printed and None is returned (also on later calls),
+        so callers fall back the same way they did when initialization failed at import time.
+        """
+        if self.built:
+            return self.value
+        with _registry_lock:
+            if not self.built:
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e: # ImportError included: optional backends may be missing
+                    print(f"Failed to initialize {self.name}: {e}")
+                    self.value, self.error = None, str(e)
+                self.init_seconds = round(time.perf_counter() - start, 4)
+                self.built = True
+        return self.value
+
+
+def lazy_resource(name: str, factory: Callable[[], Any]) -> LazyResource:
+    """Registers a lazily built resource under a unique name (e.g. 'table_analyzer.chain')."""
+    with _registry_lock:
+        if name not in _resources:
+            _resources[name] = LazyResource(name, factory)
+        return _resources[name]
+
+
+def resource_init_report() -> Dict[str, Dict[str, Any]]:
+    """Init time (seconds) and status of every registered resource; unused resources show built=False."""
+    return {name: {"built": resource.built, "init_seconds": resource.init_seconds,
+                   "error": resource.error}
+            for name, resource in sorted(_resources.items())}
+
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:
+    BaseCallbackHandler = object
+
+# Per-agent performance metrics.
+# graph_definition.wrap_agent opens an AgentMetrics record around every agent call.
+# LLM calls made while it is active (through utils.llm_cache.cached_invoke) add their
+# counts, token usage and request sizes to it via LLMUsageCallback; the embedding cache
+# (utils/embedding_cache.py) adds its requests and hits.
+# Note: with parallel analysis agents the process-wide numbers (peak RSS, child CPU time)
+# of overlapping agents cannot be separated; wall time, thread CPU time and LLM counters can.
+
+ELEMENT_KEYS = ("raw_elements", "processed_text_chunks", "image_descriptions", "chart_summaries",
+                "table_data", "synthesized_content", "final_chunks")
+LLM_COUNTERS = ("llm_calls", "llm_cache_hits", "prompt_tokens", "completion_tokens", "bytes_sent",
+                "embedding_requests", "embedded_texts", "embedding_cache_hits")
+
+_current_metrics: contextvars.ContextVar[Optional["AgentMetrics"]] = contextvars.ContextVar("agent_metrics", default=None)
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def _children_cpu_seconds() -> float:
+    # CPU time of finished child processes (e.g. the parser's page-parallel pool)
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def count_elements(values: Dict[str, Any]) -> Dict[str, int]:
+    """Lengths of the element lists (raw elements, analysis outputs, chunks) found in a state or state update."""
+    return {key: len(values[key]) for key in ELEMENT_KEYS if isinstance(values.get(key), list) and values[key]}
+
+
+class AgentMetrics:
+    """Measures one agent call. Use as a context manager; the finished record is in .record."""
+
+    def __init__(self, agent_name: str, state: Dict[str, Any]):
+        self.agent_name = agent_name
+        self.input_elements = count_elements(state)
+        self.counters = {name: 0 for name in LLM_COUNTERS}
+        self.record: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, **counts: int):
+        """Adds to the LLM counters (thread-safe; concurrent LLM calls of one agent share the record)."""
+        with self._lock:
+            for name, value in counts.items():
+                self.counters[name] += value or 0
+
+    def __enter__(self):
+        self._token = _current_metrics.set(self)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._children_cpu_start = _children_cpu_seconds()
+        self._peak_rss_start = _peak_rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_metrics.reset(self._token)
+        peak_rss_end = _peak_rss_mb()
+        self.record = {
+            "agent": self.agent_name,
+            "wall_seconds": round(time.perf_counter() - self._wall_start, 4),
+            "cpu_seconds": round(time.thread_time() - self._cpu_start
+                                 + _children_cpu_seconds() - self._children_cpu_start, 4),
+            "peak_rss_delta_mb": round(peak_rss_end - self._peak_rss_start, 2) if peak_rss_end is not None else None,
+            "input_elements": self.input_elements,
+            **self.counters,
+        }
+        return False
+
+    def finish(self, update: Dict[str, Any], status: str) -> Dict[str, Any]:
+        """Completes the record with the output element counts and the agent status."""
+        self.record.update(output_elements=count_elements(update), status=status)
+        return self.record
+
+
+def current_agent_metrics() -> Optional[AgentMetrics]:
+    """The metrics record of the agent running in this context, if any."""
+    return _current_metrics.get()
+
+
+def _message_size(message: Any) -> int:
+    content = getattr(message, "content", message)
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, default=str)
+    return len(content.encode("utf-8"))
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """LangChain callback that adds request sizes and token usage of LLM calls to an AgentMetrics record."""
+    run_inline = True # Called in the caller's thread/loop, also for async chains
+
+    def __init__(self, metrics: AgentMetrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        # Base64 images are part of the message content, so they are included in bytes_sent
+        self.metrics.add(llm_calls=1, bytes_sent=sum(_message_size(m) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.metrics.add(llm_calls=1, bytes_sent=sum(len(p.encode("utf-8")) for p in prompts))
+
+    def on_llm_end(self, response, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                info = generation.generation_info or {}
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                else: # Raw Ollama counters
+                    prompt_tokens += info.get("prompt_eval_count") or 0
+                    completion_tokens += info.get("eval_count") or 0
+        self.metrics.add(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def llm_callbacks() -> Dict[str, Any]:
+    """Runnable config that records the next LLM call in the current agent's metrics ({} outside an agent)."""
+    metrics = current_agent_metrics()
+    if metrics is None or BaseCallbackHandler is object:
+        return {}
+    return {"callbacks": [LLMUsageCallback(metrics)]}
+
+
+def summarize_agent_metrics(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sums the records per agent (a streamed document has one record per agent and window), in first-run order."""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        total = totals.setdefault(record["agent"], {"agent": record["agent"], "runs": 0, "errors": 0,
+                                                    "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                    "peak_rss_delta_mb": None,
+                                                    **{name: 0 for name in LLM_COUNTERS}})
+        total["runs"] += 1
+        total["errors"] += record.get("status") == "error"
+        total["wall_seconds"] = round(total["wall_seconds"] + record["wall_seconds"], 4)
+        total["cpu_seconds"] = round(total["cpu_seconds"] + record["cpu_seconds"], 4)
+        if record.get("peak_rss_delta_mb") is not None:
+            total["peak_rss_delta_mb"] = max(total["peak_rss_delta_mb"] or 0.0, record["peak_rss_delta_mb"])
+        for name in LLM_COUNTERS:
+            total[name] += record.get(name, 0)
+    return list(totals.values())
+
+
+def summarize_page_stats(page_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals of the parser's per-page stats (table detection checks, headers/footers found, time spent)."""
+    checks: Dict[str, int] = {}
+    for stats in page_stats.values():
+        checks[stats["table_check"]] = checks.get(stats["table_check"], 0) + 1
+    return {
+        "pages": len(page_stats),
+        "checks": checks,
+        "tables": sum(stats.get("tables", 0) for stats in page_stats.values()),
+        "headers_footers": sum(stats.get("headers_footers", 0) for stats in page_stats.values()),
+        "precheck_seconds": round(sum(stats.get("precheck_seconds", 0.0) for stats in page_stats.values()), 4),
+        "find_tables_seconds": round(sum(stats.get("find_tables_seconds", 0.0) for stats in page_stats.values()), 4),
+        "parse_seconds": round(sum(stats.get("seconds", 0.0) for stats in page_stats.values()), 4),
+    }
+
+
+def metrics_path_for(output_path: str) -> str:
+    """Metrics file written next to an output (output/doc.json -> output/doc.metrics.json)."""
+    return os.path.splitext(output_path)[0] + ".metrics.json"
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+PROMETHEUS_METRICS = {
+    "wall_seconds": ("poly_parser_agent_wall_seconds", "Wall-clock time spent in the agent."),
+    "cpu_seconds": ("poly_parser_agent_cpu_seconds", "CPU time of the agent thread and its finished child processes."),
+    "peak_rss_delta_mb": ("poly_parser_agent_peak_rss_delta_megabytes", "Growth of the process peak RSS during the agent."),
+    "runs": ("poly_parser_agent_runs", "Number of agent runs (one per streaming window)."),
+    "errors": ("poly_parser_agent_errors", "Number of failed agent runs."),
+    "llm_calls": ("poly_parser_agent_llm_calls", "LLM requests sent to Ollama."),
+    "llm_cache_hits": ("poly_parser_agent_llm_cache_hits", "LLM requests answered from the LLM cache."),
+    "prompt_tokens": ("poly_parser_agent_prompt_tokens", "Prompt tokens reported by the model."),
+    "completion_tokens": ("poly_parser_agent_completion_tokens", "Completion tokens reported by the model."),
+    "bytes_sent": ("poly_parser_agent_bytes_sent", "Bytes of prompt content (including base64 images) sent to the model."),
+    "embedding_requests": ("poly_parser_agent_embedding_requests", "Embedding requests sent to the model."),
+    "embedded_texts": ("poly_parser_agent_embedded_texts", "Texts embedded by the model (embedding cache misses)."),
+    "embedding_cache_hits": ("poly_parser_agent_embedding_cache_hits", "Texts answered from the embedding cache."),
+}
+
+
+def write_prometheus_metrics(documents: List[Dict[str, Any]], output_path: str):
+    """
+    Writes per-agent totals in the Prometheus text exposition format
+    (e.g. for the node_exporter textfile collector).
+
+    Args:
+        documents: Dicts with 'pdf_path' and 'agents' (the output of summarize_agent_metrics).
+        output_path: The .prom file to write (written atomically via a temp file).
+    """
+    lines = []
+    for key, (metric_name, help_text) in PROMETHEUS_METRICS.items():
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} gauge")
+        for document in documents:
+            for agent in document.get("agents") or []:
+                if agent.get(key) is None:
+                    continue
+                labels = f'document="{_escape_label(os.path.basename(document["pdf_path"]))}",agent="{_escape_label(agent["agent"])}"'
+                lines.append(f"{metric_name}{{{labels}}} {agent[key]}")
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, output_path)
+    print(f"Prometheus metrics written to {output_path}")
@@ -0,0 +1,205 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Optional dependency: without NumPy the native semantic chunker is unavailable and the
+# chunker falls back to recursive splitting.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    print("NumPy not available. Native semantic chunking disabled.")
+    NUMPY_AVAILABLE = False
+
+# Document-level semantic chunking.
+# Instead of one SemanticChunker call per element, all sentences of the synthesized content
+# are embedded in a single (cached, batched) embed_documents call, the cosine distances of
+# adjacent sentences are computed as one NumPy array and breakpoints are picked against a
+# threshold over the whole document. Related text can therefore be merged across elements
+# and pages, while element-type changes and atomic elements (tables) are always breakpoints.
+
+SENTENCE_SPLIT_PATTERN = r"(?<=[.?!])\s+" # Same sentence splitting as langchain's SemanticChunker
+BUFFER_SIZE = 1 # Neighbouring sentences on each side embedded together with a sentence
+ATOMIC_ELEMENT_TYPES = ("table_processed",) # Never split into sentences nor merged with other elements
+THRESHOLD_TYPES = ("percentile", "standard_deviation", "interquartile")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in re.split(SENTENCE_SPLIT_PATTERN, text) if sentence.strip()]
+
+
+def build_units(elements: Sequence[Tuple[str, str, Dict[str, Any]]], max_length: int,
+                split_oversized: Callable[[str], List[str]],
+                length_function: Callable[[str], int] = len) -> List[Dict[str, Any]]:
+    """
+    Turns (element_type, content, metadata) elements into the units chunks are built from:
+    one unit per sentence, or per atomic element. Units longer than max_length are cut with
+    split_oversized. Every unit keeps the index, page and bbox of its element, and its length.
+    """
+    units = []
+    for element_index, (element_type, content, metadata) in enumerate(elements):
+        atomic = element_type in ATOMIC_ELEMENT_TYPES
+        for piece in ([content.strip()] if atomic else split_sentences(content)):
+            for text in (split_oversized(piece) if length_function(piece) > max_length else [piece]):
+                text = text.strip()
+                units.append({
+                    "text": text,
+                    "length": length_function(text) if text else 0,
+                    "element_index": element_index,
+                    "element_type": element_type,
+                    "atomic": atomic,
+                    "page_number": metadata.get("page_number"),
+                    "bbox": metadata.get("bbox"),
+                })
+    return [unit for unit in units if unit["text"]]
+
+
+def hard_boundaries(units: List[Dict[str, Any]]) -> "np.ndarray":
+    """Boolean array: True between units i and i+1 where a chunk must end (type change, atomic element)."""
+    types = np.array([unit["element_type"] for unit in units], dtype=object)
+    atomic = np.array([unit["atomic"] for unit in units], dtype=bool)
+    elements = np.array([unit["element_index"] for unit in units])
+    type_change = types[1:] != types[:-1]
+    # Pieces of one oversized atomic element stay adjacent; separate atomic elements never merge
+    atomic_edge = (atomic[1:] | atomic[:-1]) & (elements[1:] != elements[:-1])
+    return type_change | atomic_edge
+
+
+def sentence_windows(units: List[Dict[str, Any]], boundaries: "np.ndarray", buffer_size: int = BUFFER_SIZE) -> List[Optional[str]]:
+    """
+    The text embedded for every unit: the unit with buffer_size neighbours on each side, limited
+    to its run (the units between two hard boundaries). Units alone in their run are not
+    compared with anything and get None.
+    """
+    run_ids = np.concatenate(([0], np.cumsum(boundaries)))
+    windows: List[Optional[str]] = []
+    for i, unit in enumerate(units):
+        start, end = i, i
+        while start > 0 and i - start < buffer_size and run_ids[start - 1] == run_ids[i]:
+            start -= 1
+        while end < len(units) - 1 and end - i < buffer_size and run_ids[end + 1] == run_ids[i]:
+            end += 1
+        alone = (i == 0 or run_ids[i - 1] != run_ids[i]) and (i == len(units) - 1 or run_ids[i + 1] != run_ids[i])
+        windows.append(None if alone else " ".join(u["text"] for u in units[start:end + 1]))
+    return windows
+
+
+def adjacent_distances(vectors: "np.ndarray") -> "np.ndarray":
+    """Cosine distance between each row and the next (length n - 1)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit_vectors = vectors / np.where(norms == 0, 1.0, norms)
+    return 1.0 - np.einsum("ij,ij->i", unit_vectors[:-1], unit_vectors[1:])
+
+
+def breakpoint_threshold(distances: "np.ndarray", threshold_type: str, amount: float) -> float:
+    """
+    Distance above which adjacent sentences are split, computed over the whole document.
+    percentile: amount is a percentile; values <= 1 are read as a fraction (0.85 -> 85th percentile).
+    standard_deviation / interquartile: mean + amount * std / IQR.
+    """
+    if distances.size == 0:
+        return float("inf")
+    if threshold_type == "percentile":
+        return float(np.percentile(distances, amount * 100 if amount <= 1 else amount))
+    if threshold_type == "standard_deviation":
+        return float(np.mean(distances) + amount * np.std(distances))
+    if threshold_type == "interquartile":
+        q1, q3 = np.percentile(distances, [25, 75])
+        return float(np.mean(distances) + amount * (q3 - q1))
+    raise ValueError(f"Unknown threshold type '{threshold_type}'. Use one of: {', '.join(THRESHOLD_TYPES)}")
+
+
+def _provenance(chunk_units: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Joins the units of a chunk and records, per element, where its sentences are in the chunk text."""
+    parts, provenance, offset = [], [], 0
+    for unit in chunk_units:
+        same_element = provenance and provenance[-1]["element_index"] == unit["element_index"]
+        separator = "" if not parts else (" " if same_element else "\n\n")
+        offset += len(separator)
+        parts.append(separator + unit["text"])
+        if same_element:
+            provenance[-1]["sentences"] += 1
+            provenance[-1]["char_end"] = offset + len(unit["text"])
+        else:
+            provenance.append({"element_index": unit["element_index"], "page_number": unit["page_number"],
+                               "bbox": unit["bbox"], "sentences": 1,
+                               "char_start": offset, "char_end": offset + len(unit["text"])})
+        offset += len(unit["text"])
+    return "".join(parts), provenance
+
+
+def pool_vectors(vectors: "np.ndarray") -> "np.ndarray":
+    """L2-normalized mean of the rows: one vector standing for a whole chunk."""
+    pooled = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    norm = np.linalg.norm(pooled)
+    return pooled / norm if norm > 0 else pooled
+
+
+def chunk_document(elements: Sequence[Tuple[str, str, Dict[str, Any]]], embeddings,
+                   split_oversized: Callable[[str], List[str]],
+                   max_length: int, min_length: int = 0,
+                   length_function: Callable[[str], int] = len,
+                   threshold_type: str = "percentile", threshold_amount: float = 0.85,
+                   buffer_size: int = BUFFER_SIZE, return_vectors: bool = False) -> List[Dict[str, Any]]:
+    """
+    Chunks a whole document at once.
+
+    Args:
+        elements: (element_type, content, metadata) in reading order.
+        embeddings: A LangChain Embeddings model (ideally wrapped with the embedding cache).
+        split_oversized: Splits a single sentence or atomic element longer than max_length.
+        max_length: A chunk never grows beyond this length (unless a single unit is longer).
+        min_length: Semantic breakpoints are ignored until a chunk has at least this length.
+        length_function: Measures texts (characters by default; e.g. a token counter).
+        threshold_type, threshold_amount: See breakpoint_threshold.
+        buffer_size: Neighbouring sentences embedded with each sentence.
+        return_vectors: Also return a pooled embedding per chunk (see pool_vectors). Units that
+                        need no distance (alone in their run) are then embedded too.
+
+    Returns:
+        One dict per chunk: 'content', 'element_indices' and 'provenance' (per source element:
+        page_number, bbox, number of sentences and their char_start/char_end in 'content'),
+        plus 'vector' (float32 array) if return_vectors is set.
+    """
+    units = build_units(elements, max_length, split_oversized, length_function)
+    if not units:
+        return []
+
+    boundaries = hard_boundaries(units)
+    windows = sentence_windows(units, boundaries, buffer_size)
+    if return_vectors:
+        windows = [window if window is not None else unit["text"] for window, unit in zip(windows, units)]
+    embedded = [i for i, window in enumerate(windows) if window is not None]
+    distances = np.zeros(len(units) - 1)
+    vectors = None
+    if embedded:
+        # One embedding call for the whole document; the cache deduplicates and batches it
+        embedded_vectors = np.asarray(embeddings.embed_documents([windows[i] for i in embedded]), dtype=np.float32)
+        vectors = np.zeros((len(units), embedded_vectors.shape[1]), dtype=np.float32)
+        vectors[embedded] = embedded_vectors
+        distances = adjacent_distances(vectors)
+    threshold = breakpoint_threshold(distances[~boundaries], threshold_type, threshold_amount)
+    semantic_breaks = distances > threshold
+
+    # Chunks as (start, end) unit index ranges
+    separator_length = length_function("\n\n")
+    ranges, start, current_length = [], 0, units[0]["length"]
+    for i in range(1, len(units)):
+        too_long = current_length + separator_length + units[i]["length"] > max_length
+        if boundaries[i - 1] or too_long or (semantic_breaks[i - 1] and current_length >= min_length):
+            ranges.append((start, i))
+            start, current_length = i, units[i]["length"]
+        else:
+            current_length += separator_length + units[i]["length"]
+    ranges.append((start, len(units)))
+
+    results = []
+    for start, end in ranges:
+        chunk_units = units[start:end]
+        content, provenance = _provenance(chunk_units)
+        result = {"content": content,
+                  "element_indices": sorted({unit["element_index"] for unit in chunk_units}),
+                  "provenance": provenance}
+        if return_vectors:
+            result["vector"] = pool_vectors(vectors[start:end])
+        results.append(result)
+    return results
@@ -0,0 +1,81 @@
+import os
+import functools
+from typing import Callable, Optional, Tuple
+
+from utils.llm_provider import lazy_resource
+
+# Token counting for chunk sizing.
+# Loads, in this order:
+#   1. a HuggingFace `tokenizers` tokenizer from a local file: CHUNK_TOKENIZER is the path of a
+#      tokenizer.json, or of a directory holding one. Default: the tokenizer of the embedding
+#      model (bge-m3) under .cache/tokenizers, so chunk sizes match what the embedding model sees.
+#      Nothing is downloaded unless CHUNK_TOKENIZER_HUB_ID names a hub model (e.g. BAAI/bge-m3):
+#      then a missing local file is fetched once from the HuggingFace hub and saved to that path.
+#   2. tiktoken's CHUNK_TIKTOKEN_ENCODING, as an approximation (offline runs need its encoding
+#      file in the local tiktoken cache, see TIKTOKEN_CACHE_DIR).
+# Without either, chunk sizes stay in characters.
+DEFAULT_TOKENIZER_PATH = os.path.join(".cache", "tokenizers", "bge-m3", "tokenizer.json")
+DEFAULT_TIKTOKEN_ENCODING = "cl100k_base"
+TOKEN_COUNT_CACHE_SIZE = 65536 # Memoized texts (splitters measure the same pieces many times)
+
+
+def _tokenizer_path() -> str:
+    path = os.getenv("CHUNK_TOKENIZER", DEFAULT_TOKENIZER_PATH)
+    return os.path.join(path, "tokenizer.json") if os.path.isdir(path) else path
+
+
+def _load_hf_tokenizer(path: str):
+    """The tokenizer stored at path; downloaded there first only if CHUNK_TOKENIZER_HUB_ID opts in."""
+    from tokenizers import Tokenizer
+    if os.path.isfile(path):
+        return Tokenizer.from_file(path)
+    hub_id = os.getenv("CHUNK_TOKENIZER_HUB_ID")
+    if not hub_id:
+        raise FileNotFoundError(f"no tokenizer file at '{path}' (set CHUNK_TOKENIZER, or CHUNK_TOKENIZER_HUB_ID to download one)")
+    print(f"Downloading tokenizer '{hub_id}' from the HuggingFace hub to '{path}'...")
+    hf_tokenizer = Tokenizer.from_pretrained(hub_id)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    hf_tokenizer.save(path)
+    return hf_tokenizer
+
+
+def _load_tokenizer() -> Tuple[str, Callable[[str], int]]:
+    """Returns (tokenizer name, count function). Raises ImportError if no tokenizer can be loaded."""
+    path = _tokenizer_path()
+    try:
+        hf_tokenizer = _load_hf_tokenizer(path)
+        print(f"Loaded tokenizer '{path}'.")
+        return path, lambda text: len(hf_tokenizer.encode(text, add_special_tokens=False).ids)
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Could not load tokenizer '{path}': {e}")
+
+    encoding_name = os.getenv("CHUNK_TIKTOKEN_ENCODING", DEFAULT_TIKTOKEN_ENCODING)
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+        print(f"Using tiktoken encoding '{encoding_name}' to count tokens.")
+        return f"tiktoken:{encoding_name}", lambda text: len(encoding.encode(text, disallowed_special=()))
+    except ImportError:
+        raise ImportError("No local 'tokenizers' tokenizer, and 'tiktoken' is not installed")
+
+
+tokenizer = lazy_resource("tokenizer", _load_tokenizer)
+
+
+def tokenizer_name() -> Optional[str]:
+    """Name of the loaded tokenizer (loading it on first use), or None if none is available."""
+    loaded = tokenizer.get()
+    return loaded[0] if loaded else None
+
+
+@functools.lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def count_tokens(text: str) -> int:
+    """
+    Number of tokens in text (memoized). Falls back to the character count if no tokenizer
+    is available, so check tokenizer_name() before relying on the unit.
+    """
+    loaded = tokenizer.get()
+    return loaded[1](text) if loaded else len(text)